@@ -0,0 +1,17 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def timebot():
+    """time.py загружается по пути: имя файла совпадает со стандартным модулем time"""
+    spec = importlib.util.spec_from_file_location('timebot', os.path.join(ROOT, 'time.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['timebot'] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,26 @@
+import threading
+
+
+def make_delivery(timebot, run_id, url='http://127.0.0.1:1/', **settings):
+    settings = dict(timebot.HTTP_DELIVERY_DEFAULTS, http_url=url, **settings)
+    return timebot.HttpDelivery(settings, threading.Event(), run_id)
+
+
+def test_batch_key_depends_on_every_index(timebot):
+    delivery = make_delivery(timebot, 'run')
+    assert delivery.batch_key([3, 4, 5]) == delivery.batch_key([5, 3, 4])
+    assert delivery.batch_key([3, 4, 5]) != delivery.batch_key([3, 4])
+    assert delivery.batch_key([3, 4]) != delivery.batch_key([3, 5])
+    assert delivery.batch_key([3]) != make_delivery(timebot, 'other').batch_key([3])
+
+
+def test_server_accepts_repeated_batch_once(timebot):
+    server = timebot.MockAdminServer().start()
+    try:
+        delivery = make_delivery(timebot, 'run', url=server.url, http_batch_size=2)
+        for _ in range(2):
+            delivery.deliver(['a', 'b', 'c'], [0, 1, 2], lambda index: None, lambda index: None)
+        assert server.commands == ['a', 'b', 'c']
+        assert server.duplicates == 2
+    finally:
+        server.stop()
@@ -0,0 +1,63 @@
+from unittest import mock
+
+
+class FakeText:
+    """Поле правки: Tk всегда добавляет перевод строки в конец"""
+
+    def __init__(self):
+        self.text = ''
+
+    def delete(self, start, end):
+        self.text = ''
+
+    def insert(self, index, text):
+        self.text += text
+
+    def get(self, start, end):
+        return self.text + '\n'
+
+    def edit_modified(self, flag):
+        pass
+
+
+def make_app(timebot):
+    app = timebot.App.__new__(timebot.App)
+    app.debug_text = FakeText()
+    app.nickname_entry = mock.Mock(**{'get.return_value': 'Next'})
+    app.text_parser = mock.Mock(parsed_lines=0)
+    app.settings = {'aggregate_policy': 'sum'}
+    app.status_var = mock.Mock()
+    app.live_parse_job = None
+    app.execution_in_progress = False
+    app.watch_pipeline = None
+    app.text_player = None
+    app.forget_loaded_text()
+    app.set_player_commands = mock.Mock(return_value=0)
+    return app
+
+
+def test_unrecognised_image_keeps_player_commands(timebot):
+    app = make_app(timebot)
+    app.load_text('', 'Alice', [])
+    app.live_parse()
+    app.set_player_commands.assert_not_called()
+    app.text_parser.parse.assert_not_called()
+
+
+def test_unchanged_text_uses_layout_commands(timebot):
+    app = make_app(timebot)
+    commands = ['playtime_addrole Alice JobCaptain 3600']
+    app.load_text('Капитан 1ч', 'Alice', commands)
+    app.live_parse()
+    app.set_player_commands.assert_called_once_with('Alice', commands)
+    app.text_parser.parse.assert_not_called()
+
+
+def test_edited_text_is_parsed_for_its_player(timebot):
+    app = make_app(timebot)
+    app.load_text('', 'Alice', [])
+    app.debug_text.insert('end', 'Капитан 2ч')
+    app.text_parser.parse.return_value = ['playtime_addrole Alice JobCaptain 7200']
+    app.live_parse()
+    app.text_parser.parse.assert_called_once_with('Капитан 2ч\n', 'Alice', 'sum')
+    app.set_player_commands.assert_called_once_with('Alice', ['playtime_addrole Alice JobCaptain 7200'])
@@ -0,0 +1,17 @@
+def test_overwrite_keeps_size_accounting(timebot, tmp_path):
+    cache = timebot.OcrCache(str(tmp_path), max_bytes=1000)
+    key = timebot.OcrCache.make_key(b'image', 'text')
+    cache.put(key, 'a' * 100)
+    for _ in range(20):
+        cache.put(key, 'b' * 300)
+    assert cache._size == 300
+    assert cache.get(key) == 'b' * 300
+
+
+def test_eviction_keeps_recent_entries(timebot, tmp_path):
+    cache = timebot.OcrCache(str(tmp_path), max_bytes=1000)
+    keys = [timebot.OcrCache.make_key(str(index).encode(), 'text') for index in range(6)]
+    for key in keys:
+        cache.put(key, 'x' * 300)
+    assert cache._size <= 900
+    assert cache.get(keys[-1]) == 'x' * 300
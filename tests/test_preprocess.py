@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('PIL')
+
+from PIL import Image, ImageDraw
+
+
+def black_share(image):
+    return float((np.asarray(image) == 0).mean())
+
+
+def noisy_field(sigma, size=(300, 200), seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = np.clip(200 + rng.normal(0, sigma, size[::-1]), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, 'L')
+
+
+@pytest.mark.parametrize('sigma', [0, 3, 6])
+def test_adaptive_keeps_noisy_field_white(timebot, sigma):
+    options = dict(timebot.PREPROCESS_OPTIONS, threshold='adaptive')
+    assert black_share(timebot.preprocess_image(noisy_field(sigma), options)) < 0.05
+
+
+def test_adaptive_keeps_text_black(timebot):
+    image = Image.new('L', (300, 60), 200)
+    ImageDraw.Draw(image).text((5, 20), "Captain 12:34", fill=60)
+    ink = np.asarray(image) < 130
+    options = dict(timebot.PREPROCESS_OPTIONS, threshold='adaptive')
+    binary = np.asarray(timebot.preprocess_image(image, options))
+    assert (binary[ink] == 0).mean() > 0.95
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_fixed_threshold_matches_legacy(timebot, mode):
+    rng = np.random.default_rng(1)
+    shape = (60, 90, 3) if mode == 'RGB' else (60, 90)
+    image = Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode)
+    options = dict(timebot.PREPROCESS_OPTIONS, threshold=150, invert_dark=False, upscale=1)
+    legacy = np.asarray(timebot.preprocess_image_legacy(image, options))
+    assert (np.asarray(timebot.preprocess_image(image, options)) == legacy).all()
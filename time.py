@@ -1,13 +1,65 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, ttk, simpledialog
-import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+import importlib
+import itertools
+import functools
+import hashlib
+import io
 import re
-import pyautogui
+import sys
 import time
 import os
 import json
-import pyperclip  # Для работы с буфером обмена
+import csv
+import queue
+import argparse
+import threading
+import random
+import contextlib
+import difflib
+import shutil
+import tempfile
+import statistics
+from array import array
+from collections import Counter, defaultdict, deque, namedtuple
+
+
+class _LazyModule:
+    """Модуль, который импортируется только при первом обращении к нему"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Тяжёлые зависимости загружаются по требованию: командная строка не должна
+# импортировать GUI и pyautogui, которому для импорта нужен дисплей
+tk = _LazyModule('tkinter')
+filedialog = _LazyModule('tkinter.filedialog')
+messagebox = _LazyModule('tkinter.messagebox')
+scrolledtext = _LazyModule('tkinter.scrolledtext')
+ttk = _LazyModule('tkinter.ttk')
+simpledialog = _LazyModule('tkinter.simpledialog')
+tkfont = _LazyModule('tkinter.font')
+pytesseract = _LazyModule('pytesseract')
+Image = _LazyModule('PIL.Image')
+ImageEnhance = _LazyModule('PIL.ImageEnhance')
+ImageFilter = _LazyModule('PIL.ImageFilter')
+ImageOps = _LazyModule('PIL.ImageOps')
+ImageChops = _LazyModule('PIL.ImageChops')
+ImageDraw = _LazyModule('PIL.ImageDraw')
+ImageFont = _LazyModule('PIL.ImageFont')
+np = _LazyModule('numpy')
+pyautogui = _LazyModule('pyautogui')
+pyperclip = _LazyModule('pyperclip')  # Для работы с буфером обмена
+http_client = _LazyModule('http.client')
+http_server = _LazyModule('http.server')
+urllib_parse = _LazyModule('urllib.parse')
+sqlite3 = _LazyModule('sqlite3')
+yaml = _LazyModule('yaml')  # Словари в YAML, необязательно
 
 # Словарь перевода должностей (полный словарь как выше)
 ROLE_TRANSLATION = {
@@ -62,6 +114,20 @@ ROLE_TRANSLATION = {
     "зоотехник": "JobZookeeper"
 }
 
+# Серии символов строки времени: текст до первой цифры одной серией (время с него не
+# начинается, и должность не разбивается на серии), затем цифры, буквы, пробелы и прочие символы
+TIME_TOKEN_PATTERN = re.compile(r'(^\D+)|(\d+)|([^\W\d]+)|(\s+)|([^\w\s]+)')
+
+# Частые формы времени по видам серий: пары «число единица», разделённые пробелами
+# ("12ч", "12 ч", "12ч 30м", "12 ч 30 м")
+TIME_PAIR_SHAPES = frozenset(('da', 'dsa', 'dasda', 'dsasda', 'dasdsa', 'dsasdsa', 'dasdasda'))
+# Секунды в стандартной единице времени
+TIME_UNIT_SECONDS = {'ч': 3600, 'м': 60, 'с': 1}
+
+# Прежний поиск времени в строке таблицы (эталон для bench-time): пары число+единица,
+# "164 40m", "16ч4м" или просто числа
+TIME_SEARCH_PATTERN = re.compile(r'((?:\d+\s*\w+\s*)+|\d+\s+\d+\s*\w+|\d+\w+\d+\w+|\d+\s*\w+|\d+\s+\d+)')
+
 # Словарь вариантов написания единиц времени
 TIME_UNITS = {
     "ч": ["ч", "Ч", "h", "H", "час", "часов"],
@@ -69,6 +135,319 @@ TIME_UNITS = {
     "с": ["с", "С", "s", "S", "сек", "секунд", "секунды"]
 }
 
+# Латинские буквы и цифры, которые OCR путает с похожими кириллическими
+ROLE_HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м', 'n': 'п', 'o': 'о', 'p': 'р',
+    'r': 'г', 't': 'т', 'u': 'и', 'x': 'х', 'y': 'у', '0': 'о', '3': 'з', '6': 'б', 'ё': 'е', 'й': 'и'
+})
+
+# Допустимое число правок при нечётком поиске должности — доля длины строки:
+# одна правка на 4-7 букв, две на 8-11 ("мин" и "ученик" не становятся мимом и учёным)
+ROLE_MAX_DISTANCE_RATIO = 0.25
+# Более короткие строки ищутся только точно
+ROLE_MIN_FUZZY_LENGTH = 5
+
+# Параметры распознавания Tesseract
+OCR_LANGUAGES = 'rus+eng'
+OCR_OEM = 3
+OCR_PSM = 6
+OCR_CONFIG = rf'--oem {OCR_OEM} --psm {OCR_PSM} -l {OCR_LANGUAGES}'
+
+# Параметры предобработки изображения (входят в ключ кэша распознавания)
+PREPROCESS_OPTIONS = {
+    'contrast': 2.0,
+    'sharpen': True,
+    # Число (фиксированный порог), 'otsu' или 'adaptive' (порог по локальному среднему)
+    'threshold': 'otsu',
+    'adaptive_block': 31,
+    'adaptive_offset': 10,
+    # Светлый текст на тёмной теме инвертируется в тёмный на светлом
+    'invert_dark': True,
+    # Целочисленное увеличение мелкого текста перед бинаризацией
+    'upscale': 1
+}
+
+# Обработка очень больших изображений полосами, чтобы не превысить лимит памяти
+TILE_OPTIONS = {
+    # Лимит памяти на распознавание одного изображения (байт); 0 — всегда целиком
+    'memory_limit': 512 * 1024 * 1024,
+    # Перекрытие соседних полос (пикселей исходного изображения): больше высоты строки таблицы
+    'overlap': 96,
+    # Полос, обрабатываемых одновременно
+    'workers': 1
+}
+
+# Оценка памяти предобработки и OCR на пиксель (после увеличения): копии в NumPy и буферы Tesseract
+TILE_BYTES_PER_PIXEL = 16
+
+# Повторное распознавание слабых строк в режиме 'layout'
+ROW_RETRY_OPTIONS = {
+    'min_confidence': 75,
+    'padding': 4
+}
+
+# Варианты повторного распознавания строки, перебираются по порядку
+ROW_RETRY_VARIANTS = [
+    {'psm': 7, 'upscale': 2, 'invert': False, 'threshold': 'otsu'},
+    {'psm': 7, 'upscale': 3, 'invert': False, 'threshold': 'adaptive'},
+    {'psm': 7, 'upscale': 2, 'invert': True, 'threshold': 'otsu'},
+    {'psm': 13, 'upscale': 2, 'invert': False, 'threshold': 'otsu'}
+]
+
+# Первые слова заголовка и итоговой строки таблицы: такие строки отбрасываются до повторного распознавания
+TABLE_SERVICE_WORDS = ('должность', 'время', 'итого', 'всего')
+
+# Папка данных приложения
+APP_DATA_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+                            'ss14-timebot')
+
+# Внешние словари: <папка>/roles.json и time_units.json (или .yaml/.yml), без них — встроенные
+DICTIONARY_DIR = os.path.join(APP_DATA_DIR, 'dictionaries')
+DICTIONARY_NAMES = ('roles', 'time_units')
+DICTIONARY_EXTENSIONS = ('.json', '.yaml', '.yml')
+# Не чаще чем раз в столько секунд проверяется, изменились ли файлы словарей
+DICTIONARY_CHECK_INTERVAL = 1.0
+
+# Встроенные словари, если внешних файлов нет
+BUILTIN_ROLE_TRANSLATION = ROLE_TRANSLATION
+BUILTIN_TIME_UNITS = TIME_UNITS
+
+# Идентификатор трекера — одно слово, он подставляется в команду консоли
+JOB_ID_PATTERN = re.compile(r'^\S+$')
+# Вариант единицы времени — только буквы, иначе он смешается с числом
+TIME_UNIT_VARIANT_PATTERN = re.compile(r'^[^\W\d]+$')
+
+# Предельный размер кэша распознавания на диске
+OCR_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Слово, распознанное Tesseract, с рамкой и уверенностью (0-100)
+OcrWord = namedtuple('OcrWord', 'text left top right bottom conf')
+
+# Строка таблицы: должность, время, средняя уверенность и рамка (left, top, right, bottom)
+OcrRow = namedtuple('OcrRow', 'role time confidence box')
+
+# Начисление времени игроку: ник, идентификатор должности, секунды
+PlaytimeEntry = namedtuple('PlaytimeEntry', 'nickname job seconds')
+
+# Команда консоли, из которой восстанавливается PlaytimeEntry
+COMMAND_PATTERN = re.compile(r'^playtime_addrole\s+(\S+)\s+(\S+)\s+(\d+)$')
+
+# Слияние повторных начислений (ник, должность): большее, сумма или последнее
+AGGREGATE_POLICIES = ('max', 'sum', 'last')
+
+# Строк VALUES в одном INSERT при экспорте в SQL
+EXPORT_SQL_BATCH_SIZE = 1000
+
+# Способы ввода команд
+INPUT_METHOD_NAMES = {
+    'clipboard': "Буфер обмена",
+    'direct': "Прямой ввод",
+    'http': "HTTP (админ API)"
+}
+
+# Отправка команд на административный HTTP-эндпоинт сервера
+HTTP_DELIVERY_DEFAULTS = {
+    'http_url': 'http://127.0.0.1:1212/admin/commands',
+    'http_token': '',
+    'http_concurrency': 4,
+    'http_batch_size': 50,
+    'http_retries': 3,
+    'http_timeout': 10.0
+}
+
+# Ответы HTTP, после которых запрос имеет смысл повторить
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Перенос времени напрямую между базами данных SS14
+PLAYTIME_TABLE = 'play_time'
+MIGRATION_CHUNK_SIZE = 1000
+# Слияние с уже существующим временем: большее из двух значений или сумма
+MERGE_POLICIES = ('max', 'add')
+
+# Время в базе SQLite хранится как TimeSpan .NET: [-][d.]hh:mm:ss[.fffffff]
+TIMESPAN_PATTERN = re.compile(r'^(-)?(?:(\d+)\.)?(\d+):(\d+):(\d+)(?:\.(\d+))?$')
+
+# Адаптивные задержки ввода: команда считается принятой, когда меняется
+# область консоли вокруг курсора (ширина и высота в пикселях)
+ADAPTIVE_PACING = {
+    'region': (600, 40),
+    'poll': 0.02,
+    'timeout': 2.0,
+    # Доля изменившихся пикселей, при которой область считается изменившейся
+    'min_changed': 0.002,
+    # Пауза после команды: уменьшается на step при подтверждении и удваивается без него
+    'min_delay': 0.02,
+    'max_delay': 3.0,
+    'step': 0.05
+}
+
+# Записей журнала выполнения между сбросами на диск
+JOURNAL_FSYNC_EVERY = 20
+
+# Сколько ждать отправки, прерванной из командной строки (с): дольше висит только запрос без ответа
+STOP_JOIN_TIMEOUT = 2.0
+
+# Период опроса событий выполнения интерфейсом (мс): заодно ограничивает частоту обновлений
+EXECUTION_POLL_MS = 100
+
+# Период проверки файлов словарей интерфейсом (мс)
+DICTIONARY_POLL_MS = 2000
+
+# Пауза после последней правки распознанного текста перед его разбором (мс)
+LIVE_PARSE_DELAY_MS = 300
+
+# Порядок команд сессии в списке
+COMMAND_SORT_NAMES = {
+    'player': "По игроку",
+    'role': "По должности",
+    'time': "По времени",
+    'status': "Неотправленные сначала"
+}
+
+# Расширения файлов изображений для пакетной обработки
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# Наблюдение за папкой: период опроса (если inotify недоступен) и размер очереди изображений
+WATCH_POLL_INTERVAL = 1.0
+WATCH_QUEUE_SIZE = 8
+
+# Съёмка списка с экрана во время прокрутки
+CAPTURE_OPTIONS = {
+    # Пауза между снимками (сек)
+    'interval': 0.3,
+    # Доля изменившихся пикселей, с которой кадр считается новым и распознаётся
+    'min_changed': 0.002,
+    # Съёмка заканчивается после стольких одинаковых кадров подряд (список перестали прокручивать)
+    'idle_frames': 20,
+    # Щелчков колеса мыши после каждого кадра; 0 — список прокручивают вручную
+    'scroll_clicks': 0
+}
+
+# Флаги inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_ISDIR = 0x40000000
+
+# Синтетические таблицы времени для бенчмарка: темы (фон, заголовок, текст),
+# шрифты с кириллицей (ищутся в системных папках), масштабы и уровни шума
+BENCH_THEMES = {
+    'dark': ((27, 27, 30), (140, 140, 150), (214, 214, 214)),
+    'light': ((238, 238, 238), (110, 110, 110), (24, 24, 24))
+}
+BENCH_FONTS = ('DejaVuSans.ttf', 'DejaVuSans-Bold.ttf', 'DejaVuSerif.ttf', 'DejaVuSansMono.ttf',
+               'arial.ttf', 'segoeui.ttf', 'tahoma.ttf')
+BENCH_SCALES = (0.75, 1.0, 1.5, 2.0)
+BENCH_NOISE = (0.0, 0.08, 0.16)
+BENCH_ROWS_PER_IMAGE = 12
+
+# Образец бенчмарка: изображение (None в режиме разбора текста), текст и эталон {(должность, секунды): число}
+BenchSample = namedtuple('BenchSample', 'name image text truth')
+
+# Сколько последних длительностей каждого этапа хранится для перцентилей
+METRICS_SAMPLE_SIZE = 10000
+
+
+class Metrics:
+    """Длительности этапов обработки и счётчики событий (потокобезопасно)
+
+    Длительности меряются монотонными часами perf_counter; для каждого этапа
+    хранятся сумма, минимум, максимум и последние METRICS_SAMPLE_SIZE значений
+    для перцентилей, поэтому память не растёт с числом команд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = Counter()
+            self._spans = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                                            'samples': deque(maxlen=METRICS_SAMPLE_SIZE)}
+            span['count'] += 1
+            span['total'] += seconds
+            span['min'] = min(span['min'], seconds)
+            span['max'] = max(span['max'], seconds)
+            span['samples'].append(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Замеряет длительность блока как этап name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def totals(self):
+        """Суммарное время по этапам в секундах"""
+        with self._lock:
+            return {name: span['total'] for name, span in self._spans.items()}
+
+    def snapshot(self):
+        """Сводка для отчёта: счётчики и статистика этапов в миллисекундах"""
+        with self._lock:
+            spans = {}
+            for name, span in sorted(self._spans.items()):
+                samples = sorted(span['samples'])
+                spans[name] = {
+                    'count': span['count'],
+                    'total_ms': round(span['total'] * 1000, 3),
+                    'mean_ms': round(span['total'] * 1000 / span['count'], 3),
+                    'min_ms': round(span['min'] * 1000, 3),
+                    'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+                    'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+                    'max_ms': round(span['max'] * 1000, 3)
+                }
+            return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    'seconds': round(time.time() - self.started, 3),
+                    'counters': dict(sorted(self.counters.items())),
+                    'spans': spans}
+
+    def summary(self):
+        """Короткая строка для строки состояния интерфейса"""
+        snapshot = self.snapshot()
+        parts = [f"{name}: {span['mean_ms']:.0f} мс × {span['count']}" for name, span in snapshot['spans'].items()]
+        parts += [f"{name}: {value}" for name, value in snapshot['counters'].items()]
+        return " · ".join(parts)
+
+
+def write_metrics_report(metrics, path):
+    """Сохраняет отчёт метрик в JSON или CSV (по расширению файла)"""
+    snapshot = metrics.snapshot()
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if not path.lower().endswith('.csv'):
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+            return
+
+        writer = csv.writer(f)
+        writer.writerow(['kind', 'name', 'count', 'total_ms', 'mean_ms', 'min_ms', 'p50_ms', 'p95_ms', 'max_ms'])
+        for name, span in snapshot['spans'].items():
+            writer.writerow(['span', name, span['count'], span['total_ms'], span['mean_ms'], span['min_ms'],
+                             span['p50_ms'], span['p95_ms'], span['max_ms']])
+        for name, value in snapshot['counters'].items():
+            writer.writerow(['counter', name, value])
+
+
+# Метрики текущего запуска (в процессах пакетной обработки — свои)
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
 
 def find_tesseract():
     """Поиск Tesseract в стандартных местах"""
@@ -86,24 +465,175 @@ def find_tesseract():
     return None
 
 
-def setup_tesseract():
-    """Настройка пути к Tesseract"""
+def find_tessdata(tesseract_path=None):
+    """Папка tessdata рядом с найденным Tesseract"""
+    if tesseract_path:
+        tessdata = os.path.join(os.path.dirname(tesseract_path), 'tessdata')
+        if os.path.isdir(tessdata):
+            return tessdata
+    return None
+
+
+class PytesseractBackend:
+    """Распознавание через pytesseract: отдельный процесс tesseract на каждое изображение"""
+
+    name = 'pytesseract'
+
+    def __init__(self):
+        self._version = None
+
+    def version(self):
+        if self._version is None:
+            self._version = str(pytesseract.get_tesseract_version())
+        return self._version
+
+    def image_to_string(self, image, psm=OCR_PSM):
+        config = rf'--oem {OCR_OEM} --psm {psm} -l {OCR_LANGUAGES}'
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_words(self, image, psm=OCR_PSM):
+        config = rf'--oem {OCR_OEM} --psm {psm} -l {OCR_LANGUAGES}'
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+
+        words = []
+        for i, text in enumerate(data['text']):
+            text = text.strip()
+            # Уровень 5 — слово; у пустых блоков уверенность -1
+            if data['level'][i] != 5 or not text:
+                continue
+            left, top = data['left'][i], data['top'][i]
+            words.append(OcrWord(text, left, top, left + data['width'][i], top + data['height'][i],
+                                 float(data['conf'][i])))
+        return words
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    """Пул заранее инициализированных движков tesserocr
+
+    Языковые модели загружаются один раз на движок, изображения передаются
+    в памяти без временных файлов и без запуска процесса на каждый вызов.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, tessdata_path=None, size=1):
+        self._tesserocr = importlib.import_module('tesserocr')
+        self._tessdata_path = tessdata_path
+        self._size = max(1, size)
+        self._engines = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        # Первый движок создаём сразу, чтобы ошибки инициализации всплыли при настройке
+        self._engines.put(self._create_engine())
+
+    def _create_engine(self):
+        kwargs = {'lang': OCR_LANGUAGES, 'oem': OCR_OEM, 'psm': OCR_PSM}
+        if self._tessdata_path:
+            kwargs['path'] = self._tessdata_path
+        engine = self._tesserocr.PyTessBaseAPI(**kwargs)
+        self._created += 1
+        return engine
+
+    @contextlib.contextmanager
+    def _engine(self):
+        """Берёт свободный движок из пула, при необходимости создаёт новый"""
+        try:
+            engine = self._engines.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                engine = self._create_engine() if self._created < self._size else None
+            if engine is None:
+                engine = self._engines.get()
+        try:
+            yield engine
+        finally:
+            self._engines.put(engine)
+
+    def version(self):
+        return self._tesserocr.tesseract_version().split()[1]
+
+    def image_to_string(self, image, psm=OCR_PSM):
+        with self._engine() as engine:
+            engine.SetPageSegMode(psm)
+            engine.SetImage(image)
+            return engine.GetUTF8Text()
+
+    def image_to_words(self, image, psm=OCR_PSM):
+        level = self._tesserocr.RIL.WORD
+        words = []
+        with self._engine() as engine:
+            engine.SetPageSegMode(psm)
+            engine.SetImage(image)
+            engine.Recognize()
+            for result in self._tesserocr.iterate_level(engine.GetIterator(), level):
+                text = (result.GetUTF8Text(level) or '').strip()
+                box = result.BoundingBox(level)
+                if text and box:
+                    words.append(OcrWord(text, *box, result.Confidence(level)))
+        return words
+
+    def close(self):
+        while self._created:
+            self._engines.get().End()
+            self._created -= 1
+
+
+# Активный движок распознавания, выбирается в setup_tesseract
+_ocr_backend = None
+
+
+def setup_tesseract(engine_pool_size=1):
+    """Настройка пути к Tesseract и выбор движка распознавания"""
+    global _ocr_backend
+
+    tesseract_path = find_tesseract()
+
+    # Предпочитаем пул постоянных движков, pytesseract остаётся запасным вариантом
     try:
-        pytesseract.get_tesseract_version()
+        _ocr_backend = TesserocrBackend(find_tessdata(tesseract_path), engine_pool_size)
         return True
+    except (ImportError, RuntimeError):
+        pass
+
+    try:
+        pytesseract.get_tesseract_version()
     except EnvironmentError:
-        tesseract_path = find_tesseract()
-        if tesseract_path:
-            pytesseract.pytesseract.tesseract_cmd = tesseract_path
-            return True
+        if not tesseract_path:
+            return False
+        pytesseract.pytesseract.tesseract_cmd = tesseract_path
+
+    _ocr_backend = PytesseractBackend()
+    return True
+
+
+def get_ocr_backend():
+    """Активный движок распознавания (настраивается при первом обращении)"""
+    if _ocr_backend is None and not setup_tesseract():
+        raise EnvironmentError("Tesseract OCR не установлен или не найден")
+    return _ocr_backend
+
+
+@functools.lru_cache(maxsize=None)
+def has_numpy():
+    """Доступен ли NumPy для быстрой предобработки"""
+    try:
+        importlib.import_module('numpy')
+        return True
+    except ImportError:
         return False
 
 
-def preprocess_image(image):
-    """Предварительная обработка изображения для улучшения распознавания"""
+def preprocess_image_legacy(image, options=None):
+    """Предобработка средствами PIL (без NumPy), каждый шаг создаёт новое изображение"""
+    options = options or PREPROCESS_OPTIONS
+
     # Увеличение контрастности
     enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(2.0)
+    image = enhancer.enhance(options['contrast'])
 
     # Преобразование в черно-белое
     image = image.convert('L')
@@ -111,242 +641,3371 @@ def preprocess_image(image):
     # Применение фильтра для увеличения резкости
     image = image.filter(ImageFilter.SHARPEN)
 
-    # Бинаризация (пороговая обработка)
-    threshold = 150
+    # Бинаризация (пороговая обработка); без NumPy доступен только фиксированный порог
+    threshold = options['threshold'] if isinstance(options['threshold'], int) else 150
     image = image.point(lambda p: 255 if p > threshold else 0)
 
     return image
 
 
-def normalize_role(role_str):
-    """Нормализует строку должности для поиска в словаре"""
-    role_str = role_str.lower().replace('ё', 'е').replace('.', '').strip()
-    return role_str
+def _otsu_threshold(histogram):
+    """Порог Оцу по гистограмме яркости"""
+    histogram = np.asarray(histogram, dtype=np.float64)
+    levels = np.arange(256, dtype=np.float64)
 
+    weight_background = np.cumsum(histogram)
+    weight_foreground = weight_background[-1] - weight_background
+    sum_background = np.cumsum(histogram * levels)
+    mean_background = sum_background / np.maximum(weight_background, 1)
+    mean_foreground = (sum_background[-1] - sum_background) / np.maximum(weight_foreground, 1)
 
-def normalize_time_unit(unit):
-    """Нормализует единицу времени"""
-    unit = unit.lower().strip()
+    between_variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return int(np.argmax(between_variance))
 
-    # Ищем единицу в словаре вариантов
-    for standard_unit, variants in TIME_UNITS.items():
-        if unit in variants:
-            return standard_unit
 
-    return unit
+def _sharpen(gray, out):
+    """Резкость ядром ImageFilter.SHARPEN в целых числах, без ограничения 0..255
 
+    PIL считает (17 * p - сумма_3x3) / 8 с округлением половины вверх и не
+    трогает крайние строки и столбцы; здесь так же, поэтому после порога
+    результат совпадает с preprocess_image_legacy.
+    """
+    height, width = gray.shape
+    padded = np.pad(gray, 1, mode='edge')
 
-def time_to_seconds(time_str):
-    """Конвертирует строку времени в секунды с поддержкой разных форматов"""
-    total_seconds = 0
+    # Сумма 3x3 раздельно: сначала по строкам, затем по столбцам
+    rows = np.add(padded[:, 0:width], padded[:, 1:width + 1], dtype=np.int16)
+    rows += padded[:, 2:width + 2]
+    np.add(rows[0:height], rows[1:height + 1], out=out)
+    out += rows[2:height + 2]
 
-    # Очищаем строку от лишних пробелов
-    time_str = time_str.strip()
+    np.subtract(np.multiply(gray, 17, dtype=np.int16), out, out=out)
+    out += 4
+    out >>= 3
 
-    # Обработка формата "число число+единица" (например, "164 40m")
-    # Ищем шаблон: число [пробел] число+единица
-    double_num_match = re.match(r'^(\d+)\s+(\d+)(\w+)$', time_str)
-    if double_num_match:
-        num1 = int(double_num_match.group(1))
-        num2 = int(double_num_match.group(2))
-        unit = normalize_time_unit(double_num_match.group(3))
+    # Края PIL копирует без фильтра
+    out[[0, -1], :] = gray[[0, -1], :]
+    out[:, [0, -1]] = gray[:, [0, -1]]
+    return out
 
-        # Интерпретация зависит от единицы измерения
-        if unit == 'ч':
-            # Оба числа в часах (например, "164 40ч" = 164 часа + 40 часов)
-            total_seconds += (num1 + num2) * 3600
-        elif unit == 'м':
-            # Первое число - часы, второе - минуты (например, "164 40м" = 164 часа + 40 минут)
-            total_seconds += num1 * 3600 + num2 * 60
-        elif unit == 'с':
-            # Первое число - часы, второе - секунды (например, "164 40с" = 164 часа + 40 секунд)
-            total_seconds += num1 * 3600 + num2
-        return total_seconds
 
-    # Обработка формата без пробелов (например, "16ч4м")
-    # Ищем шаблон: число+единица число+единица
-    compact_match = re.match(r'^(\d+)(\w+)(\d+)(\w+)$', time_str)
-    if compact_match:
-        num1 = int(compact_match.group(1))
-        unit1 = normalize_time_unit(compact_match.group(2))
-        num2 = int(compact_match.group(3))
-        unit2 = normalize_time_unit(compact_match.group(4))
+def preprocess_image(image, options=None, histogram=None):
+    """Предварительная обработка изображения для улучшения распознавания
 
-        # Обрабатываем первое число
-        if unit1 == 'ч':
-            total_seconds += num1 * 3600
-        elif unit1 == 'м':
-            total_seconds += num1 * 60
-        elif unit1 == 'с':
-            total_seconds += num1
+    Перевод в оттенки серого, контраст и инверсия тёмной темы сведены в один
+    проход по таблице, резкость и бинаризация выполняются целочисленно над
+    массивами NumPy без промежуточного изображения на каждом шаге. Полосе
+    большого изображения передаётся histogram всей страницы, чтобы контраст
+    и порог у всех полос были одинаковыми.
+    """
+    options = options or PREPROCESS_OPTIONS
+    if not has_numpy():
+        return preprocess_image_legacy(image, options)
 
-        # Обрабатываем второе число
-        if unit2 == 'ч':
-            total_seconds += num2 * 3600
-        elif unit2 == 'м':
-            total_seconds += num2 * 60
-        elif unit2 == 'с':
-            total_seconds += num2
+    # Увеличение мелкого текста
+    factor = int(options.get('upscale', 1))
+    if factor > 1:
+        image = image.resize((image.width * factor, image.height * factor), Image.BICUBIC)
 
-        return total_seconds
+    # Цветное изображение, как и в PIL, получает контраст по каналам до перевода в серое
+    color = image.mode in ('RGB', 'RGBA')
+    if not color and image.mode != 'L':
+        image = image.convert('L')
+    if histogram is None:
+        histogram = (image.convert('L') if color else image).histogram()
+    histogram = np.asarray(histogram, dtype=np.int64)
 
-    # Обработка формата с явными единицами (например, "166ч 40м")
-    # Ищем все пары число+единица
-    time_parts = re.findall(r'(\d+)\s*(\w+)', time_str)
+    # Контраст относительно средней яркости (как ImageEnhance.Contrast) одной таблицей
+    levels = np.arange(256, dtype=np.float64)
+    mean = int(levels @ histogram / max(histogram.sum(), 1) + 0.5)
+    contrast = options['contrast']
+    lut = np.clip(mean + contrast * (levels - mean), 0, 255).astype(np.uint8)
 
-    for num_str, unit in time_parts:
-        num = int(num_str)
-        unit = normalize_time_unit(unit)
+    # Тёмная тема: инвертируем, чтобы Tesseract получил тёмный текст на светлом фоне
+    median = int(np.searchsorted(np.cumsum(histogram), histogram.sum() / 2))
+    if options.get('invert_dark', True) and lut[median] < 128:
+        lut = 255 - lut
 
-        if unit == 'ч':
-            total_seconds += num * 3600
-        elif unit == 'м':
-            total_seconds += num * 60
-        elif unit == 'с':
-            total_seconds += num
+    image = image.point(lut.tolist() * len(image.getbands()))
+    if color:
+        image = image.convert('L')
+    gray = np.asarray(image)
 
-    # Если не найдено ни одной единицы, но есть числа, предполагаем что это минуты
-    if total_seconds == 0:
-        numbers = re.findall(r'(\d+)', time_str)
-        if numbers:
-            # Берем последнее найденное число как минуты
-            total_seconds = int(numbers[-1]) * 60
+    # Бинаризация
+    threshold = options['threshold']
+    if threshold == 'adaptive':
+        # Порог по локальному среднему ставится до резкости: резкость усиливает шум,
+        # и на зашумлённом фоне треть пикселей уходила в чёрное. Пиксель берётся
+        # средним 3x3, окно считает BoxBlur PIL за O(1) на пиксель любого размера
+        radius = options['adaptive_block'] // 2
+        pixel = np.asarray(image.filter(ImageFilter.BoxBlur(1)), dtype=np.int16)
+        local = np.asarray(image.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+        local -= options['adaptive_offset']
+        binary = pixel >= local
+    else:
+        # Резкость в буфере int16
+        if options.get('sharpen', True):
+            work = _sharpen(gray, np.empty(gray.shape, dtype=np.int16))
+        else:
+            work = gray
+        if threshold == 'otsu':
+            threshold = _otsu_threshold(np.bincount(lut, weights=histogram, minlength=256))
+        binary = work > threshold
 
-    return total_seconds
+    return Image.fromarray(binary.view(np.uint8) * np.uint8(255), 'L')
 
 
-def process_text(text, player_nickname):
-    """Обрабатывает текст и генерирует команды"""
-    commands = []
+def normalize_role(role_str):
+    """Нормализует строку должности для поиска в словаре"""
+    role_str = role_str.lower().replace('ё', 'е').replace('.', '').strip()
+    return role_str
 
-    # Разделение текста на строки
-    lines = text.split('\n')
 
-    # Обрабатываем каждую строку
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
+def fold_role(role_str):
+    """Приводит должность к виду для нечёткого поиска: похожие символы, пунктуация, пробелы"""
+    role_str = normalize_role(role_str).translate(ROLE_HOMOGLYPHS)
+    role_str = re.sub(r'[^\w\s-]', '', role_str)
+    return ' '.join(role_str.split())
 
-        # Ищем время в строке - улучшенное регулярное выражение
-        time_match = re.search(r'((?:\d+\s*\w+\s*)+|\d+\s+\d+\s*\w+|\d+\w+\d+\w+|\d+\s*\w+|\d+\s+\d+)', line)
-        if not time_match:
-            continue
 
-        time_str = time_match.group(1)
-        role_str = line.replace(time_str, '').strip()
+def _bounded_levenshtein(a, b, limit):
+    """Расстояние Левенштейна или None, если оно больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return None
 
-        # Конвертация времени
-        seconds = time_to_seconds(time_str)
-        if seconds == 0:
-            continue
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        # Вся строка таблицы уже больше предела — дальше расстояние только растёт
+        if min(current) > limit:
+            return None
+        previous = current
 
-        # Перевод должности
-        normalized_role = normalize_role(role_str)
-        role_en = ROLE_TRANSLATION.get(normalized_role)
-        if not role_en:
-            print(f"Неизвестная должность: {role_str}")
-            continue
+    return previous[-1] if previous[-1] <= limit else None
 
-        # Формирование команды
-        command = f"playtime_addrole {player_nickname} {role_en} {seconds}"
-        commands.append(command)
-        print(f"Сгенерирована команда: {command}")
-        print(f"  Время: {time_str} -> {seconds} секунд")
 
-    return commands
+# Результат поиска должности: идентификатор, найденное имя и число правок
+RoleMatch = namedtuple('RoleMatch', 'job name distance')
 
 
-def process_image(image_path, player_nickname):
-    """Обрабатывает изображение и генерирует команды"""
-    try:
-        # Открываем и обрабатываем изображение
-        image = Image.open(image_path)
-        processed_image = preprocess_image(image)
+class RoleResolver:
+    """Нечёткий поиск должности по индексу триграмм с кэшем повторных запросов
 
-        # Распознавание текста с улучшенными параметрами
-        custom_config = r'--oem 3 --psm 6 -l rus+eng'
-        text = pytesseract.image_to_string(processed_image, config=custom_config)
+    Индекс строится один раз по всем названиям, поэтому на каждый запрос
+    расстояние считается только для названий с общими триграммами. Нечёткое
+    совпадение принимается, только если оно однозначно: другая должность на
+    том же расстоянии означает, что строку не удалось узнать.
+    """
 
-        return text, process_text(text, player_nickname)
-    except Exception as e:
-        messagebox.showerror("Ошибка", f"Не удалось обработать изображение: {str(e)}")
-        return "", []
+    def __init__(self, table, max_distance_ratio=ROLE_MAX_DISTANCE_RATIO, max_candidates=16, cache_size=4096):
+        self.max_distance_ratio = max_distance_ratio
+        self.max_candidates = max_candidates
+        self._names = []
+        self._folded = []
+        self._jobs = []
+        self._exact = {}
+        self._index = defaultdict(list)
 
+        for name, job in table.items():
+            folded = fold_role(name)
+            if folded in self._exact:
+                continue
+            self._exact[folded] = len(self._names)
+            for trigram in self._trigrams(folded):
+                self._index[trigram].append(len(self._names))
+            self._names.append(name)
+            self._folded.append(folded)
+            self._jobs.append(job)
 
-class SettingsDialog(tk.Toplevel):
-    """Диалог настроек выполнения команд"""
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
 
-    def __init__(self, parent, settings):
-        super().__init__(parent)
-        self.title("Настройки выполнения команд")
-        self.geometry("400x300")
-        self.settings = settings.copy()
-        self.result = None
+    @staticmethod
+    def _trigrams(folded):
+        padded = f" {folded} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
-        # Создаем интерфейс
-        self.create_widgets()
+    def _resolve(self, role_str):
+        """Лучшее совпадение RoleMatch или None"""
+        folded = fold_role(role_str)
+        if not folded:
+            return None
 
-    def create_widgets(self):
-        # Задержки
-        delay_frame = tk.Frame(self)
-        delay_frame.pack(fill=tk.X, padx=10, pady=10)
+        index = self._exact.get(folded)
+        if index is not None:
+            return RoleMatch(self._jobs[index], self._names[index], 0)
 
-        tk.Label(delay_frame, text="Задержка между командами (сек):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
-        self.cmd_delay_var = tk.StringVar(value=str(self.settings.get('command_delay', 1.0)))
-        cmd_delay_entry = tk.Entry(delay_frame, textvariable=self.cmd_delay_var, width=10)
-        cmd_delay_entry.grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
+        if len(folded) < ROLE_MIN_FUZZY_LENGTH:
+            return None
 
-        tk.Label(delay_frame, text="Задержка перед Enter (сек):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
-        self.enter_delay_var = tk.StringVar(value=str(self.settings.get('enter_delay', 0.5)))
-        enter_delay_entry = tk.Entry(delay_frame, textvariable=self.enter_delay_var, width=10)
-        enter_delay_entry.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        shared = Counter()
+        for trigram in self._trigrams(folded):
+            shared.update(self._index.get(trigram, ()))
 
-        # Способ ввода
-        input_frame = tk.Frame(self)
-        input_frame.pack(fill=tk.X, padx=10, pady=10)
+        limit = max(1, int(len(folded) * self.max_distance_ratio))
+        best = None
+        ambiguous = False
+        for index, _ in shared.most_common(self.max_candidates):
+            distance = _bounded_levenshtein(folded, self._folded[index], limit)
+            if distance is None:
+                continue
+            if best is None or distance < best.distance:
+                best = RoleMatch(self._jobs[index], self._names[index], distance)
+                ambiguous = False
+                limit = distance
+            elif self._jobs[index] != best.job:
+                ambiguous = True
+        return None if ambiguous else best
 
-        tk.Label(input_frame, text="Способ ввода команд:").pack(side=tk.LEFT, padx=5)
-        self.input_method_var = tk.StringVar(value=self.settings.get('input_method', 'clipboard'))
-        tk.Radiobutton(input_frame, text="Буфер обмена", variable=self.input_method_var, value='clipboard').pack(
-            side=tk.LEFT, padx=5)
-        tk.Radiobutton(input_frame, text="Прямой ввод", variable=self.input_method_var, value='direct').pack(
-            side=tk.LEFT, padx=5)
 
-        # Кнопки
-        button_frame = tk.Frame(self)
-        button_frame.pack(fill=tk.X, padx=10, pady=10)
+# Индекс должностей строится при первом поиске
+_role_resolver = None
 
-        tk.Button(button_frame, text="Сохранить", command=self.save_settings).pack(side=tk.RIGHT, padx=5)
-        tk.Button(button_frame, text="Отмена", command=self.destroy).pack(side=tk.RIGHT, padx=5)
 
-    def save_settings(self):
-        try:
-            self.settings['command_delay'] = float(self.cmd_delay_var.get())
-            self.settings['enter_delay'] = float(self.enter_delay_var.get())
-            self.settings['input_method'] = self.input_method_var.get()
-            self.result = self.settings
-            self.destroy()
-        except ValueError:
-            messagebox.showerror("Ошибка", "Неверное значение задержки")
+def get_role_resolver():
+    """Общий индекс должностей по ROLE_TRANSLATION"""
+    global _role_resolver
+    if _role_resolver is None:
+        _role_resolver = RoleResolver(ROLE_TRANSLATION)
+    return _role_resolver
 
 
-class App:
-    def __init__(self, root):
-        self.root = root
+# Обратный индекс вариантов единиц времени строится при первом разборе
+_time_unit_index = None
+
+
+def get_time_unit_index():
+    """Вариант написания → стандартная единица (при совпадении побеждает первая в TIME_UNITS)"""
+    global _time_unit_index
+    if _time_unit_index is None:
+        index = {}
+        for standard_unit, variants in TIME_UNITS.items():
+            for variant in variants:
+                index.setdefault(variant.lower(), standard_unit)
+        _time_unit_index = index
+    return _time_unit_index
+
+
+def normalize_time_unit(unit):
+    """Нормализует единицу времени"""
+    unit = unit.lower().strip()
+    return get_time_unit_index().get(unit, unit)
+
+
+def validate_role_table(data):
+    """Проверяет словарь «название → трекер» и приводит названия к нижнему регистру"""
+    if not isinstance(data, dict) or not data:
+        raise ValueError("Словарь должностей должен быть непустым объектом «название: трекер»")
+
+    table = {}
+    for name, job in data.items():
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError(f"Пустое название должности: {name!r}")
+        if not isinstance(job, str) or not JOB_ID_PATTERN.match(job.strip()):
+            raise ValueError(f"Неверный трекер для «{name}»: {job!r}")
+        name = ' '.join(name.lower().split())
+        job = job.strip()
+        if table.get(name, job) != job:
+            raise ValueError(f"Должность «{name}» указана с разными трекерами: {table[name]} и {job}")
+        table[name] = job
+    return table
+
+
+def validate_time_units(data):
+    """Проверяет словарь «стандартная единица → варианты написания»"""
+    if not isinstance(data, dict) or not data:
+        raise ValueError("Словарь единиц времени должен быть непустым объектом «единица: [варианты]»")
+
+    units = {}
+    owners = {}
+    for standard_unit, variants in data.items():
+        if standard_unit not in TIME_UNIT_SECONDS:
+            raise ValueError(f"Неизвестная единица времени: {standard_unit!r} (допустимы {', '.join(TIME_UNIT_SECONDS)})")
+        if not isinstance(variants, list) or not variants:
+            raise ValueError(f"Варианты единицы «{standard_unit}» должны быть непустым списком")
+
+        units[standard_unit] = []
+        for variant in variants:
+            if not isinstance(variant, str) or not TIME_UNIT_VARIANT_PATTERN.match(variant.strip()):
+                raise ValueError(f"Неверный вариант единицы «{standard_unit}»: {variant!r} (только буквы)")
+            variant = variant.strip()
+            owner = owners.setdefault(variant.lower(), standard_unit)
+            if owner != standard_unit:
+                raise ValueError(f"Вариант «{variant}» указан для двух единиц: {owner} и {standard_unit}")
+            units[standard_unit].append(variant)
+    return units
+
+
+# Проверка файлов словаря по имени
+DICTIONARY_VALIDATORS = {
+    'roles': validate_role_table,
+    'time_units': validate_time_units
+}
+
+# Папка словарей, подпись (путь, mtime, размер) загруженных файлов и время последней проверки
+_dictionary_dir = DICTIONARY_DIR
+_dictionary_signature = None
+_dictionary_checked = 0.0
+_dictionary_lock = threading.Lock()
+# Растёт при каждой загрузке словарей: по нему сбрасываются сохранённые результаты разбора
+_dictionary_generation = 0
+
+
+def set_dictionary_dir(directory):
+    """Меняет папку словарей; файлы будут прочитаны при следующем разборе"""
+    global _dictionary_dir, _dictionary_signature, _dictionary_checked
+    _dictionary_dir = directory
+    _dictionary_signature = None
+    _dictionary_checked = 0.0
+
+
+def dictionary_path(name):
+    """Файл словаря <name>.json/.yaml/.yml в папке словарей или None"""
+    for extension in DICTIONARY_EXTENSIONS:
+        path = os.path.join(_dictionary_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_dictionary(path, name):
+    """Читает и проверяет файл словаря JSON или YAML"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+        else:
+            try:
+                data = yaml.safe_load(f)
+            except ImportError:
+                raise ValueError("Для словарей YAML нужен пакет PyYAML")
+            except yaml.YAMLError as e:
+                raise ValueError(f"Неверный YAML: {e}")
+    try:
+        return DICTIONARY_VALIDATORS[name](data)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}")
+
+
+def _dictionary_files_signature():
+    signature = []
+    for name in DICTIONARY_NAMES:
+        path = dictionary_path(name)
+        try:
+            stat = os.stat(path) if path else None
+        except FileNotFoundError:
+            stat = None
+        signature.append((path, stat.st_mtime_ns, stat.st_size) if stat else None)
+    return tuple(signature)
+
+
+def load_dictionaries():
+    """Загружает словари из папки (или встроенные) и сбрасывает построенные по ним индексы
+
+    Файлы проверяются целиком до замены таблиц: при ошибке в любом из них
+    остаются прежние словари.
+    """
+    global ROLE_TRANSLATION, TIME_UNITS, _role_resolver, _time_unit_index, _dictionary_signature
+    global _dictionary_generation
+    signature = _dictionary_files_signature()
+    roles_path, units_path = (dictionary_path(name) for name in DICTIONARY_NAMES)
+    roles = read_dictionary(roles_path, 'roles') if roles_path else BUILTIN_ROLE_TRANSLATION
+    units = read_dictionary(units_path, 'time_units') if units_path else BUILTIN_TIME_UNITS
+
+    ROLE_TRANSLATION, TIME_UNITS = roles, units
+    # Индексы перестраиваются при следующем поиске, а не на каждый запрос
+    _role_resolver = None
+    _time_unit_index = None
+    _dictionary_signature = signature
+    _dictionary_generation += 1
+
+
+def refresh_dictionaries():
+    """Перечитывает словари, если их файлы изменились; True, если словари заменены"""
+    global _dictionary_checked, _dictionary_signature
+    now = time.monotonic()
+    if now - _dictionary_checked < DICTIONARY_CHECK_INTERVAL:
+        return False
+
+    with _dictionary_lock:
+        _dictionary_checked = now
+        signature = _dictionary_files_signature()
+        if signature == _dictionary_signature:
+            return False
+        try:
+            load_dictionaries()
+        except (OSError, ValueError) as e:
+            # Ошибочный файл не перечитывается, пока его снова не изменят
+            _dictionary_signature = signature
+            print(f"Словари не перезагружены: {e}")
+            return False
+    return True
+
+
+def save_dictionary(name, data):
+    """Проверяет и записывает словарь в его файл (по умолчанию JSON), затем перезагружает словари"""
+    data = DICTIONARY_VALIDATORS[name](data)
+    path = dictionary_path(name) or os.path.join(_dictionary_dir, name + '.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Запись через временный файл: наблюдатель не увидит недописанный словарь
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        else:
+            yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+    os.replace(temp_path, path)
+
+    with _dictionary_lock:
+        load_dictionaries()
+    return path
+
+
+def dictionary_to_lines(name, table):
+    """Словарь в виде строк «ключ = значение» для редактора"""
+    if name == 'time_units':
+        return '\n'.join(f"{unit} = {', '.join(variants)}" for unit, variants in table.items())
+    return '\n'.join(f"{role} = {job}" for role, job in table.items())
+
+
+def dictionary_from_lines(name, text):
+    """Разбирает строки «ключ = значение» редактора; пустые строки и # — пропускаются"""
+    data = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        key, separator, value = line.partition('=')
+        key, value = key.strip(), value.strip()
+        if not separator:
+            raise ValueError(f"Строка {number}: нет знака «=»")
+        if key in data:
+            raise ValueError(f"Строка {number}: «{key}» указано повторно")
+        if name == 'time_units':
+            value = [variant.strip() for variant in value.split(',') if variant.strip()]
+        data[key] = value
+    return data
+
+
+def _tokenize_time(text):
+    """Разбивает строку на серии: kinds — по букве на серию ('p' — текст до первой цифры,
+    'd' — цифры, 'a' — буквы, 's' — пробелы, 'o' — прочее), values — сами серии"""
+    series = TIME_TOKEN_PATTERN.findall(text)
+    kinds = ''.join(['p' if prefix else 'd' if digits else 'a' if letters else 's' if spaces else 'o'
+                     for prefix, digits, letters, spaces, other in series])
+    return kinds, [prefix or digits or letters or spaces or other for prefix, digits, letters, spaces, other in series]
+
+
+def _unit_seconds(number, unit):
+    return int(number) * TIME_UNIT_SECONDS.get(normalize_time_unit(unit), 0)
+
+
+def time_to_seconds(time_str):
+    """Конвертирует строку времени в секунды с поддержкой разных форматов
+
+    Строка один раз разбивается на серии символов, и все форматы разбираются
+    по этим сериям. Результат совпадает с прежним разбором тремя регулярными
+    выражениями (time_to_seconds_legacy), включая его особенности: например,
+    «164ч» читается как «1 6 4ч», как и раньше.
+    """
+    text = time_str.strip()
+    return _time_tokens_seconds(text, *_tokenize_time(text))
+
+
+def _time_tokens_seconds(text, kinds, values):
+    """Секунды по сериям строки времени text без пробелов по краям"""
+    # Частые формы узнаются по одной строке видов серий
+    if kinds in TIME_PAIR_SHAPES:
+        return _pairs_seconds(kinds, values)
+    if kinds == 'dada':
+        # "16ч4м": второе число — только последняя цифра, остальные цифры уходят в первую единицу
+        return _unit_seconds(values[0], values[1] + values[2][:-1]) + _unit_seconds(values[2][-1], values[3])
+
+    # Формат "число число+единица" (например, "164 40m"): первое число — часы
+    if kinds.startswith('dsd') and 's' not in kinds[2:] and 'o' not in kinds[2:]:
+        rest = text[len(values[0]) + len(values[1]):]
+        if len(rest) >= 2:
+            if len(values) > 3:
+                number, unit = values[2], rest[len(values[2]):]
+            else:
+                number, unit = rest[:-1], rest[-1]
+            hours = int(values[0])
+            unit = normalize_time_unit(unit)
+            if unit == 'ч':
+                return (hours + int(number)) * 3600
+            if unit == 'м':
+                return hours * 3600 + int(number) * 60
+            if unit == 'с':
+                return hours * 3600 + int(number)
+            return 0
+
+    # Формат без пробелов (например, "16ч4м"): число, единица, число, единица
+    if kinds.startswith('d') and 's' not in kinds and 'o' not in kinds:
+        seconds = _compact_seconds(text, kinds, values)
+        if seconds is not None:
+            return seconds
+
+    # Пары число+единица (например, "166ч 40м")
+    total_seconds = 0
+    i = 0
+    while i < len(kinds):
+        kind, value = kinds[i], values[i]
+        i += 1
+        if kind != 'd':
+            continue
+
+        # Единица — вся серия букв и цифр сразу после числа или после пробелов
+        j = i + 1 if i < len(kinds) and kinds[i] == 's' else i
+        if j < len(kinds) and kinds[j] in 'da':
+            unit_end = j
+            while unit_end < len(kinds) and kinds[unit_end] in 'da':
+                unit_end += 1
+            total_seconds += _unit_seconds(value, ''.join(values[j:unit_end]))
+            i = unit_end
+        elif len(value) > 1:
+            # Единицей становится последняя цифра числа
+            total_seconds += _unit_seconds(value[:-1], value[-1])
+
+    if total_seconds == 0:
+        return _fallback_minutes(kinds, values)
+    return total_seconds
+
+
+def _pairs_seconds(kinds, values):
+    """Время из пар «число единица», разделённых пробелами (виды серий из TIME_PAIR_SHAPES)"""
+    if kinds == 'da' and len(values[0]) >= 3:
+        # Слитная пара из трёх и более цифр читается форматом без пробелов: "164ч" = "1 6 4ч"
+        number = values[0]
+        return _unit_seconds(number[:-2], number[-2]) + _unit_seconds(number[-1], values[1])
+
+    # Единица нормализуется здесь же, без вызова normalize_time_unit на каждую пару
+    index = get_time_unit_index()
+    total_seconds = 0
+    number = None
+    for kind, value in zip(kinds, values):
+        if kind == 'd':
+            number = value
+        elif kind == 'a':
+            unit = value.lower()
+            total_seconds += int(number) * TIME_UNIT_SECONDS.get(index.get(unit, unit), 0)
+    if total_seconds == 0:
+        return int(number) * 60
+    return total_seconds
+
+
+def _compact_seconds(text, kinds, values):
+    """Формат "число единица число единица" из серий строки без пробелов или None"""
+    n = len(text)
+    # Последняя цифра не дальше предпоследнего символа: с неё начинается второе число
+    second = -1
+    position = 0
+    second_end = 0
+    for kind, value in zip(kinds, values):
+        if kind == 'd' and position <= n - 2:
+            second = min(position + len(value) - 1, n - 2)
+            second_end = position + len(value)
+        position += len(value)
+
+    first = min(len(values[0]), second - 1)
+    if second < 0 or first < 1:
+        return None
+
+    # Второе число тянется до конца серии цифр, но оставляет единице хотя бы один символ
+    unit_start = min(second_end, n - 1)
+    return (_unit_seconds(text[:first], text[first:second]) +
+            _unit_seconds(text[second:unit_start], text[unit_start:]))
+
+
+def _fallback_minutes(kinds, values):
+    """Если единицы не найдены, последнее число считается минутами"""
+    index = kinds.rfind('d')
+    return int(values[index]) * 60 if index >= 0 else 0
+
+
+def _time_pair_end(kinds, values, index):
+    """Конец пары «число слово» с серии цифр index (с пробелами после неё) или None
+
+    Слово — все идущие подряд серии букв и цифр сразу после числа или после
+    пробелов. Без слова парой считается число хотя бы из двух цифр: его
+    последняя цифра играет роль слова, как при откате \\d+ в прежнем выражении.
+    """
+    end = index + 1
+    word = end + 1 if end < len(kinds) and kinds[end] == 's' else end
+    if word < len(kinds) and kinds[word] in 'da':
+        end = word
+        while end < len(kinds) and kinds[end] in 'da':
+            end += 1
+    elif len(values[index]) < 2:
+        return None
+    if end < len(kinds) and kinds[end] == 's':
+        end += 1
+    return end
+
+
+def _time_span(kinds, values):
+    """Серии времени в строке таблицы: (первая, после последней) или None
+
+    Повторяет поиск TIME_SEARCH_PATTERN: время начинается с первой серии цифр,
+    с которой получается пара «число слово», и продолжается такими же парами.
+    """
+    start = kinds.find('d')
+    while start >= 0:
+        end = _time_pair_end(kinds, values, start)
+        if end is not None:
+            break
+        start = kinds.find('d', start + 1)
+    else:
+        return None
+
+    while end < len(kinds) and kinds[end] == 'd':
+        following = _time_pair_end(kinds, values, end)
+        if following is None:
+            break
+        end = following
+    return start, end
+
+
+def split_time_line(line):
+    """(должность, время, секунды) строки таблицы за один проход токенизатора или None"""
+    kinds, values = _tokenize_time(line)
+    # Частая строка «должность время»: всё после текста до первой цифры — время частой формы
+    skip = 1 if kinds[:1] == 'p' else 0
+    shape = kinds[skip:]
+    if shape in TIME_PAIR_SHAPES or shape == 'dada':
+        time_str = line[len(values[0]):] if skip else line
+        return (values[0].strip() if skip else ''), time_str, _time_tokens_seconds(time_str, shape, values[skip:])
+
+    span = _time_span(kinds, values)
+    if span is None:
+        return None
+
+    start, end = span
+    begin = sum(map(len, values[:start]))
+    finish = begin + sum(map(len, values[start:end]))
+    # Пробелы после времени вырезаются вместе с ним, как и раньше
+    if kinds[end - 1] == 's':
+        end -= 1
+    time_str = ''.join(values[start:end])
+    return ((line[:begin] + line[finish:]).strip(), time_str,
+            _time_tokens_seconds(time_str, kinds[start:end], values[start:end]))
+
+
+def split_time_line_legacy(line):
+    """Прежнее деление строки: поиск TIME_SEARCH_PATTERN, замена и разбор времени (эталон для bench-time)"""
+    time_match = TIME_SEARCH_PATTERN.search(line)
+    if not time_match:
+        return None
+    time_str = time_match.group(1)
+    return line.replace(time_str, '').strip(), time_str.strip(), time_to_seconds_legacy(time_str)
+
+
+def _normalize_time_unit_legacy(unit):
+    """Прежняя нормализация единицы перебором списков TIME_UNITS"""
+    unit = unit.lower().strip()
+
+    # Ищем единицу в словаре вариантов
+    for standard_unit, variants in TIME_UNITS.items():
+        if unit in variants:
+            return standard_unit
+
+    return unit
+
+
+def time_to_seconds_legacy(time_str):
+    """Прежний разбор времени тремя регулярными выражениями (эталон для bench-time)"""
+    total_seconds = 0
+
+    # Очищаем строку от лишних пробелов
+    time_str = time_str.strip()
+
+    # Обработка формата "число число+единица" (например, "164 40m")
+    # Ищем шаблон: число [пробел] число+единица
+    double_num_match = re.match(r'^(\d+)\s+(\d+)(\w+)$', time_str)
+    if double_num_match:
+        num1 = int(double_num_match.group(1))
+        num2 = int(double_num_match.group(2))
+        unit = _normalize_time_unit_legacy(double_num_match.group(3))
+
+        # Интерпретация зависит от единицы измерения
+        if unit == 'ч':
+            # Оба числа в часах (например, "164 40ч" = 164 часа + 40 часов)
+            total_seconds += (num1 + num2) * 3600
+        elif unit == 'м':
+            # Первое число - часы, второе - минуты (например, "164 40м" = 164 часа + 40 минут)
+            total_seconds += num1 * 3600 + num2 * 60
+        elif unit == 'с':
+            # Первое число - часы, второе - секунды (например, "164 40с" = 164 часа + 40 секунд)
+            total_seconds += num1 * 3600 + num2
+        return total_seconds
+
+    # Обработка формата без пробелов (например, "16ч4м")
+    # Ищем шаблон: число+единица число+единица
+    compact_match = re.match(r'^(\d+)(\w+)(\d+)(\w+)$', time_str)
+    if compact_match:
+        num1 = int(compact_match.group(1))
+        unit1 = _normalize_time_unit_legacy(compact_match.group(2))
+        num2 = int(compact_match.group(3))
+        unit2 = _normalize_time_unit_legacy(compact_match.group(4))
+
+        # Обрабатываем первое число
+        if unit1 == 'ч':
+            total_seconds += num1 * 3600
+        elif unit1 == 'м':
+            total_seconds += num1 * 60
+        elif unit1 == 'с':
+            total_seconds += num1
+
+        # Обрабатываем второе число
+        if unit2 == 'ч':
+            total_seconds += num2 * 3600
+        elif unit2 == 'м':
+            total_seconds += num2 * 60
+        elif unit2 == 'с':
+            total_seconds += num2
+
+        return total_seconds
+
+    # Обработка формата с явными единицами (например, "166ч 40м")
+    # Ищем все пары число+единица
+    time_parts = re.findall(r'(\d+)\s*(\w+)', time_str)
+
+    for num_str, unit in time_parts:
+        num = int(num_str)
+        unit = _normalize_time_unit_legacy(unit)
+
+        if unit == 'ч':
+            total_seconds += num * 3600
+        elif unit == 'м':
+            total_seconds += num * 60
+        elif unit == 'с':
+            total_seconds += num
+
+    # Если не найдено ни одной единицы, но есть числа, предполагаем что это минуты
+    if total_seconds == 0:
+        numbers = re.findall(r'(\d+)', time_str)
+        if numbers:
+            # Берем последнее найденное число как минуты
+            total_seconds = int(numbers[-1]) * 60
+
+    return total_seconds
+
+
+def process_text(text, player_nickname):
+    """Обрабатывает текст и генерирует команды"""
+    refresh_dictionaries()
+    commands = []
+
+    # Разделение текста на строки
+    lines = text.split('\n')
+
+    # Обрабатываем каждую строку
+    rows = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # Время и должность отделяются за один проход по сериям символов строки
+        parsed = split_time_line(line)
+        if not parsed:
+            continue
+
+        rows += 1
+        role_str, time_str, seconds = parsed
+        command = build_command(role_str, time_str, player_nickname, seconds)
+        if command:
+            commands.append(command)
+
+    # Время разбора меряет вызывающий целиком, здесь только счётчик: на каждую строку метрики дороги
+    get_metrics().count('parsed_rows', rows)
+    return commands
+
+
+class IncrementalParser:
+    """Разбор текста с памятью результатов по строкам
+
+    Строки разбираются независимо, поэтому при правке текста заново
+    разбираются только новые и изменённые строки. Память сбрасывается при
+    смене ника или перезагрузке словарей и хранит только строки текущего текста.
+    """
+
+    def __init__(self):
+        self._memo = {}
+        self._key = None
+        self.parsed_lines = 0
+
+    def parse(self, text, nickname, policy=None):
+        """Команды текста, как у process_text, со слиянием повторов по policy"""
+        refresh_dictionaries()
+        if self._key != (nickname, _dictionary_generation):
+            self._key = (nickname, _dictionary_generation)
+            self._memo = {}
+
+        memo = {}
+        commands = []
+        self.parsed_lines = 0
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line not in memo:
+                if line in self._memo:
+                    memo[line] = self._memo[line]
+                else:
+                    memo[line] = process_text(line, nickname)
+                    self.parsed_lines += 1
+            commands.extend(memo[line])
+
+        self._memo = memo
+        return aggregate_commands(commands, policy)
+
+
+def lookup_role(role_str):
+    """Идентификатор должности для строки из OCR или None"""
+    match = get_role_resolver().resolve(role_str)
+    return match.job if match else None
+
+
+def build_command(role_str, time_str, player_nickname, seconds=None):
+    """Формирует команду для пары должность/время или возвращает None; seconds — уже разобранное время"""
+    metrics = get_metrics()
+
+    # Конвертация времени
+    if seconds is None:
+        seconds = time_to_seconds(time_str)
+    if seconds == 0:
+        metrics.count('zero_time_rows')
+        return None
+
+    # Перевод должности с учётом опечаток OCR
+    match = get_role_resolver().resolve(role_str)
+    if not match:
+        metrics.count('unknown_roles')
+        print(f"Неизвестная должность: {role_str}")
+        return None
+    if match.distance:
+        metrics.count('corrected_roles')
+        print(f"Исправлена должность: {role_str} -> {match.name}")
+
+    # Формирование команды
+    command = format_command(PlaytimeEntry(player_nickname, match.job, seconds))
+    print(f"Сгенерирована команда: {command}")
+    print(f"  Время: {time_str} -> {seconds} секунд")
+    return command
+
+
+def format_command(entry):
+    """Команда консоли для начисления времени"""
+    return f"playtime_addrole {entry.nickname} {entry.job} {entry.seconds}"
+
+
+def parse_command(command):
+    """PlaytimeEntry из команды playtime_addrole или None"""
+    match = COMMAND_PATTERN.match(command.strip())
+    if not match:
+        return None
+    return PlaytimeEntry(match.group(1), match.group(2), int(match.group(3)))
+
+
+def iter_command_entries(lines):
+    """Начисления из строк файла команд; пустые строки и комментарии пропускаются"""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        entry = parse_command(line)
+        if entry is None:
+            print(f"Пропущена строка: {line}")
+            continue
+        yield entry
+
+
+def aggregate_entries(entries, policy='max'):
+    """Сливает начисления по (ник, должность) и возвращает их в детерминированном порядке
+
+    Повторы появляются из перекрывающихся скриншотов: по умолчанию берётся
+    большее значение, чтобы время не считалось дважды. Нулевые начисления
+    отбрасываются, результат отсортирован по нику и должности.
+    """
+    if policy not in AGGREGATE_POLICIES:
+        raise ValueError(f"Неизвестный способ слияния: {policy}")
+
+    merged = {}
+    for entry in entries:
+        key = (entry.nickname, entry.job)
+        current = merged.get(key)
+        if current is None or policy == 'last':
+            merged[key] = entry.seconds
+        elif policy == 'sum':
+            merged[key] = current + entry.seconds
+        else:
+            merged[key] = max(current, entry.seconds)
+
+    return [PlaytimeEntry(nickname, job, seconds)
+            for (nickname, job), seconds in sorted(merged.items(), key=lambda item: (item[0][0].lower(), item[0]))
+            if seconds > 0]
+
+
+def aggregate_commands(commands, policy='max'):
+    """Команды после слияния повторов; policy None оставляет команды как есть"""
+    if not policy:
+        return list(commands)
+    return [format_command(entry) for entry in aggregate_entries(iter_command_entries(commands), policy)]
+
+
+def export_command_script(entries, output):
+    """Пишет скрипт команд консоли (одна команда в строке) и возвращает число команд"""
+    output.write(f"# playtime_addrole, экспорт {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    count = 0
+    for entry in entries:
+        output.write(format_command(entry) + '\n')
+        count += 1
+    return count
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _write_sql_batch(batch, output):
+    values = ',\n'.join(f"    ({_sql_string(nickname)}, {_sql_string(job)}, {seconds})"
+                        for (nickname, job), seconds in batch.items())
+    output.write(
+        "INSERT INTO play_time (player_id, tracker, time_spent)\n"
+        "SELECT p.user_id, v.tracker, make_interval(secs => v.seconds)\n"
+        f"FROM (VALUES\n{values}\n) AS v(nickname, tracker, seconds)\n"
+        "JOIN player p ON p.last_seen_user_name = v.nickname\n"
+        "ON CONFLICT (player_id, tracker) DO UPDATE SET time_spent = play_time.time_spent + EXCLUDED.time_spent;\n")
+
+
+def export_sql_script(entries, output, batch_size=EXPORT_SQL_BATCH_SIZE):
+    """Пишет скрипт PostgreSQL с пакетными upsert в play_time и возвращает число начислений
+
+    Время добавляется к существующему, как у playtime_addrole. Игрок ищется по
+    last_seen_user_name; ники, которых нет в таблице player, пропускаются.
+    """
+    output.write(f"-- playtime_addrole, экспорт {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    output.write("BEGIN;\n")
+    count = 0
+    batch = {}
+    for entry in entries:
+        # В одном INSERT ... ON CONFLICT ключ не может встречаться дважды
+        key = (entry.nickname, entry.job)
+        batch[key] = batch.get(key, 0) + entry.seconds
+        count += 1
+        if len(batch) >= batch_size:
+            _write_sql_batch(batch, output)
+            batch = {}
+    if batch:
+        _write_sql_batch(batch, output)
+    output.write("COMMIT;\n")
+    return count
+
+
+# Форматы экспорта
+EXPORT_FORMATS = {
+    'sql': export_sql_script,
+    'script': export_command_script
+}
+
+
+def process_rows(rows, player_nickname):
+    """Генерирует команды из строк таблицы, выделенных по рамкам слов"""
+    refresh_dictionaries()
+    commands = []
+    for row in rows:
+        command = build_command(row.role, row.time, player_nickname)
+        if command:
+            commands.append(command)
+    get_metrics().count('parsed_rows', len(rows))
+    return commands
+
+
+def _is_time_token(text):
+    """Слово из колонки времени: начинается с цифры или является единицей времени"""
+    return text[0].isdigit() or normalize_time_unit(text) in TIME_UNITS
+
+
+def group_words_into_rows(words):
+    """Группирует слова в строки таблицы по вертикальному положению"""
+    rows = []
+    for word in sorted(words, key=lambda w: (w.top + w.bottom) / 2):
+        center = (word.top + word.bottom) / 2
+        # Слово относится к строке, если его центр попадает в высоту первого слова строки
+        if rows and rows[-1][0].top <= center <= rows[-1][0].bottom:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    return [sorted(row, key=lambda w: w.left) for row in rows]
+
+
+def _time_column_index(row_words):
+    """Индекс первого слова времени в строке: до конца строки только числа и единицы"""
+    index = None
+    for i in range(len(row_words) - 1, -1, -1):
+        text = row_words[i].text
+        if not _is_time_token(text):
+            break
+        if text[0].isdigit():
+            index = i
+    return index
+
+
+def find_column_boundary(word_rows):
+    """Граница колонок — середина промежутка между концом должностей и началом времени"""
+    role_ends = []
+    time_starts = []
+    for row_words in word_rows:
+        index = _time_column_index(row_words)
+        if index:
+            role_ends.append(row_words[index - 1].right)
+            time_starts.append(row_words[index].left)
+
+    if not role_ends:
+        return None
+    return (statistics.median(role_ends) + statistics.median(time_starts)) / 2
+
+
+def _split_row(row_words, boundary):
+    """Делит слова строки на должность и время, возвращает OcrRow или None"""
+    if boundary is not None:
+        # Случайные цифры в колонке должностей остаются частью должности
+        role_words = [w for w in row_words if (w.left + w.right) / 2 < boundary]
+        time_words = [w for w in row_words if (w.left + w.right) / 2 >= boundary]
+    else:
+        index = _time_column_index(row_words)
+        if index is None:
+            return None
+        role_words, time_words = row_words[:index], row_words[index:]
+
+    if not role_words or not time_words:
+        return None
+
+    return OcrRow(
+        role=' '.join(w.text for w in role_words),
+        time=' '.join(w.text for w in time_words),
+        confidence=sum(w.conf for w in row_words) / len(row_words),
+        box=(min(w.left for w in row_words), min(w.top for w in row_words),
+             max(w.right for w in row_words), max(w.bottom for w in row_words)),
+    )
+
+
+def extract_rows(words, boundary=None):
+    """Выделяет строки (должность, время) из слов, разделяя колонки по координате x"""
+    word_rows = group_words_into_rows(words)
+    if boundary is None:
+        boundary = find_column_boundary(word_rows)
+
+    rows = []
+    for row_words in word_rows:
+        row = _split_row(row_words, boundary)
+        if row:
+            rows.append(row)
+    return rows
+
+
+def row_is_valid(row):
+    """Строка переводится в команду: время ненулевое и должность известна"""
+    return time_to_seconds(row.time) > 0 and lookup_role(row.role) is not None
+
+
+def is_service_row(row):
+    """Заголовок или итоговая строка таблицы"""
+    words = row.role.lower().split()
+    return bool(words) and words[0].rstrip(':') in TABLE_SERVICE_WORDS
+
+
+def row_is_retryable(row):
+    """Повторное распознавание может помочь: в колонке времени есть цифра"""
+    return any(character.isdigit() for character in row.time)
+
+
+def _recognize_row(backend, image, row, boundary, variant, scale):
+    """Повторно распознаёт одну строку по её рамке с параметрами варианта"""
+    padding = ROW_RETRY_OPTIONS['padding']
+    left, top, right, bottom = row.box
+    # Рамка задана в координатах предобработанного изображения
+    origin = (max(0, int(left / scale) - padding), max(0, int(top / scale) - padding))
+    crop = image.crop((origin[0], origin[1],
+                       min(image.width, int(right / scale) + padding),
+                       min(image.height, int(bottom / scale) + padding)))
+
+    options = dict(PREPROCESS_OPTIONS, upscale=variant['upscale'], threshold=variant['threshold'])
+    if variant['invert']:
+        crop = ImageOps.invert(crop.convert('L'))
+        options['invert_dark'] = False
+    processed = preprocess_image(crop, options)
+
+    # Возвращаем слова в координаты страницы, чтобы применить ту же границу колонок
+    def to_page(value, offset):
+        return (offset + value / variant['upscale']) * scale
+
+    words = [OcrWord(w.text, to_page(w.left, origin[0]), to_page(w.top, origin[1]),
+                     to_page(w.right, origin[0]), to_page(w.bottom, origin[1]), w.conf)
+             for w in backend.image_to_words(processed, psm=variant['psm'])]
+    if not words:
+        return None
+    return _split_row(sorted(words, key=lambda w: w.left), boundary)
+
+
+def refine_rows(backend, image, rows, boundary):
+    """Повторно распознаёт только слабые строки: низкая уверенность или не удалось разобрать
+
+    Заголовок и итоговая строка отбрасываются, а строки без цифр в колонке
+    времени остаются как есть: перебор вариантов их не исправит, но умножил
+    бы число вызовов OCR на каждой странице.
+    """
+    scale = max(1, int(PREPROCESS_OPTIONS.get('upscale', 1)))
+    refined = []
+    for row in rows:
+        if is_service_row(row):
+            continue
+        valid = row_is_valid(row)
+        if valid and row.confidence >= ROW_RETRY_OPTIONS['min_confidence'] or not row_is_retryable(row):
+            refined.append(row)
+            continue
+
+        best, best_valid = row, valid
+        get_metrics().count('rows_retried')
+        for variant in ROW_RETRY_VARIANTS:
+            candidate = _recognize_row(backend, image, row, boundary, variant, scale)
+            if candidate is None or not row_is_valid(candidate):
+                continue
+            if not best_valid or candidate.confidence > best.confidence:
+                best, best_valid = candidate, True
+            if best.confidence >= ROW_RETRY_OPTIONS['min_confidence']:
+                break
+
+        if best is not row:
+            get_metrics().count('rows_refined')
+            print(f"Повторно распознана строка: {row.role} {row.time} -> {best.role} {best.time}")
+        refined.append(best)
+    return refined
+
+
+def rows_to_text(rows):
+    """Текст для редактируемого поля: по строке "должность время" на запись"""
+    return ''.join(f"{row.role} {row.time}\n" for row in rows)
+
+
+class OcrCache:
+    """Кэш распознанного текста на диске с вытеснением давно использованных записей"""
+
+    def __init__(self, directory, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+
+    @staticmethod
+    def make_key(image_bytes, *parameters):
+        """Ключ записи: хэш содержимого изображения и всех параметров распознавания"""
+        digest = hashlib.sha256(image_bytes)
+        for parameter in parameters:
+            digest.update(b'\0')
+            digest.update(json.dumps(parameter, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.txt')
+
+    def get(self, key):
+        """Возвращает текст из кэша или None"""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+
+        # Время изменения файла служит меткой последнего использования
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return text
+
+    def put(self, key, text):
+        """Сохраняет текст в кэш"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Запись через временный файл, чтобы параллельные процессы не читали половину записи
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        # Перезаписанная запись больше не занимает места
+        try:
+            previous = os.path.getsize(path)
+        except FileNotFoundError:
+            previous = 0
+        os.replace(temp_path, path)
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(path) - previous
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """Записи кэша: (время использования, размер, путь)"""
+        entries = []
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith('.txt'):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Удаляет давно использованные записи, пока кэш не уложится в 90% лимита"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+@functools.lru_cache(maxsize=None)
+def get_ocr_cache():
+    """Общий кэш распознавания приложения"""
+    return OcrCache(os.path.join(APP_DATA_DIR, 'ocr-cache'))
+
+
+def needs_tiling(image, options=None):
+    """Не уложится ли обработка изображения целиком в лимит памяти"""
+    options = options or TILE_OPTIONS
+    factor = int(PREPROCESS_OPTIONS.get('upscale', 1))
+    # Исходный RGBA-битмап плюс рабочие копии предобработки и Tesseract
+    needed = image.width * image.height * (4 + TILE_BYTES_PER_PIXEL * factor * factor)
+    return bool(options['memory_limit']) and needed > options['memory_limit']
+
+
+def open_image(source, options=None):
+    """Открывает изображение; большое сразу переводится в оттенки серого
+
+    Для JPEG draft декодирует изображение прямо в оттенки серого без
+    полноцветной копии, остальные форматы переводятся после декодирования.
+    В памяти остаётся один байт на пиксель, остальное обрабатывается полосами.
+    """
+    image = Image.open(source)
+    if not needs_tiling(image, options):
+        return image
+    image.draft('L', image.size)
+    return image if image.mode == 'L' else image.convert('L')
+
+
+def tile_strips(image, options=None):
+    """Границы (top, bottom) перекрывающихся горизонтальных полос под лимит памяти"""
+    options = options or TILE_OPTIONS
+    factor = int(PREPROCESS_OPTIONS.get('upscale', 1))
+    overlap = options['overlap']
+
+    # Из лимита вычитается сама страница в оттенках серого, остаток делится между полосами
+    budget = options['memory_limit'] - image.width * image.height
+    per_row = image.width * factor * factor * TILE_BYTES_PER_PIXEL * max(1, options['workers'])
+    height = max(budget // per_row, 4 * overlap)
+
+    strips = []
+    top = 0
+    while True:
+        bottom = min(top + height, image.height)
+        strips.append((top, bottom))
+        if bottom >= image.height:
+            return strips
+        top = bottom - overlap
+
+
+def tiled_words(backend, image, options=None):
+    """Слова страницы, распознанной по полосам, в координатах целой предобработанной страницы
+
+    Слово достаётся той полосе, в чьей средней части (без половины перекрытия
+    с каждой стороны) лежит его центр, поэтому строки на стыке полос не
+    теряются и не повторяются.
+    """
+    options = options or TILE_OPTIONS
+    factor = int(PREPROCESS_OPTIONS.get('upscale', 1))
+    half = options['overlap'] / 2
+    if image.mode != 'L':
+        image = image.convert('L')
+    histogram = image.histogram()
+    metrics = get_metrics()
+
+    def recognize_strip(strip):
+        top, bottom = strip
+        with metrics.span('tile_preprocess'):
+            processed = preprocess_image(image.crop((0, top, image.width, bottom)), histogram=histogram)
+        with metrics.span('tile_ocr'):
+            words = backend.image_to_words(processed)
+
+        core_top = (top + half if top else 0) * factor
+        core_bottom = (bottom - half if bottom < image.height else bottom) * factor
+        offset = top * factor
+        return [OcrWord(w.text, w.left, w.top + offset, w.right, w.bottom + offset, w.conf) for w in words
+                if core_top <= (w.top + w.bottom) / 2 + offset < core_bottom]
+
+    strips = tile_strips(image, options)
+    metrics.count('tiles', len(strips))
+    if options['workers'] > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(recognize_strip, strips))
+    else:
+        results = map(recognize_strip, strips)
+    return [word for words in results for word in words]
+
+
+def _page_words(backend, processed_image, image):
+    """Слова страницы: с целого предобработанного изображения или по полосам"""
+    if processed_image is None:
+        return tiled_words(backend, image)
+    return backend.image_to_words(processed_image)
+
+
+def _recognize_cached(image_path, use_cache, mode, recognize):
+    """Чтение изображения, кэш и предобработка, общие для всех режимов распознавания"""
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+
+    backend = get_ocr_backend()
+    metrics = get_metrics()
+
+    if use_cache:
+        with metrics.span('cache'):
+            cache = get_ocr_cache()
+            key = OcrCache.make_key(image_bytes, mode, PREPROCESS_OPTIONS, TILE_OPTIONS, OCR_CONFIG,
+                                    backend.name, backend.version())
+            result = cache.get(key)
+        if result is not None:
+            metrics.count('cache_hits')
+            return result
+        metrics.count('cache_misses')
+
+    # Открываем и обрабатываем изображение; большое обрабатывается полосами при распознавании
+    with metrics.span('preprocess'):
+        image = open_image(io.BytesIO(image_bytes))
+        processed_image = None if needs_tiling(image) else preprocess_image(image)
+
+    with metrics.span('ocr'):
+        result = recognize(backend, processed_image, image)
+
+    if use_cache:
+        cache.put(key, result)
+    return result
+
+
+def _recognize_text(backend, processed_image, image):
+    """Сплошной текст; по полосам — строки из слов, сгруппированных по высоте"""
+    if processed_image is not None:
+        return backend.image_to_string(processed_image)
+    rows = group_words_into_rows(tiled_words(backend, image))
+    return ''.join(' '.join(word.text for word in row) + '\n' for row in rows)
+
+
+def recognize_image(image_path, use_cache=True):
+    """Распознаёт текст на изображении"""
+    return _recognize_cached(image_path, use_cache, 'text', _recognize_text)
+
+
+def _layout_rows(backend, processed_image, image):
+    """Строки таблицы за один проход OCR с повторным распознаванием только слабых строк"""
+    words = _page_words(backend, processed_image, image)
+    boundary = find_column_boundary(group_words_into_rows(words))
+    return refine_rows(backend, image, extract_rows(words, boundary), boundary)
+
+
+def _recognize_layout(backend, processed_image, image):
+    return json.dumps(_layout_rows(backend, processed_image, image), ensure_ascii=False)
+
+
+def recognize_frame_rows(image):
+    """Строки таблицы со снимка в памяти (кадры съёмки экрана не кэшируются)"""
+    backend = get_ocr_backend()
+    metrics = get_metrics()
+    with metrics.span('preprocess'):
+        processed_image = None if needs_tiling(image) else preprocess_image(image)
+    with metrics.span('ocr'):
+        return _layout_rows(backend, processed_image, image)
+
+
+def recognize_rows(image_path, use_cache=True):
+    """Распознаёт строки таблицы (должность, время, уверенность, рамка)
+
+    Отбор строк для повтора зависит от словаря должностей, поэтому в ключ
+    кэша входит подпись файлов словарей: после их правки страница
+    распознаётся заново.
+    """
+    refresh_dictionaries()
+    payload = _recognize_cached(image_path, use_cache,
+                                ('layout', ROW_RETRY_OPTIONS, ROW_RETRY_VARIANTS, _dictionary_signature),
+                                _recognize_layout)
+    return [OcrRow(role, time_str, confidence, tuple(box))
+            for role, time_str, confidence, box in json.loads(payload)]
+
+
+def ocr_image(image_path, player_nickname, use_cache=True, mode='layout'):
+    """Распознаёт изображение и возвращает текст для поля правки и команды
+
+    В режиме 'layout' строки выделяются по рамкам слов за один проход OCR,
+    в режиме 'text' разбирается сплошной текст.
+    """
+    metrics = get_metrics()
+    metrics.count('images')
+    if mode == 'layout':
+        rows = recognize_rows(image_path, use_cache)
+        with metrics.span('parse'):
+            return rows_to_text(rows), process_rows(rows, player_nickname)
+
+    text = recognize_image(image_path, use_cache)
+    with metrics.span('parse'):
+        return text, process_text(text, player_nickname)
+
+
+def process_image(image_path, player_nickname, use_cache=True, mode='layout'):
+    """Обрабатывает изображение и генерирует команды"""
+    try:
+        return ocr_image(image_path, player_nickname, use_cache, mode)
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось обработать изображение: {str(e)}")
+        return "", []
+
+
+def _resolve_manifest_path(base_dir, path):
+    """Разрешает путь из манифеста относительно папки манифеста"""
+    path = os.path.expanduser(str(path).strip())
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return os.path.normpath(path)
+
+
+def _jobs_from_directory(directory):
+    """Задания из папки вида <папка>/<ник>/<скриншоты>"""
+    jobs = []
+    for nickname in sorted(os.listdir(directory)):
+        player_dir = os.path.join(directory, nickname)
+        if not os.path.isdir(player_dir):
+            continue
+        for file_name in sorted(os.listdir(player_dir)):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                jobs.append((nickname, os.path.join(player_dir, file_name)))
+    return jobs
+
+
+def _jobs_from_json(manifest_path):
+    """Задания из JSON: {"ник": ["путь", ...]} или [{"nickname": ..., "images": [...]}]"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8-sig') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        entries = data.items()
+    else:
+        entries = [(item['nickname'], item.get('images', item.get('image', []))) for item in data]
+
+    jobs = []
+    for nickname, images in entries:
+        if isinstance(images, str):
+            images = [images]
+        for image in images:
+            jobs.append((str(nickname).strip(), _resolve_manifest_path(base_dir, image)))
+    return jobs
+
+
+def _jobs_from_csv(manifest_path):
+    """Задания из CSV: ник,путь[,путь...] — по строке на игрока или на скриншот"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, encoding='utf-8-sig', newline='') as f:
+        for row_number, row in enumerate(csv.reader(f)):
+            cells = [cell.strip() for cell in row if cell.strip()]
+            if len(cells) < 2:
+                continue
+            # Пропускаем строку заголовка
+            if row_number == 0 and cells[0].lower() in ('nickname', 'nick', 'ник'):
+                continue
+            for image in cells[1:]:
+                jobs.append((cells[0], _resolve_manifest_path(base_dir, image)))
+    return jobs
+
+
+def load_batch_jobs(source):
+    """Собирает список заданий (ник, путь к изображению) из манифеста или папки"""
+    if os.path.isdir(source):
+        return _jobs_from_directory(source)
+
+    extension = os.path.splitext(source)[1].lower()
+    if extension == '.json':
+        return _jobs_from_json(source)
+    if extension == '.csv':
+        return _jobs_from_csv(source)
+
+    raise ValueError(f"Неподдерживаемый формат манифеста: {source}")
+
+
+# Параметры распознавания в процессе пула
+_batch_options = {'use_cache': True, 'mode': 'layout'}
+
+
+def _init_batch_worker(options, dictionary_dir=DICTIONARY_DIR, tile_options=None):
+    """Инициализация процесса пула пакетной обработки"""
+    _batch_options.update(options)
+    set_dictionary_dir(dictionary_dir)
+    TILE_OPTIONS.update(tile_options or {})
+    # Параллелизм даёт пул процессов, потоки OpenMP внутри Tesseract только мешают
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    # Движок каждого процесса инициализируется один раз и остаётся тёплым на все его задания
+    setup_tesseract()
+
+
+def _process_batch_job(job):
+    """Обрабатывает одно изображение пакета и возвращает отчёт"""
+    nickname, image_path = job
+    started = time.perf_counter()
+    report = {'nickname': nickname, 'image': image_path, 'commands': [], 'text': '', 'error': None}
+
+    # Метрики процесса пула обнуляются на каждое задание и возвращаются в отчёте
+    metrics = get_metrics()
+    metrics.reset()
+    try:
+        report['text'], report['commands'] = ocr_image(image_path, nickname, **_batch_options)
+    except Exception as e:
+        report['error'] = str(e)
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['stages'] = {name: round(total, 4) for name, total in metrics.totals().items()}
+    report['counters'] = dict(metrics.counters)
+    return report
+
+
+def run_batch(jobs, output_path, report_path=None, workers=None, progress=None, use_cache=True, mode='layout',
+              policy='max'):
+    """Распознаёт все изображения пакета в пуле процессов и записывает общий файл команд
+
+    При заданном policy повторы (ник, должность) со всех скриншотов сливаются
+    перед записью, иначе команды пишутся по мере готовности в порядке заданий.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    started = time.perf_counter()
+    reports = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=({'use_cache': use_cache, 'mode': mode}, _dictionary_dir, TILE_OPTIONS)) as pool, \
+            open(output_path, 'w', encoding='utf-8') as output:
+        # map сохраняет порядок заданий, поэтому файл команд детерминирован
+        for done, report in enumerate(pool.map(_process_batch_job, jobs), 1):
+            if not policy:
+                for command in report['commands']:
+                    output.write(command + '\n')
+            reports.append(report)
+            if progress:
+                progress(done, len(jobs), report)
+
+        if policy:
+            commands = (command for report in reports for command in report['commands'])
+            for command in aggregate_commands(commands, policy):
+                output.write(command + '\n')
+
+    if report_path:
+        stages = Counter()
+        counters = Counter()
+        for report in reports:
+            stages.update(report['stages'])
+            counters.update(report['counters'])
+        summary = {
+            'images': len(reports),
+            'failed': sum(1 for report in reports if report['error']),
+            'commands': sum(len(report['commands']) for report in reports),
+            'workers': workers,
+            'seconds': round(time.perf_counter() - started, 3),
+            # Суммарное время этапов по всем процессам
+            'stages': {name: round(total, 3) for name, total in sorted(stages.items())},
+            'counters': dict(sorted(counters.items())),
+            'results': reports,
+        }
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    return reports
+
+
+def load_bench_fonts(paths=None):
+    """Пути шрифтов, которые удалось загрузить; по умолчанию — системные шрифты из BENCH_FONTS"""
+    fonts = []
+    for path in paths or BENCH_FONTS:
+        try:
+            font = ImageFont.truetype(path, 16)
+        except OSError:
+            continue
+        fonts.append(font.path)
+    return fonts
+
+
+def _bench_time_string(rng, seconds):
+    """Время в одном из вариантов написания TIME_UNITS, как его может показать игра или OCR"""
+    hours, minutes = divmod(seconds // 60, 60)
+    hour_unit = rng.choice(TIME_UNITS['ч'])
+    minute_unit = rng.choice(TIME_UNITS['м'])
+    separator = rng.choice((' ', ' ', ''))
+    if not hours:
+        return f"{minutes}{minute_unit}"
+    if not minutes:
+        return f"{hours}{hour_unit}"
+    return f"{hours}{hour_unit}{separator}{minutes}{minute_unit}"
+
+
+def render_playtime_table(rows, font_path, scale=1.0, theme='dark', noise=0.0, seed=0):
+    """Рисует таблицу «должность — время» в стиле окна времени игры SS14"""
+    background, header_color, text_color = BENCH_THEMES[theme]
+    font = ImageFont.truetype(font_path, max(8, round(18 * scale)))
+    row_height = round(30 * scale)
+    padding = round(12 * scale)
+    time_column = round(360 * scale)
+
+    image = Image.new('RGB', (round(640 * scale), row_height * (len(rows) + 1) + 2 * padding), background)
+    draw = ImageDraw.Draw(image)
+    draw.text((padding, padding), "Должность", font=font, fill=header_color)
+    draw.text((time_column, padding), "Время", font=font, fill=header_color)
+    for i, (role, time_str) in enumerate(rows, 1):
+        top = padding + i * row_height
+        draw.text((padding, top), role, font=font, fill=text_color)
+        draw.text((time_column, top), time_str, font=font, fill=text_color)
+
+    if noise:
+        # Шум из собственного генератора, чтобы корпус повторялся от запуска к запуску
+        rng = random.Random(seed)
+        grain = Image.frombytes('L', image.size, rng.randbytes(image.width * image.height)).convert('RGB')
+        image = Image.blend(image, grain, noise)
+    return image
+
+
+def _add_text_noise(rng, text, rate):
+    """Подменяет кириллические буквы похожими латинскими, как это делает OCR"""
+    lookalikes = {'а': 'a', 'е': 'e', 'о': 'o', 'р': 'p', 'с': 'c', 'х': 'x', 'у': 'y', 'к': 'k', 'м': 'm', 'т': 't'}
+    return ''.join(lookalikes[char] if char in lookalikes and rng.random() < rate else char for char in text)
+
+
+def synthetic_corpus(count, seed=0, fonts=None, rows_per_image=BENCH_ROWS_PER_IMAGE, text_noise=0.0):
+    """Детерминированный набор таблиц времени с известным эталоном
+
+    Должности по кругу обходят все ключи ROLE_TRANSLATION, время пишется
+    разными вариантами TIME_UNITS; шрифт, масштаб, шум и тема чередуются.
+    Без fonts изображения не рисуются (бенчмарк разбора текста).
+    """
+    rng = random.Random(seed)
+    refresh_dictionaries()
+    roles = sorted(ROLE_TRANSLATION)
+    cursor = 0
+    for i in range(count):
+        rows = []
+        truth = Counter()
+        for _ in range(rows_per_image):
+            role = roles[cursor % len(roles)]
+            cursor += 1
+            seconds = rng.choice((rng.randint(1, 59), rng.randint(1, 300) * 60 + rng.randint(0, 59))) * 60
+            rows.append((role[0].upper() + role[1:], _bench_time_string(rng, seconds)))
+            truth[(ROLE_TRANSLATION[role], seconds)] += 1
+
+        text = '\n'.join(f"{role} {time_str}" for role, time_str in rows)
+        if text_noise:
+            text = _add_text_noise(rng, text, text_noise)
+
+        image = None
+        if fonts:
+            image = render_playtime_table(rows, fonts[i % len(fonts)], rng.choice(BENCH_SCALES),
+                                          ('dark', 'light')[i % 2], rng.choice(BENCH_NOISE), seed + i)
+        yield BenchSample(f"synthetic-{seed}-{i:04}", image, text, truth)
+
+
+def _score_commands(truth, commands):
+    """Число верных строк и всех найденных строк относительно эталона"""
+    found = Counter()
+    for command in commands:
+        entry = parse_command(command)
+        if entry:
+            found[(entry.job, entry.seconds)] += 1
+    return sum((truth & found).values()), sum(found.values())
+
+
+def run_benchmark(samples, mode='layout', parse_only=False, corpus_dir=None):
+    """Прогоняет образцы через распознавание (или только разбор текста) и считает скорость и точность"""
+    metrics = get_metrics()
+    metrics.reset()
+    directory = corpus_dir or tempfile.mkdtemp(prefix='timebot-bench-')
+    images = rows = correct = found = 0
+    elapsed = 0.0
+
+    for sample in samples:
+        if parse_only:
+            started = time.perf_counter()
+            with metrics.span('parse'):
+                commands = process_text(sample.text, 'bench')
+            elapsed += time.perf_counter() - started
+        else:
+            # Образцы сохраняются как обычные скриншоты, чтобы пройти весь путь распознавания
+            image_path = os.path.join(directory, sample.name + '.png')
+            sample.image.save(image_path)
+            with open(os.path.splitext(image_path)[0] + '.gt.txt', 'w', encoding='utf-8') as f:
+                f.write(sample.text + '\n')
+            started = time.perf_counter()
+            _, commands = ocr_image(image_path, 'bench', use_cache=False, mode=mode)
+            elapsed += time.perf_counter() - started
+
+        sample_correct, sample_found = _score_commands(sample.truth, commands)
+        images += 1
+        rows += sum(sample.truth.values())
+        correct += sample_correct
+        found += sample_found
+
+    if not corpus_dir:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'mode': 'parse' if parse_only else mode,
+        'images': images,
+        'rows': rows,
+        'found': found,
+        'correct': correct,
+        'precision': round(correct / found, 4) if found else 0.0,
+        'recall': round(correct / rows, 4) if rows else 0.0,
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(images / elapsed, 2) if elapsed else 0.0,
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed else 0.0,
+        'spans': metrics.snapshot()['spans'],
+        'counters': metrics.snapshot()['counters']
+    }
+
+
+def compare_with_baseline(result, baseline, tolerance=0.005, max_slowdown=0.3):
+    """Список регрессий относительно сохранённого результата"""
+    regressions = []
+    for key in ('precision', 'recall'):
+        if result[key] < baseline[key] - tolerance:
+            regressions.append(f"{key}: {result[key]:.4f} < {baseline[key]:.4f}")
+    if baseline['images_per_sec'] and result['images_per_sec'] < baseline['images_per_sec'] * (1 - max_slowdown):
+        regressions.append(f"images_per_sec: {result['images_per_sec']} < {baseline['images_per_sec']} "
+                           f"(допустимо замедление {max_slowdown:.0%})")
+    return regressions
+
+
+def parse_timespan(value):
+    """Секунды из значения TimeSpan в базе SQLite (текст .NET или число секунд)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    match = TIMESPAN_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Неверное значение времени: {value}")
+
+    sign, days, hours, minutes, seconds, fraction = match.groups()
+    total = int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    if fraction:
+        total += int(fraction) / 10 ** len(fraction)
+    return -float(total) if sign else float(total)
+
+
+def format_timespan(seconds):
+    """Значение TimeSpan для базы SQLite в формате .NET [d.]hh:mm:ss[.fffffff]"""
+    sign = '-' if seconds < 0 else ''
+    ticks = round(abs(seconds) * 10 ** 7)
+    total, fraction = divmod(ticks, 10 ** 7)
+    days, total = divmod(total, 86400)
+    hours, total = divmod(total, 3600)
+    minutes, secs = divmod(total, 60)
+
+    text = f"{sign}{days}." if days else sign
+    text += f"{hours:02}:{minutes:02}:{secs:02}"
+    if fraction:
+        text += f".{fraction:07}"
+    return text
+
+
+def merge_playtime(existing, incoming, policy='max'):
+    """Новое время трекера при слиянии с уже существующим"""
+    if existing is None:
+        return incoming
+    if policy == 'add':
+        return existing + incoming
+    return max(existing, incoming)
+
+
+def _read_playtime_chunks(source, chunk_size):
+    """Строки play_time источника порциями фиксированного размера"""
+    cursor = source.execute(f"SELECT player_id, tracker, time_spent FROM {PLAYTIME_TABLE}")
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _existing_playtime(target, player_ids):
+    """Уже записанное в цель время игроков порции: {(игрок, трекер): секунды}"""
+    player_ids = list(player_ids)
+    existing = {}
+    # Старые сборки SQLite ограничивают запрос 999 параметрами
+    for start in range(0, len(player_ids), 500):
+        part = player_ids[start:start + 500]
+        cursor = target.execute(
+            f"SELECT player_id, tracker, time_spent FROM {PLAYTIME_TABLE} "
+            f"WHERE player_id IN ({','.join('?' * len(part))})", part)
+        for player_id, tracker, time_spent in cursor:
+            existing[(player_id, tracker)] = parse_timespan(time_spent)
+    return existing
+
+
+def migrate_playtime(source_path, target_path, policy='max', chunk_size=MIGRATION_CHUNK_SIZE, all_trackers=False,
+                     dry_run=False, progress=None):
+    """Переносит время из базы SQLite одного сервера SS14 в базу другого
+
+    Таблица play_time источника читается порциями, поэтому память не растёт с
+    числом игроков. Переносятся трекеры должностей из ROLE_TRANSLATION (или все
+    трекеры при all_trackers), каждая порция пишется в цель одной транзакцией.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Неизвестный способ слияния: {policy}")
+
+    refresh_dictionaries()
+    jobs = set(ROLE_TRANSLATION.values())
+    stats = Counter()
+
+    # Источник открывается только для чтения
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        for chunk in _read_playtime_chunks(source, max(1, chunk_size)):
+            # Повторы ключа в источнике складываются по тому же правилу
+            incoming = {}
+            for player_id, tracker, time_spent in chunk:
+                stats['read'] += 1
+                if not all_trackers and tracker not in jobs:
+                    stats['skipped'] += 1
+                    continue
+                key = (player_id, tracker)
+                incoming[key] = merge_playtime(incoming.get(key), parse_timespan(time_spent), policy)
+
+            if incoming:
+                existing = _existing_playtime(target, {player_id for player_id, _ in incoming})
+                inserts = []
+                updates = []
+                for (player_id, tracker), seconds in incoming.items():
+                    current = existing.get((player_id, tracker))
+                    merged = merge_playtime(current, seconds, policy)
+                    if current is None:
+                        inserts.append((player_id, tracker, format_timespan(merged)))
+                    elif merged != current:
+                        updates.append((format_timespan(merged), player_id, tracker))
+                    else:
+                        stats['unchanged'] += 1
+
+                if not dry_run:
+                    with target:
+                        target.executemany(
+                            f"INSERT INTO {PLAYTIME_TABLE} (player_id, tracker, time_spent) VALUES (?, ?, ?)",
+                            inserts)
+                        target.executemany(
+                            f"UPDATE {PLAYTIME_TABLE} SET time_spent = ? WHERE player_id = ? AND tracker = ?",
+                            updates)
+                stats['inserted'] += len(inserts)
+                stats['updated'] += len(updates)
+
+            if progress:
+                progress(stats)
+    finally:
+        source.close()
+        target.close()
+
+    return stats
+
+
+class ExecutionJournal:
+    """Журнал отправленных команд для продолжения после сбоя или остановки
+
+    Для каждого списка команд свой дописываемый файл JSON Lines в APP_DATA_DIR
+    (имя — хэш списка или ключа key, если список ещё пополняется). Запуск начинается строкой {"run": id, "start": число},
+    каждая отправленная команда — {"run": id, "seq": индекс}, успешное
+    завершение — {"run": id, "finished": true}. На диск (fsync) записи
+    сбрасываются пачками по JOURNAL_FSYNC_EVERY и при закрытии.
+    """
+
+    def __init__(self, commands, directory=None, key=None):
+        digest = hashlib.sha256((key or '\n'.join(commands)).encode('utf-8')).hexdigest()
+        self.directory = directory or os.path.join(APP_DATA_DIR, 'journal')
+        self.path = os.path.join(self.directory, f"{digest[:32]}.jsonl")
+        self.total = len(commands)
+        self.run_id = None
+        self.sent = set()
+        self.finished = False
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Восстанавливает последний запуск; строка, оборванная сбоем, пропускается"""
+        try:
+            f = open(self.path, encoding='utf-8')
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'start' in record:
+                    self.run_id = record['run']
+                    self.sent = set()
+                    self.finished = False
+                elif record.get('run') != self.run_id:
+                    continue
+                elif 'seq' in record:
+                    self.sent.add(record['seq'])
+                elif record.get('finished'):
+                    self.finished = True
+
+    @property
+    def resumable(self):
+        """Есть незавершённый запуск, в котором уже что-то отправлено"""
+        return self.run_id is not None and not self.finished and bool(self.sent)
+
+    def begin(self, resume=False):
+        """Открывает журнал: продолжает последний запуск или начинает новый"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(self.path, 'a+b')
+
+        # Оборванную при сбое строку завершаем, чтобы не испортить следующую запись
+        if self._file.tell():
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b'\n':
+                self._file.write(b'\n')
+
+        if resume and self.resumable:
+            return
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(4).hex()}"
+        self.sent = set()
+        self.finished = False
+        self._write({'run': self.run_id, 'start': self.total}, sync=True)
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps(record).encode('utf-8') + b'\n')
+        self._unsynced += 1
+        if sync or self._unsynced >= JOURNAL_FSYNC_EVERY:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def record(self, index):
+        """Отмечает команду отправленной; вызывается из нескольких потоков"""
+        with self._lock:
+            # Журнал могли закрыть, не дождавшись исполнителя
+            if self._file is None:
+                return
+            self.sent.add(index)
+            self._write({'run': self.run_id, 'seq': index})
+
+    def finish(self):
+        """Отмечает, что все команды запуска отправлены"""
+        with self._lock:
+            if self._file is None:
+                return
+            self.finished = True
+            self._write({'run': self.run_id, 'finished': True}, sync=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+
+
+def screen_changed(before, after, min_changed):
+    """Отличаются ли два снимка экрана больше чем на долю min_changed пикселей"""
+    difference = ImageChops.difference(before.convert('L'), after.convert('L'))
+    changed = difference.point(lambda value: 255 if value > 32 else 0).histogram()[255]
+    return changed >= max(1, min_changed * before.width * before.height)
+
+
+class KeystrokeDelivery:
+    """Ввод команд в консоль игры эмуляцией клавиатуры (буфер обмена или прямой ввод)
+
+    При адаптивных задержках вместо фиксированных пауз снимается область
+    консоли вокруг курсора: Enter нажимается, как только команда появилась в
+    строке ввода, а следующая команда идёт, как только строка очистилась.
+    Пауза между командами сокращается на шаг после каждого подтверждения и
+    удваивается, если клиент не успел (AIMD).
+    """
+
+    def __init__(self, settings, stop_event):
+        self.settings = settings
+        self.stop_event = stop_event
+        self.adaptive = settings.get('adaptive_pacing', False)
+        self.delay = min(settings['command_delay'], ADAPTIVE_PACING['max_delay'])
+        self.region = None
+
+    def _pause(self, seconds):
+        """Пауза; возвращает True, если за это время выполнение остановили"""
+        return self.stop_event.wait(seconds)
+
+    def _capture(self):
+        return pyautogui.screenshot(region=self.region)
+
+    def _wait_for_change(self, reference):
+        """Ждёт изменения области консоли; False — не дождались или выполнение остановили"""
+        deadline = time.perf_counter() + ADAPTIVE_PACING['timeout']
+        while not self._pause(ADAPTIVE_PACING['poll']):
+            if screen_changed(reference, self._capture(), ADAPTIVE_PACING['min_changed']):
+                return True
+            if time.perf_counter() >= deadline:
+                return False
+        return False
+
+    def _type(self, command):
+        # Выбираем способ ввода
+        if self.settings['input_method'] == 'clipboard':
+            # Копируем команду в буфер обмена и вставляем (Ctrl+V) после небольшой задержки
+            pyperclip.copy(command)
+            if self._pause(0.1):
+                return False
+            pyautogui.hotkey('ctrl', 'v')
+        else:
+            # Прямой ввод команды
+            pyautogui.write(command)
+        return True
+
+    def _send_adaptive(self, command):
+        before = self._capture()
+        if not self._type(command):
+            return False
+
+        # Enter нажимаем, когда команда появилась в строке ввода
+        typed = self._wait_for_change(before)
+        if self.stop_event.is_set():
+            return False
+        if not typed and self._pause(self.settings['enter_delay']):
+            return False
+
+        entered = self._capture()
+        pyautogui.press('enter')
+        accepted = self._wait_for_change(entered)
+
+        pacing = ADAPTIVE_PACING
+        if typed and accepted:
+            self.delay = max(pacing['min_delay'], self.delay - pacing['step'])
+        else:
+            get_metrics().count('pacing_backoffs')
+            # Клиент не успевает: увеличиваем паузу
+            self.delay = min(pacing['max_delay'], self.delay * 2)
+        self._pause(self.delay)
+        return True
+
+    def send(self, command):
+        """Вводит одну команду; возвращает False, если выполнение остановили"""
+        if self.adaptive:
+            return self._send_adaptive(command)
+
+        if not self._type(command):
+            return False
+
+        # Задержка перед нажатием Enter
+        if self._pause(self.settings['enter_delay']):
+            return False
+        pyautogui.press('enter')
+
+        # Задержка между командами
+        self._pause(self.settings['command_delay'])
+        return True
+
+    def deliver(self, commands, indices, on_progress, on_sent):
+        if self.adaptive:
+            # Курсор стоит на строке ввода консоли: следим за областью вокруг него
+            x, y = pyautogui.position()
+            width, height = ADAPTIVE_PACING['region']
+            self.region = (max(0, x - width // 2), max(0, y - height // 2), width, height)
+            try:
+                self._capture()
+            except Exception as e:
+                raise RuntimeError(f"Адаптивные задержки недоступны: не удалось снять экран ({e})")
+
+        for index in indices:
+            if self.stop_event.is_set():
+                return
+            if index is None:
+                continue
+            on_progress(index)
+            with get_metrics().span('send'):
+                if not self.send(commands[index]):
+                    return
+            on_sent(index)
+
+
+class HttpDelivery:
+    """Отправка команд на административный HTTP-эндпоинт сервера
+
+    Команды уходят пачками (POST JSON {"commands": [...]}) по нескольким
+    постоянным keep-alive соединениям: число одновременных запросов ограничено
+    http_concurrency, временные ошибки повторяются с экспоненциальной паузой.
+    Пачки подтверждаются независимо, поэтому порядок подтверждений может
+    отличаться от порядка команд. Каждая пачка несёт заголовок Idempotency-Key
+    (хэш запуска и всех номеров команд пачки): повтор после потерянного ответа
+    сервер узнаёт по ключу и не начисляет время второй раз, а пачка с другим
+    составом никогда не получит чужой ключ.
+    """
+
+    def __init__(self, settings, stop_event, run_id=None):
+        url = urllib_parse.urlsplit(settings['http_url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError(f"Неверный адрес HTTP: {settings['http_url']}")
+
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port
+        self.path = (url.path or '/') + (f"?{url.query}" if url.query else '')
+        self.headers = {'Content-Type': 'application/json; charset=utf-8', 'Connection': 'keep-alive'}
+        if settings['http_token']:
+            self.headers['Authorization'] = f"SS14Token {settings['http_token']}"
+
+        self.concurrency = max(1, int(settings['http_concurrency']))
+        self.batch_size = max(1, int(settings['http_batch_size']))
+        self.retries = max(0, int(settings['http_retries']))
+        self.timeout = float(settings['http_timeout'])
+        self.stop_event = stop_event
+        # Запуск из журнала сохраняет ключи пачек и при продолжении после сбоя
+        self.run_id = run_id or os.urandom(8).hex()
+
+    def batch_key(self, batch):
+        """Ключ идемпотентности пачки: не зависит от того, как команды разбиты на пачки до неё"""
+        indices = ','.join(str(index) for index in sorted(batch))
+        return hashlib.sha256(f"{self.run_id}:{indices}".encode('ascii')).hexdigest()
+
+    def _connect(self):
+        connection_class = http_client.HTTPSConnection if self.https else http_client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _send_batch(self, connection, batch, key):
+        """Отправляет пачку с повторами; возвращает соединение для следующих запросов"""
+        body = json.dumps({'commands': batch}, ensure_ascii=False).encode('utf-8')
+        headers = dict(self.headers, **{'Idempotency-Key': key})
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                get_metrics().count('http_retries')
+                if self.stop_event.wait(min(0.25 * 2 ** attempt, 5.0)):
+                    break
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.request('POST', self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                # Ответ дочитываем полностью, иначе соединение нельзя использовать повторно
+                payload = response.read()
+            except (OSError, http_client.HTTPException) as e:
+                if connection is not None:
+                    connection.close()
+                connection = None
+                error = str(e) or type(e).__name__
+                continue
+
+            if 200 <= response.status < 300:
+                return connection
+            error = f"HTTP {response.status}: {payload[:200].decode('utf-8', 'replace')}"
+            if response.status not in HTTP_RETRY_STATUSES:
+                break
+
+        if connection is not None:
+            connection.close()
+        raise ConnectionError(f"Сервер не принял команды: {error}")
+
+    def deliver(self, commands, indices, on_progress, on_sent):
+        # Очередь пачек ограничена: при живой очереди команд пачки формируются по мере поступления
+        batches = queue.Queue(maxsize=self.concurrency * 2)
+        errors = []
+
+        def worker():
+            connection = None
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                # После ошибки или остановки оставшиеся пачки только вычитываются
+                if self.stop_event.is_set() or errors:
+                    continue
+                try:
+                    on_progress(batch[0])
+                    with get_metrics().span('send_batch'):
+                        connection = self._send_batch(connection, [commands[index] for index in batch],
+                                                      self.batch_key(batch))
+                    for index in batch:
+                        on_sent(index)
+                except Exception as e:
+                    errors.append(e)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in workers:
+            thread.start()
+
+        # None в indices означает, что новых команд пока нет: неполная пачка отправляется сразу
+        batch = []
+        for index in indices:
+            if self.stop_event.is_set() or errors:
+                break
+            if index is not None:
+                batch.append(index)
+            if batch and (index is None or len(batch) >= self.batch_size):
+                batches.put(batch)
+                batch = []
+        if batch and not errors:
+            batches.put(batch)
+
+        for _ in workers:
+            batches.put(None)
+        for thread in workers:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+
+def create_delivery(settings, stop_event, run_id=None):
+    """Способ доставки команд по настройке input_method"""
+    if settings['input_method'] == 'http':
+        return HttpDelivery(settings, stop_event, run_id)
+    return KeystrokeDelivery(settings, stop_event)
+
+
+class CommandExecutor(threading.Thread):
+    """Отправляет команды в отдельном потоке
+
+    Интерфейс получает события через потокобезопасную очередь: ('progress', индекс),
+    ('sent', индекс), ('finished', остановлено) и ('error', текст). Все паузы
+    прерываются остановкой сразу, без ожидания конца текущей задержки.
+    Команды из skip не отправляются; каждая отправленная записывается в journal
+    до того, как о ней узнает интерфейс.
+    """
+
+    def __init__(self, commands, settings, events, start_index=0, start_delay=1.0, skip=(), journal=None):
+        super().__init__(daemon=True)
+        self.commands = commands
+        self.settings = dict(settings)
+        self.events = events
+        self.start_index = start_index
+        self.start_delay = start_delay
+        self.skip = skip
+        self.journal = journal
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _sent(self, index):
+        get_metrics().count('commands_sent')
+        if self.journal:
+            self.journal.record(index)
+        self.events.put(('sent', index))
+
+    def run(self):
+        try:
+            # Время, чтобы пользователь успел перейти в игру
+            if self.stop_event.wait(self.start_delay):
+                self.events.put(('finished', True))
+                return
+
+            if isinstance(self.commands, CommandQueue):
+                indices = self.commands.iter_indices(self.start_index, self.stop_event)
+            else:
+                indices = [index for index in range(self.start_index, len(self.commands)) if index not in self.skip]
+            delivery = create_delivery(self.settings, self.stop_event, self.journal.run_id if self.journal else None)
+            delivery.deliver(self.commands, indices,
+                             lambda index: self.events.put(('progress', index)),
+                             self._sent)
+
+            stopped = self.stop_event.is_set()
+            if self.journal and not stopped:
+                self.journal.finish()
+            self.events.put(('finished', stopped))
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        finally:
+            if self.journal:
+                self.journal.close()
+
+
+class CommandQueue:
+    """Пополняемый список команд: исполнитель ждёт новые команды, пока очередь не закрыта"""
+
+    def __init__(self):
+        self._commands = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getitem__(self, index):
+        return self._commands[index]
+
+    def __iter__(self):
+        return iter(list(self._commands))
+
+    def extend(self, commands):
+        with self._condition:
+            self._commands.extend(commands)
+            self._condition.notify_all()
+
+    def close(self):
+        """Новых команд не будет: исполнитель завершится, отправив оставшиеся"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def iter_indices(self, start, stop_event):
+        """Индексы команд по мере поступления; None — очередь опустела и ждёт новых команд"""
+        index = start
+        waiting = False
+        while not stop_event.is_set():
+            with self._condition:
+                if index >= len(self._commands):
+                    if self._closed:
+                        return
+                    if waiting:
+                        # Ждём с таймаутом, чтобы заметить остановку
+                        self._condition.wait(0.1)
+                        continue
+            if index < len(self._commands):
+                waiting = False
+                yield index
+                index += 1
+            else:
+                waiting = True
+                yield None
+
+
+def _inotify_events(directory, stop_event):
+    """Пути закрытых после записи и перемещённых в папку файлов (Linux, inotify через ctypes)
+
+    inotify инициализируется сразу при вызове, чтобы его недоступность была
+    видна до начала наблюдения; возвращается генератор путей.
+    """
+    import ctypes
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    watches = {}
+
+    def add_watch(path):
+        wd = libc.inotify_add_watch(fd, os.fsencode(path), mask)
+        if wd >= 0:
+            watches[wd] = path
+
+    add_watch(directory)
+    for root, dirs, _ in os.walk(directory):
+        for name in dirs:
+            add_watch(os.path.join(root, name))
+    return _read_inotify(fd, watches, add_watch, stop_event)
+
+
+def _read_inotify(fd, watches, add_watch, stop_event):
+    import select
+    import struct
+
+    try:
+        header = struct.Struct('iIII')
+        while not stop_event.is_set():
+            if not select.select([fd], [], [], 0.2)[0]:
+                continue
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, event_mask, _, length = header.unpack_from(data, offset)
+                name = data[offset + header.size:offset + header.size + length].rstrip(b'\0')
+                offset += header.size + length
+                if wd not in watches or not name:
+                    continue
+
+                path = os.path.join(watches[wd], os.fsdecode(name))
+                if event_mask & IN_ISDIR:
+                    # Новая папка игрока: следим за ней, а у перемещённой целиком забираем готовые файлы
+                    add_watch(path)
+                    if event_mask & IN_MOVED_TO:
+                        for root, _, files in os.walk(path):
+                            for file_name in files:
+                                yield os.path.join(root, file_name)
+                elif event_mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    yield path
+    finally:
+        os.close(fd)
+
+
+def _polled_events(directory, stop_event, poll_interval):
+    """Пути новых файлов по опросу папки; файл выдаётся, когда его размер перестал меняться"""
+    def scan():
+        found = {}
+        for root, _, files in os.walk(directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found[path] = (stat.st_size, stat.st_mtime)
+        return found
+
+    seen = set(scan())
+    pending = {}
+    while not stop_event.wait(poll_interval):
+        for path, signature in scan().items():
+            if path in seen:
+                continue
+            # Файл ещё копируется, пока его размер и время изменения меняются между опросами
+            if pending.get(path) == signature:
+                seen.add(path)
+                del pending[path]
+                yield path
+            else:
+                pending[path] = signature
+
+
+def watch_directory(directory, stop_event, poll_interval=WATCH_POLL_INTERVAL):
+    """Новые изображения в папке и её подпапках, пока не установлен stop_event
+
+    На Linux используется inotify, на остальных системах (и если inotify
+    недоступен) — опрос папки. Файлы, лежавшие в папке до запуска, пропускаются.
+    """
+    events = None
+    if sys.platform.startswith('linux'):
+        try:
+            events = _inotify_events(directory, stop_event)
+        except (OSError, AttributeError):
+            events = None
+    if events is None:
+        events = _polled_events(directory, stop_event, poll_interval)
+
+    for path in events:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            yield path
+
+
+class CommandStore:
+    """Начисления сессии по всем игрокам в компактных массивах
+
+    Ник и трекер каждой записи хранятся номерами в таблицах строк, секунды —
+    в array('q'), состояние отправки — байтом. Строки команд собираются только
+    для показанных и отправляемых записей, поэтому сотни тысяч команд
+    занимают единицы мегабайт. Замена начислений игрока лишь помечает старые
+    записи удалёнными: номера записей не сдвигаются, пока не вызван compact(),
+    и исполнитель может отправлять представление, пока сессия пополняется.
+    """
+
+    PENDING, SENT, REMOVED = 0, 1, 2
+    # Таблицы bytes.translate: состояние -> 1, если запись действующая или отправленная
+    _LIVE = bytes([1, 1, 0]) + bytes(253)
+    _SENT = bytes([0, 1, 0]) + bytes(253)
+
+    def __init__(self):
+        self._nicknames = []
+        self._nickname_ids = {}
+        self._jobs = []
+        self._job_ids = {}
+        self._player = array('I')
+        self._job = array('I')
+        self._seconds = array('q')
+        self._status = bytearray()
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._status)
+
+    def _intern(self, value, values, ids):
+        index = ids.get(value)
+        if index is None:
+            index = ids[value] = len(values)
+            values.append(value)
+        return index
+
+    def append(self, entry, status=PENDING):
+        """Добавляет начисление и возвращает номер записи"""
+        self._player.append(self._intern(entry.nickname, self._nicknames, self._nickname_ids))
+        self._job.append(self._intern(entry.job, self._jobs, self._job_ids))
+        self._seconds.append(entry.seconds)
+        self._status.append(status)
+        return len(self._status) - 1
+
+    def entry(self, index):
+        return PlaytimeEntry(self._nicknames[self._player[index]], self._jobs[self._job[index]], self._seconds[index])
+
+    def command(self, index):
+        return format_command(self.entry(index))
+
+    def status(self, index):
+        return self._status[index]
+
+    def mark_sent(self, index):
+        if self._status[index] == self.PENDING:
+            self._status[index] = self.SENT
+
+    def replace(self, entries, nicknames=()):
+        """Заменяет начисления игроков из entries и nicknames; отправленные ранее совпадения остаются отправленными"""
+        entries = list(entries)
+        players = {self._nickname_ids[nickname] for nickname in {entry.nickname for entry in entries} | set(nicknames)
+                   if nickname in self._nickname_ids}
+        sent = set()
+        if players:
+            for index, player in enumerate(self._player):
+                status = self._status[index]
+                if player in players and status != self.REMOVED:
+                    if status == self.SENT:
+                        sent.add((player, self._job[index], self._seconds[index]))
+                    self._status[index] = self.REMOVED
+                    self._removed += 1
+
+        for entry in entries:
+            index = self.append(entry)
+            if (self._player[index], self._job[index], entry.seconds) in sent:
+                self._status[index] = self.SENT
+        return len(entries)
+
+    def replace_commands(self, commands, nicknames=()):
+        """replace() по строкам команд; строки, не похожие на команду, пропускаются"""
+        return self.replace(iter_command_entries(commands), nicknames)
+
+    def clear(self):
+        self.__init__()
+
+    def compact(self):
+        """Убирает удалённые записи; номера записей после этого меняются"""
+        if not self._removed:
+            return False
+        keep = [index for index, status in enumerate(self._status) if status != self.REMOVED]
+        self._player = array('I', (self._player[index] for index in keep))
+        self._job = array('I', (self._job[index] for index in keep))
+        self._seconds = array('q', (self._seconds[index] for index in keep))
+        self._status = bytearray(self._status[index] for index in keep)
+        self._removed = 0
+        return True
+
+    def players(self):
+        """[(ник, команд, отправлено)] по алфавиту ников"""
+        total = Counter(itertools.compress(self._player, self._status.translate(self._LIVE)))
+        sent = Counter(itertools.compress(self._player, self._status.translate(self._SENT)))
+        return sorted(((self._nicknames[player], count, sent[player]) for player, count in total.items()),
+                      key=lambda item: (item[0].lower(), item[0]))
+
+    def view(self, nickname=None, role=None, order='player'):
+        """Номера записей после фильтра по нику и части трекера, в порядке order из COMMAND_SORT_NAMES"""
+        if order not in COMMAND_SORT_NAMES:
+            raise ValueError(f"Неизвестный порядок команд: {order}")
+
+        if self._removed:
+            indices = [index for index, status in enumerate(self._status) if status != self.REMOVED]
+        else:
+            indices = list(range(len(self._status)))
+        if nickname:
+            player = self._nickname_ids.get(nickname)
+            indices = [index for index in indices if self._player[index] == player]
+        if role:
+            role = role.lower()
+            jobs = {job for job, name in enumerate(self._jobs) if role in name.lower()}
+            indices = [index for index in indices if self._job[index] in jobs]
+
+        if order == 'time':
+            indices.sort(key=self._seconds.__getitem__, reverse=True)
+            return array('I', indices)
+
+        # Ключи сортировки — целые числа из рангов ника и трекера: так быстрее, чем кортежи строк
+        players = map(self._ranks(self._nicknames).__getitem__, self._player)
+        jobs = map(self._ranks(self._jobs).__getitem__, self._job)
+        players_count = len(self._nicknames)
+        jobs_count = len(self._jobs)
+        if order == 'role':
+            keys = [job * players_count + player for player, job in zip(players, jobs)]
+        elif order == 'status':
+            keys = [(status * players_count + player) * jobs_count + job
+                    for player, job, status in zip(players, jobs, self._status)]
+        else:
+            keys = [player * jobs_count + job for player, job in zip(players, jobs)]
+        indices.sort(key=keys.__getitem__)
+        return array('I', indices)
+
+    @staticmethod
+    def _ranks(values):
+        ranks = [0] * len(values)
+        for rank, index in enumerate(sorted(range(len(values)), key=lambda index: (values[index].lower(), values[index]))):
+            ranks[index] = rank
+        return ranks
+
+
+class CommandView:
+    """Команды хранилища в порядке представления: последовательность строк для исполнителя, журнала и экспорта"""
+
+    def __init__(self, store, indices):
+        self.store = store
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, position):
+        return self.store.command(self.indices[position])
+
+    def __iter__(self):
+        return (self.store.command(index) for index in self.indices)
+
+    def record(self, position):
+        """Номер записи хранилища для позиции в представлении"""
+        return self.indices[position]
+
+
+class WatchPipeline:
+    """Потоковая обработка скриншотов из папки: наблюдение → распознавание → очередь команд
+
+    Стадии работают в своих потоках и соединены ограниченной очередью: если
+    распознавание не успевает, наблюдатель ждёт свободного места. Команды
+    каждого изображения сразу дописываются в CommandQueue, поэтому отправка
+    команд одного скриншота идёт одновременно с распознаванием следующего.
+    Ник берётся из подпапки (<папка>/<ник>/<скриншот>), для файлов в корне — nickname.
+    События интерфейсу: ('image', путь, число команд) и ('error', путь, текст).
+    """
+
+    def __init__(self, directory, commands, events, nickname=None, use_cache=True, mode='layout', policy='max',
+                 poll_interval=WATCH_POLL_INTERVAL):
+        self.directory = directory
+        self.commands = commands
+        self.events = events
+        self.nickname = nickname
+        self.use_cache = use_cache
+        self.mode = mode
+        self.policy = policy
+        self.poll_interval = poll_interval
+        self.images = queue.Queue(maxsize=WATCH_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self._threads = [threading.Thread(target=self._watch, daemon=True),
+                         threading.Thread(target=self._recognize, daemon=True)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает наблюдение; уже добавленные команды остаются в очереди"""
+        self.stop_event.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.commands.close()
+
+    def _player_nickname(self, path):
+        parts = os.path.relpath(path, self.directory).split(os.sep)
+        return parts[0] if len(parts) > 1 else self.nickname
+
+    def _watch(self):
+        try:
+            for path in watch_directory(self.directory, self.stop_event, self.poll_interval):
+                nickname = self._player_nickname(path)
+                if not nickname:
+                    self.events.put(('error', path, "не указан ник игрока"))
+                    continue
+                # Ограниченная очередь: ждём, пока распознавание разберёт предыдущие изображения
+                while not self.stop_event.is_set():
+                    try:
+                        self.images.put((nickname, path), timeout=0.2)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            self.events.put(('error', self.directory, str(e)))
+
+    def _recognize(self):
+        while not self.stop_event.is_set():
+            try:
+                nickname, path = self.images.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                _, commands = ocr_image(path, nickname, self.use_cache, self.mode)
+                commands = aggregate_commands(commands, self.policy)
+            except Exception as e:
+                self.events.put(('error', path, str(e)))
+                continue
+            self.commands.extend(commands)
+            self.events.put(('image', path, len(commands)))
+
+
+def row_key(row):
+    """Ключ строки для склейки кадров: (трекер, секунды) или None, если строка не разобрана"""
+    seconds = time_to_seconds(row.time)
+    job = lookup_role(row.role) if seconds else None
+    return (job, seconds) if job else None
+
+
+def stitch_rows(keys, frame_keys):
+    """Индекс в frame_keys, с которого начинаются строки, ещё не вошедшие в keys
+
+    Кадр сопоставляется с концом уже склеенного списка: всё до последней
+    совпавшей строки — перекрытие с прошлым кадром, даже если часть строк
+    в нём распознана иначе или пропущена.
+    """
+    tail = keys[-2 * len(frame_keys):]
+    start = 0
+    for block in difflib.SequenceMatcher(None, tail, frame_keys, autojunk=False).get_matching_blocks():
+        if block.size:
+            start = block.b + block.size
+    return start
+
+
+class ScrollCapture:
+    """Распознавание таблицы времени прямо с экрана, пока список прокручивается
+
+    Область экрана снимается в память через pyautogui. Кадр, почти не
+    отличающийся от последнего распознанного, не распознаётся. Строки новых
+    кадров склеиваются по перекрытию с предыдущими (stitch_rows), поэтому
+    каждая строка таблицы попадает в результат один раз. Съёмка заканчивается
+    по stop(), после max_frames кадров или когда список перестал меняться.
+    Вместо экрана кадры можно брать из grab (например, из сохранённых снимков).
+    События: ('frame', номер, новых строк), ('skipped', номер), ('error', текст), ('done', всего строк).
+    """
+
+    def __init__(self, region, events, grab=None, options=None, max_frames=None):
+        self.region = region
+        self.events = events
+        self.grab = grab or (lambda: pyautogui.screenshot(region=region))
+        self.options = dict(CAPTURE_OPTIONS, **(options or {}))
+        self.max_frames = max_frames
+        self.rows = []
+        self._keys = []
+        # Прочтения каждой должности: секунды → [голоса, строка с наибольшей уверенностью]
+        self._readings = {}
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def add_frame(self, rows):
+        """Добавляет строки кадра, ещё не вошедшие в результат; возвращает их число
+
+        Должность в таблице одна на строку, поэтому повторное чтение знакомой
+        должности с другим временем — голос за другое прочтение: в результате
+        остаётся прочтение с большим числом голосов (при равенстве — с большей
+        уверенностью OCR).
+        """
+        frame = [(row, key) for row, key in ((row, row_key(row)) for row in rows) if key]
+        frame_keys = [key for _, key in frame]
+        start = stitch_rows(self._keys, frame_keys)
+        added = 0
+
+        # Строка перекрытия с новой должностью пропущена в прошлом кадре: встаёт перед следующей знакомой
+        for j in range(start - 1, -1, -1):
+            row, key = frame[j]
+            if key[0] in self._readings:
+                self._vote(row, key)
+                continue
+            following = next((k for _, k in frame[j + 1:start] if k in self._keys), None)
+            self._add(row, key, self._keys.index(following) if following else len(self._keys))
+            added += 1
+
+        for row, key in frame[start:]:
+            if key[0] in self._readings:
+                self._vote(row, key)
+            else:
+                self._add(row, key, len(self._keys))
+                added += 1
+        return added
+
+    def _add(self, row, key, index):
+        self.rows.insert(index, row)
+        self._keys.insert(index, key)
+        self._readings[key[0]] = {key[1]: [1, row]}
+
+    def _vote(self, row, key):
+        job, seconds = key
+        readings = self._readings[job]
+        reading = readings.setdefault(seconds, [0, row])
+        reading[0] += 1
+        if row.confidence > reading[1].confidence:
+            reading[1] = row
+
+        best = max(readings, key=lambda value: (readings[value][0], readings[value][1].confidence))
+        index = next(i for i, (other, _) in enumerate(self._keys) if other == job)
+        if self._keys[index][1] != best:
+            self.rows[index] = readings[best][1]
+            self._keys[index] = (job, best)
+
+    def _scroll(self):
+        left, top, width, height = self.region
+        pyautogui.scroll(-self.options['scroll_clicks'], x=left + width // 2, y=top + height // 2)
+
+    def _run(self):
+        metrics = get_metrics()
+        previous = None
+        idle = 0
+        frame_number = 0
+        try:
+            while not self.stop_event.is_set() and (self.max_frames is None or frame_number < self.max_frames):
+                with metrics.span('capture'):
+                    frame = self.grab()
+                if frame is None:
+                    break
+                frame_number += 1
+
+                if previous is not None and not screen_changed(previous, frame, self.options['min_changed']):
+                    metrics.count('frames_skipped')
+                    self.events.put(('skipped', frame_number))
+                    idle += 1
+                    # При автопрокрутке неизменный кадр означает конец списка
+                    if self.options['scroll_clicks'] or idle >= self.options['idle_frames']:
+                        break
+                else:
+                    idle = 0
+                    previous = frame
+                    metrics.count('frames')
+                    self.events.put(('frame', frame_number, self.add_frame(recognize_frame_rows(frame))))
+
+                if self.options['scroll_clicks']:
+                    self._scroll()
+                self.stop_event.wait(self.options['interval'])
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        self.events.put(('done', len(self.rows)))
+
+
+class MockAdminServer:
+    """Локальный имитатор административного эндпоинта для проверки отправки без сервера игры
+
+    Пачку с уже виденным Idempotency-Key подтверждает, но команды из неё не добавляет.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, token='', fail_rate=0.0, delay=0.0):
+        self.token = token
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.commands = []
+        self.requests = 0
+        self.duplicates = 0
+        self.connections = 0
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            # HTTP/1.1 держит соединение открытым между запросами
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+                if server.token and self.headers.get('Authorization') != f"SS14Token {server.token}":
+                    self._reply(401, {'error': 'unauthorized'})
+                    return
+                if server.fail_rate and random.random() < server.fail_rate:
+                    self._reply(503, {'error': 'unavailable'})
+                    return
+                if server.delay:
+                    time.sleep(server.delay)
+
+                try:
+                    commands = json.loads(body)['commands']
+                except (ValueError, KeyError, TypeError):
+                    self._reply(400, {'error': 'bad request'})
+                    return
+
+                key = self.headers.get('Idempotency-Key')
+                with server._lock:
+                    server.requests += 1
+                    if key and key in server._keys:
+                        server.duplicates += 1
+                        commands = []
+                    else:
+                        if key:
+                            server._keys.add(key)
+                        server.commands.extend(commands)
+                self._reply(200, {'accepted': len(commands)})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http_server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/admin/commands"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class VirtualList:
+    """Список, в котором нарисованы только видимые строки
+
+    Listbox держит ровно столько строк, сколько помещается в окне; текст строки
+    берётся по номеру из row_text при прокрутке, а полоса прокрутки считается
+    по общему числу строк. Так список из сотен тысяч команд открывается
+    и прокручивается без задержки.
+    """
+
+    def __init__(self, parent, height=10, width=80, on_select=None):
+        self.frame = tk.Frame(parent)
+        self.listbox = tk.Listbox(self.frame, height=height, width=width, activestyle='none', exportselection=False)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.count = 0
+        self.row_text = None
+        self.first = 0
+        self.highlighted = None
+        self.on_select = on_select
+        self.line_height = None
+
+        self.listbox.bind('<Configure>', lambda event: self.refresh())
+        self.listbox.bind('<MouseWheel>', self.on_wheel)
+        self.listbox.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.listbox.bind('<Button-5>', lambda event: self.scroll(3))
+        self.listbox.bind('<<ListboxSelect>>', self.on_listbox_select)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def visible_rows(self):
+        """Сколько строк помещается в окне; до первой отрисовки — высота из настроек"""
+        height = self.listbox.winfo_height()
+        if height <= 1:
+            return int(self.listbox.cget('height'))
+        if self.line_height is None:
+            # Шаг строки Listbox: высота шрифта, 1 пиксель и рамки выделения
+            self.line_height = tkfont.Font(font=self.listbox.cget('font')).metrics('linespace') + 1 + \
+                2 * int(self.listbox.cget('selectborderwidth'))
+        border = 2 * (int(self.listbox.cget('borderwidth')) + int(self.listbox.cget('highlightthickness')))
+        return max(1, (height - border) // self.line_height)
+
+    def set_rows(self, count, row_text):
+        self.count = count
+        self.row_text = row_text
+        if self.highlighted is not None and self.highlighted >= count:
+            self.highlighted = None
+        self.refresh()
+
+    def refresh(self):
+        """Перерисовывает видимые строки, например после изменения источника"""
+        visible = self.visible_rows()
+        self.first = max(0, min(self.first, self.count - visible))
+        last = min(self.count, self.first + visible)
+
+        self.listbox.delete(0, tk.END)
+        if last > self.first:
+            self.listbox.insert(0, *(self.row_text(index) for index in range(self.first, last)))
+        if self.highlighted is not None and self.first <= self.highlighted < last:
+            self.listbox.selection_set(self.highlighted - self.first)
+
+        if self.count:
+            self.scrollbar.set(self.first / self.count, last / self.count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        self.first += rows
+        self.refresh()
+        return 'break'
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.first = int(float(amount) * self.count)
+            self.refresh()
+        elif unit == 'pages':
+            self.scroll(int(amount) * max(1, self.visible_rows() - 1))
+        else:
+            self.scroll(int(amount))
+
+    def on_wheel(self, event):
+        # В Windows delta кратна 120, в macOS — единицы
+        step = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll(-3 * step)
+
+    def on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        self.highlighted = self.first + selection[0]
+        if self.on_select:
+            self.on_select(self.highlighted)
+
+    def see(self, index):
+        visible = self.visible_rows()
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + visible:
+            self.first = index - visible + 1
+        self.refresh()
+
+    def highlight(self, index):
+        """Выделяет строку с номером index и прокручивает к ней"""
+        self.highlighted = index
+        self.see(index)
+
+
+class BatchDialog:
+    """Диалог пакетной обработки скриншотов"""
+
+    def __init__(self, parent):
+        self.window = tk.Toplevel(parent)
+        self.window.title("Пакетная обработка")
+        self.window.geometry("560x200")
+        self.result = None
+
+        self.create_widgets()
+
+    def create_widgets(self):
+        form_frame = tk.Frame(self.window)
+        form_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Label(form_frame, text="Манифест или папка:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        self.source_var = tk.StringVar()
+        tk.Entry(form_frame, textvariable=self.source_var, width=40).grid(row=0, column=1, padx=5, pady=5)
+        tk.Button(form_frame, text="Файл...", command=self.select_manifest).grid(row=0, column=2, padx=2)
+        tk.Button(form_frame, text="Папка...", command=self.select_directory).grid(row=0, column=3, padx=2)
+
+        tk.Label(form_frame, text="Файл команд:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.output_var = tk.StringVar(value="commands.txt")
+        tk.Entry(form_frame, textvariable=self.output_var, width=40).grid(row=1, column=1, padx=5, pady=5)
+        tk.Button(form_frame, text="...", command=self.select_output).grid(row=1, column=2, padx=2)
+
+        tk.Label(form_frame, text="Процессов:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        self.workers_var = tk.StringVar(value=str(os.cpu_count() or 1))
+        tk.Entry(form_frame, textvariable=self.workers_var, width=10).grid(row=2, column=1, sticky=tk.W, padx=5,
+                                                                             pady=5)
+
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Button(button_frame, text="Запустить", command=self.start).pack(side=tk.RIGHT, padx=5)
+        tk.Button(button_frame, text="Отмена", command=self.window.destroy).pack(side=tk.RIGHT, padx=5)
+
+    def select_manifest(self):
+        path = filedialog.askopenfilename(filetypes=[("Манифест", "*.csv *.json")])
+        if path:
+            self.source_var.set(path)
+
+    def select_directory(self):
+        path = filedialog.askdirectory()
+        if path:
+            self.source_var.set(path)
+
+    def select_output(self):
+        path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")])
+        if path:
+            self.output_var.set(path)
+
+    def start(self):
+        try:
+            workers = int(self.workers_var.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Неверное число процессов")
+            return
+
+        if not self.source_var.get() or not self.output_var.get():
+            messagebox.showerror("Ошибка", "Укажите манифест и файл команд")
+            return
+
+        self.result = {'source': self.source_var.get(), 'output': self.output_var.get(), 'workers': workers}
+        self.window.destroy()
+
+
+class DictionaryDialog:
+    """Редактор словаря: одна запись на строку «ключ = значение»"""
+
+    def __init__(self, parent, name, title, hint):
+        self.window = tk.Toplevel(parent)
+        self.window.title(title)
+        self.window.geometry("560x520")
+        self.name = name
+        self.result = None
+
+        path = dictionary_path(name)
+        source = path or "встроенный словарь (при сохранении будет создан файл)"
+        tk.Label(self.window, text=f"{hint}\nФайл: {source}", justify=tk.LEFT, anchor=tk.W).pack(
+            fill=tk.X, padx=10, pady=5)
+
+        self.text = scrolledtext.ScrolledText(self.window, height=20, width=60)
+        self.text.pack(fill=tk.BOTH, expand=True, padx=10)
+        table = ROLE_TRANSLATION if name == 'roles' else TIME_UNITS
+        self.text.insert(tk.END, dictionary_to_lines(name, table))
+
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Button(button_frame, text="Сохранить", command=self.save).pack(side=tk.RIGHT, padx=5)
+        tk.Button(button_frame, text="Отмена", command=self.window.destroy).pack(side=tk.RIGHT, padx=5)
+
+    def save(self):
+        try:
+            self.result = save_dictionary(self.name, dictionary_from_lines(self.name, self.text.get("1.0", tk.END)))
+        except (OSError, ValueError, ImportError) as e:
+            messagebox.showerror("Ошибка", f"Словарь не сохранён: {e}")
+            return
+        self.window.destroy()
+
+
+class RegionDialog:
+    """Выбор области экрана рамкой поверх полупрозрачного окна во весь экран"""
+
+    def __init__(self, parent):
+        self.window = tk.Toplevel(parent)
+        self.window.attributes('-fullscreen', True)
+        self.window.attributes('-alpha', 0.3)
+        self.window.attributes('-topmost', True)
+        self.result = None
+        self.start = None
+        self.rectangle = None
+
+        self.canvas = tk.Canvas(self.window, cursor='cross', bg='gray')
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.create_text(20, 20, anchor=tk.NW, fill='white', font=('Arial', 16),
+                                text="Выделите список времени мышью (Esc — отмена)")
+        self.canvas.bind('<ButtonPress-1>', self.on_press)
+        self.canvas.bind('<B1-Motion>', self.on_drag)
+        self.canvas.bind('<ButtonRelease-1>', self.on_release)
+        self.window.bind('<Escape>', lambda event: self.window.destroy())
+
+    def on_press(self, event):
+        self.start = (event.x, event.y, event.x_root, event.y_root)
+        self.rectangle = self.canvas.create_rectangle(event.x, event.y, event.x, event.y, outline='red', width=2)
+
+    def on_drag(self, event):
+        if self.rectangle:
+            self.canvas.coords(self.rectangle, self.start[0], self.start[1], event.x, event.y)
+
+    def on_release(self, event):
+        if not self.start:
+            return
+        # Область в координатах экрана, как их ждёт pyautogui
+        x, y = self.start[2:]
+        left, top = min(x, event.x_root), min(y, event.y_root)
+        width, height = abs(event.x_root - x), abs(event.y_root - y)
+        if width > 10 and height > 10:
+            self.result = (left, top, width, height)
+        self.window.destroy()
+
+
+class SettingsDialog:
+    """Диалог настроек выполнения команд"""
+
+    def __init__(self, parent, settings):
+        self.window = tk.Toplevel(parent)
+        self.window.title("Настройки выполнения команд")
+        self.window.geometry("480x510")
+        self.settings = settings.copy()
+        self.result = None
+
+        # Создаем интерфейс
+        self.create_widgets()
+
+    def create_widgets(self):
+        # Задержки
+        delay_frame = tk.Frame(self.window)
+        delay_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Label(delay_frame, text="Задержка между командами (сек):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        self.cmd_delay_var = tk.StringVar(value=str(self.settings.get('command_delay', 1.0)))
+        cmd_delay_entry = tk.Entry(delay_frame, textvariable=self.cmd_delay_var, width=10)
+        cmd_delay_entry.grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
+
+        tk.Label(delay_frame, text="Задержка перед Enter (сек):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.enter_delay_var = tk.StringVar(value=str(self.settings.get('enter_delay', 0.5)))
+        enter_delay_entry = tk.Entry(delay_frame, textvariable=self.enter_delay_var, width=10)
+        enter_delay_entry.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+
+        self.adaptive_pacing_var = tk.BooleanVar(value=self.settings.get('adaptive_pacing', False))
+        tk.Checkbutton(delay_frame, text="Адаптивные задержки (по изменению консоли на экране)",
+                       variable=self.adaptive_pacing_var).grid(row=2, column=0, columnspan=2, sticky=tk.W, padx=5)
+
+        # Способ ввода
+        input_frame = tk.Frame(self.window)
+        input_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Label(input_frame, text="Способ ввода команд:").pack(side=tk.LEFT, padx=5)
+        self.input_method_var = tk.StringVar(value=self.settings.get('input_method', 'clipboard'))
+        tk.Radiobutton(input_frame, text="Буфер обмена", variable=self.input_method_var, value='clipboard').pack(
+            side=tk.LEFT, padx=5)
+        tk.Radiobutton(input_frame, text="Прямой ввод", variable=self.input_method_var, value='direct').pack(
+            side=tk.LEFT, padx=5)
+        tk.Radiobutton(input_frame, text="HTTP", variable=self.input_method_var, value='http').pack(
+            side=tk.LEFT, padx=5)
+
+        # Административный HTTP-эндпоинт
+        http_frame = tk.Frame(self.window)
+        http_frame.pack(fill=tk.X, padx=10)
+
+        tk.Label(http_frame, text="Адрес HTTP:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
+        self.http_url_var = tk.StringVar(value=self.settings.get('http_url', HTTP_DELIVERY_DEFAULTS['http_url']))
+        tk.Entry(http_frame, textvariable=self.http_url_var, width=40).grid(row=0, column=1, columnspan=3,
+                                                                           sticky=tk.W, padx=5, pady=2)
+
+        tk.Label(http_frame, text="Токен:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
+        self.http_token_var = tk.StringVar(value=self.settings.get('http_token', ''))
+        tk.Entry(http_frame, textvariable=self.http_token_var, width=40, show='*').grid(row=1, column=1, columnspan=3,
+                                                                                       sticky=tk.W, padx=5, pady=2)
+
+        tk.Label(http_frame, text="Соединений:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=2)
+        self.http_concurrency_var = tk.StringVar(value=str(self.settings.get('http_concurrency', 4)))
+        tk.Entry(http_frame, textvariable=self.http_concurrency_var, width=6).grid(row=2, column=1, sticky=tk.W,
+                                                                                  padx=5, pady=2)
+        tk.Label(http_frame, text="Команд в запросе:").grid(row=2, column=2, sticky=tk.W, padx=5, pady=2)
+        self.http_batch_size_var = tk.StringVar(value=str(self.settings.get('http_batch_size', 50)))
+        tk.Entry(http_frame, textvariable=self.http_batch_size_var, width=6).grid(row=2, column=3, sticky=tk.W,
+                                                                                 padx=5, pady=2)
+
+        # Распознавание
+        ocr_frame = tk.Frame(self.window)
+        ocr_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        self.use_ocr_cache_var = tk.BooleanVar(value=self.settings.get('use_ocr_cache', True))
+        tk.Checkbutton(ocr_frame, text="Использовать кэш распознавания", variable=self.use_ocr_cache_var).pack(
+            side=tk.LEFT, padx=5)
+
+        self.ocr_mode_var = tk.StringVar(value=self.settings.get('ocr_mode', 'layout'))
+        tk.Checkbutton(ocr_frame, text="Колонки по рамкам слов", variable=self.ocr_mode_var, onvalue='layout',
+                       offvalue='text').pack(side=tk.LEFT, padx=5)
+
+        capture_frame = tk.Frame(self.window)
+        capture_frame.pack(fill=tk.X, padx=10)
+
+        tk.Label(capture_frame, text="Прокрутка при съёмке экрана (щелчков, 0 — вручную):").pack(side=tk.LEFT, padx=5)
+        self.capture_scroll_var = tk.StringVar(value=str(self.settings.get('capture_scroll', 0)))
+        tk.Entry(capture_frame, textvariable=self.capture_scroll_var, width=6).pack(side=tk.LEFT, padx=5)
+
+        # Слияние повторов
+        aggregate_frame = tk.Frame(self.window)
+        aggregate_frame.pack(fill=tk.X, padx=10)
+
+        tk.Label(aggregate_frame, text="Повторы должности:").pack(side=tk.LEFT, padx=5)
+        self.aggregate_policy_var = tk.StringVar(value=self.settings.get('aggregate_policy', 'max'))
+        for text, value in (("Большее", 'max'), ("Сумма", 'sum'), ("Последнее", 'last')):
+            tk.Radiobutton(aggregate_frame, text=text, variable=self.aggregate_policy_var, value=value).pack(
+                side=tk.LEFT, padx=5)
+
+        # Кнопки
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        tk.Button(button_frame, text="Сохранить", command=self.save_settings).pack(side=tk.RIGHT, padx=5)
+        tk.Button(button_frame, text="Отмена", command=self.window.destroy).pack(side=tk.RIGHT, padx=5)
+
+    def save_settings(self):
+        try:
+            self.settings['command_delay'] = float(self.cmd_delay_var.get())
+            self.settings['enter_delay'] = float(self.enter_delay_var.get())
+            self.settings['adaptive_pacing'] = self.adaptive_pacing_var.get()
+            self.settings['input_method'] = self.input_method_var.get()
+            self.settings['http_url'] = self.http_url_var.get().strip()
+            self.settings['http_token'] = self.http_token_var.get().strip()
+            self.settings['http_concurrency'] = int(self.http_concurrency_var.get())
+            self.settings['http_batch_size'] = int(self.http_batch_size_var.get())
+            self.settings['use_ocr_cache'] = self.use_ocr_cache_var.get()
+            self.settings['ocr_mode'] = self.ocr_mode_var.get()
+            self.settings['capture_scroll'] = int(self.capture_scroll_var.get())
+            self.settings['aggregate_policy'] = self.aggregate_policy_var.get()
+            self.result = self.settings
+            self.window.destroy()
+        except ValueError:
+            messagebox.showerror("Ошибка", "Неверное числовое значение")
+
+
+class App:
+    def __init__(self, root):
+        self.root = root
         self.root.title("Генератор команд для должностей")
         self.root.geometry("1000x700")
 
         # Переменные
-        self.commands = []
+        # Команды всех игроков сессии; self.commands — показанное представление или очередь наблюдения
+        self.store = CommandStore()
+        self.commands = CommandView(self.store, array('I'))
+        self.players = []
+        # Игрок, к которому относится текст в поле правки
+        self.text_player = None
+        # Вставленный программой текст и команды, построенные по раскладке страницы
+        self.loaded_text = None
+        self.loaded_commands = []
+        self.watch_sent = set()
         self.execution_in_progress = False
         self.current_command_index = 0
+        self.executor = None
+        self.journal = None
+        self.watch_pipeline = None
+        self.capture = None
 
         # Настройки по умолчанию
         self.settings = {
             'command_delay': 1.0,
             'enter_delay': 0.5,
-            'input_method': 'clipboard'  # 'clipboard' или 'direct'
+            'input_method': 'clipboard',  # 'clipboard' или 'direct'
+            'use_ocr_cache': True,
+            'ocr_mode': 'layout',  # 'layout' (колонки по рамкам слов) или 'text'
+            'aggregate_policy': 'max',  # слияние повторов: 'max', 'sum' или 'last'
+            'adaptive_pacing': False,  # задержки по изменению консоли на экране
+            'capture_scroll': 0,  # щелчков прокрутки при съёмке экрана, 0 — прокручивают вручную
+            **HTTP_DELIVERY_DEFAULTS
         }
 
         # Элементы интерфейса
@@ -360,6 +4019,11 @@ class App:
 
         tk.Button(top_frame, text="Выбрать изображение", command=self.select_image).grid(row=0, column=2, padx=5)
         tk.Button(top_frame, text="Настройки", command=self.open_settings).grid(row=0, column=3, padx=5)
+        tk.Button(top_frame, text="Пакетная обработка", command=self.open_batch).grid(row=0, column=4, padx=5)
+        self.watch_button = tk.Button(top_frame, text="Следить за папкой", command=self.toggle_watch)
+        self.watch_button.grid(row=0, column=5, padx=5)
+        self.capture_button = tk.Button(top_frame, text="Снять с экрана", command=self.toggle_capture)
+        self.capture_button.grid(row=0, column=6, padx=5)
 
         # Путь к файлу
         self.image_path_var = tk.StringVar()
@@ -385,25 +4049,51 @@ class App:
         self.debug_text = scrolledtext.ScrolledText(debug_frame, height=10, width=80)
         self.debug_text.pack(fill=tk.BOTH, expand=True)
 
-        # Поле с командами
-        commands_frame = tk.LabelFrame(root, text="Сгенерированные команды", padx=5, pady=5)
+        # Правки текста и ника разбираются на лету, после паузы в наборе
+        self.text_parser = IncrementalParser()
+        self.live_parse_job = None
+        self.debug_text.bind('<<Modified>>', self.on_text_modified)
+
+        # Команды сессии: все игроки, фильтр по игроку и должности, порядок
+        commands_frame = tk.LabelFrame(root, text="Команды сессии", padx=5, pady=5)
         commands_frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
 
-        self.commands_listbox = tk.Listbox(commands_frame, height=10, width=80)
-        self.commands_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        filter_frame = tk.Frame(commands_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+
+        tk.Label(filter_frame, text="Игрок:").pack(side=tk.LEFT)
+        self.player_filter_var = tk.StringVar()
+        self.player_filter = ttk.Combobox(filter_frame, textvariable=self.player_filter_var, width=20,
+                                          postcommand=self.update_player_choices)
+        self.player_filter.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(filter_frame, text="Должность:").pack(side=tk.LEFT)
+        self.role_filter_var = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.role_filter_var, width=20).pack(side=tk.LEFT, padx=5)
 
-        scrollbar = tk.Scrollbar(commands_frame, orient=tk.VERTICAL)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tk.Label(filter_frame, text="Порядок:").pack(side=tk.LEFT)
+        self.sort_var = tk.StringVar(value=COMMAND_SORT_NAMES['player'])
+        ttk.Combobox(filter_frame, textvariable=self.sort_var, values=list(COMMAND_SORT_NAMES.values()),
+                     state='readonly', width=22).pack(side=tk.LEFT, padx=5)
 
-        self.commands_listbox.config(yscrollcommand=scrollbar.set)
-        scrollbar.config(command=self.commands_listbox.yview)
+        tk.Button(filter_frame, text="Очистить сессию", command=self.clear_session).pack(side=tk.RIGHT, padx=5)
+        tk.Button(filter_frame, text="Удалить игрока", command=self.remove_player).pack(side=tk.RIGHT, padx=5)
+
+        for variable in (self.player_filter_var, self.role_filter_var, self.sort_var):
+            variable.trace_add('write', lambda *args: self.apply_view(scroll_top=True))
+
+        # Слева игроки с числом отправленных команд, справа команды; рисуются только видимые строки
+        self.players_list = VirtualList(commands_frame, height=10, width=28, on_select=self.select_player)
+        self.players_list.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5))
+        self.commands_list = VirtualList(commands_frame, height=10, width=80)
+        self.commands_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # Нижняя панель с кнопками выполнения
         bottom_frame = tk.Frame(root)
         bottom_frame.pack(pady=10, padx=10, fill=tk.X)
 
         # Кнопки выполнения
-        self.execute_button = tk.Button(bottom_frame, text="Выполнить все команды", command=self.start_execution,
+        self.execute_button = tk.Button(bottom_frame, text="Выполнить команды списка", command=self.start_execution,
                                         bg="#FF9800", fg="white")
         self.execute_button.grid(row=0, column=0, padx=10)
 
@@ -411,8 +4101,10 @@ class App:
                                      bg="#F44336", fg="white")
         self.stop_button.grid(row=0, column=1, padx=5)
 
+        tk.Button(bottom_frame, text="Экспорт", command=self.export_commands).grid(row=0, column=3, padx=5)
+
         # Информация о настройках
-        input_method_text = "Буфер обмена" if self.settings['input_method'] == 'clipboard' else "Прямой ввод"
+        input_method_text = INPUT_METHOD_NAMES[self.settings['input_method']]
         self.info_label = tk.Label(bottom_frame, text=f"Способ ввода: {input_method_text}")
         self.info_label.grid(row=0, column=2, padx=10)
 
@@ -421,6 +4113,13 @@ class App:
         status_bar = tk.Label(root, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # Время этапов и счётчики текущего запуска
+        self.metrics_var = tk.StringVar()
+        tk.Label(root, textvariable=self.metrics_var, anchor=tk.W, fg="gray", wraplength=980, justify=tk.LEFT).pack(
+            side=tk.BOTTOM, fill=tk.X, padx=5)
+
+        self.root.after(DICTIONARY_POLL_MS, self.poll_dictionaries)
+
     def select_image(self):
         file_path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif")]
@@ -442,28 +4141,155 @@ class App:
 
         self.status_var.set("Обработка изображения...")
         self.root.update()
+        get_metrics().reset()
 
-        text, commands = process_image(image_path, nickname)
+        text, commands = process_image(image_path, nickname, self.settings['use_ocr_cache'],
+                                       self.settings['ocr_mode'])
 
         # Выводим распознанный текст в отладочное поле
-        self.debug_text.delete(1.0, tk.END)
-        self.debug_text.insert(tk.END, text)
+        commands = aggregate_commands(commands, self.settings['aggregate_policy'])
+        self.load_text(text, nickname, commands)
 
         if not commands:
             messagebox.showinfo("Информация", "Не удалось распознать команды на изображении")
             self.status_var.set("Готов к работе")
             return
 
-        self.commands = commands
+        count = self.set_player_commands(nickname, commands)
+
+        self.status_var.set(f"Сгенерировано команд для {nickname}: {count}")
+        self.metrics_var.set(get_metrics().summary())
+
+    def load_text(self, text, nickname, commands):
+        """Вставляет распознанный текст в поле правки вместе с командами, уже построенными по раскладке
+
+        <<Modified>> от вставки придёт после возврата из метода, и разбор
+        текста запустится всё равно, поэтому он узнаёт неизменённый текст
+        по loaded_text и берёт команды раскладки: разбор текста не знает
+        колонок и ошибается там, где раскладка читает время верно.
+        """
+        self.debug_text.delete(1.0, tk.END)
+        self.debug_text.insert(tk.END, text)
+        self.debug_text.edit_modified(False)
+        self.loaded_text = self.debug_text.get(1.0, tk.END)
+        self.loaded_commands = commands
+        self.text_player = nickname
+
+    def forget_loaded_text(self):
+        self.loaded_text = None
+        self.loaded_commands = []
+
+    def on_text_modified(self, event=None):
+        # Флаг изменения сбрасывается, иначе следующая правка не вызовет событие
+        self.debug_text.edit_modified(False)
+        self.schedule_live_parse()
+
+    def schedule_live_parse(self):
+        self.cancel_live_parse()
+        self.live_parse_job = self.root.after(LIVE_PARSE_DELAY_MS, self.live_parse)
+
+    def cancel_live_parse(self):
+        if self.live_parse_job:
+            self.root.after_cancel(self.live_parse_job)
+            self.live_parse_job = None
+
+    def live_parse(self):
+        """Разбор текста после правки: меняются только затронутые строки списка команд"""
+        self.live_parse_job = None
+        # Правки текста относятся к игроку, для которого он получен, а не к нику, набранному для следующего
+        nickname = self.text_player or self.nickname_entry.get().strip()
+        # Во время выполнения и наблюдения за папкой список команд занят
+        if not nickname or self.execution_in_progress or self.watch_pipeline:
+            return
+
+        text = self.debug_text.get(1.0, tk.END)
+        if text == self.loaded_text:
+            # Текст не меняли после распознавания (или вернули как было): команды раскладки точнее
+            if not self.loaded_commands:
+                # Ничего не распознано: прежние команды игрока в сессии не трогаем
+                return
+            commands = self.loaded_commands
+        else:
+            commands = self.text_parser.parse(text, nickname, self.settings['aggregate_policy'])
+        self.set_player_commands(nickname, commands)
+        self.status_var.set(f"Команд {nickname}: {len(commands)} (разобрано строк: {self.text_parser.parsed_lines})")
+
+    def set_player_commands(self, nickname, commands, renamed=()):
+        """Заменяет команды игрока (и игроков renamed) в сессии; текст в поле правки теперь относится к нему"""
+        count = self.store.replace_commands(commands, [nickname, *renamed])
+        self.text_player = nickname
+        # Фильтр по другому игроку переключаем, чтобы новые команды были видны
+        if self.player_filter_var.get().strip() not in ('', nickname):
+            self.player_filter_var.set(nickname)
+        else:
+            self.apply_view()
+        return count
+
+    def apply_view(self, scroll_top=False):
+        """Показывает команды сессии по фильтрам; во время выполнения список занят отправляемыми командами"""
+        if self.execution_in_progress:
+            return
+
+        self.store.compact()
+        order = next((key for key, name in COMMAND_SORT_NAMES.items() if name == self.sort_var.get()), 'player')
+        self.commands = CommandView(self.store, self.store.view(self.player_filter_var.get().strip(),
+                                                                self.role_filter_var.get().strip(), order))
+        self.commands_list.highlighted = None
+        if scroll_top:
+            self.commands_list.first = 0
+        self.commands_list.set_rows(len(self.commands), self.command_row)
+        self.update_players()
+
+    def command_row(self, position):
+        index = self.commands.record(position)
+        mark = " ✓" if self.store.status(index) == CommandStore.SENT else ""
+        return f"{position + 1}. {self.store.command(index)}{mark}"
+
+    def queue_row(self, position):
+        mark = " ✓" if position in self.watch_sent else ""
+        return f"{position + 1}. {self.commands[position]}{mark}"
+
+    def update_players(self):
+        self.players = self.store.players()
+        self.players_list.set_rows(len(self.players), lambda index: "{0}: {2}/{1}".format(*self.players[index]))
+
+    def update_player_choices(self):
+        self.player_filter['values'] = [''] + [nickname for nickname, total, sent in self.players]
+
+    def select_player(self, index):
+        self.player_filter_var.set(self.players[index][0])
+
+    def remove_player(self):
+        nickname = self.player_filter_var.get().strip()
+        if not nickname:
+            messagebox.showwarning("Предупреждение", "Выберите игрока в фильтре")
+            return
+
+        if self.execution_in_progress:
+            return
 
-        # Очищаем список и добавляем команды
-        self.commands_listbox.delete(0, tk.END)
-        for i, cmd in enumerate(self.commands, 1):
-            self.commands_listbox.insert(tk.END, f"{i}. {cmd}")
+        self.store.replace([], [nickname])
+        if self.text_player == nickname:
+            self.text_player = None
+            self.forget_loaded_text()
+        self.player_filter_var.set('')
+        self.status_var.set(f"Команды игрока {nickname} удалены")
 
-        self.status_var.set(f"Сгенерировано команд: {len(self.commands)}")
+    def clear_session(self):
+        if self.execution_in_progress or not len(self.store):
+            return
+
+        if not messagebox.askyesno("Очистить сессию", f"Удалить команды всех игроков ({len(self.store)})?"):
+            return
+
+        self.store.clear()
+        self.text_player = None
+        self.forget_loaded_text()
+        self.apply_view()
+        self.status_var.set("Готов к работе")
 
     def generate_from_text(self):
+        self.cancel_live_parse()
         nickname = self.nickname_entry.get().strip()
         text = self.debug_text.get(1.0, tk.END).strip()
 
@@ -475,39 +4301,148 @@ class App:
             messagebox.showwarning("Предупреждение", "Нет текста для обработки")
             return
 
+        # Ник поменяли после распознавания: команды текста можно перенести на новый ник
+        renamed = ()
+        if self.text_player and self.text_player != nickname and messagebox.askyesno(
+                "Другой игрок",
+                f"Текст получен для игрока {self.text_player}. Перенести его команды на {nickname}?\n\n"
+                f"Нет — команды {self.text_player} останутся в сессии"):
+            renamed = (self.text_player,)
+
         self.status_var.set("Обработка текста...")
         self.root.update()
+        get_metrics().reset()
 
-        self.commands = process_text(text, nickname)
+        self.forget_loaded_text()
+        count = self.set_player_commands(nickname, self.text_parser.parse(text, nickname,
+                                                                          self.settings['aggregate_policy']), renamed)
 
-        if not self.commands:
+        if not count:
             messagebox.showinfo("Информация", "Не удалось распознать команды в тексте")
             self.status_var.set("Готов к работе")
             return
 
-        # Очищаем список и добавляем команды
-        self.commands_listbox.delete(0, tk.END)
-        for i, cmd in enumerate(self.commands, 1):
-            self.commands_listbox.insert(tk.END, f"{i}. {cmd}")
+        self.status_var.set(f"Сгенерировано команд для {nickname}: {count}")
+        self.metrics_var.set(get_metrics().summary())
+
+    def export_commands(self):
+        if not self.commands:
+            messagebox.showwarning("Предупреждение", "Нет команд для экспорта")
+            return
+
+        file_path = filedialog.asksaveasfilename(
+            defaultextension='.sql',
+            filetypes=[("Скрипт PostgreSQL", "*.sql"), ("Скрипт команд", "*.txt")]
+        )
+        if not file_path:
+            return
+
+        export_format = 'sql' if file_path.lower().endswith('.sql') else 'script'
+        export = EXPORT_FORMATS[export_format]
+        try:
+            with open(file_path, 'w', encoding='utf-8') as output:
+                count = export(iter_command_entries(self.commands), output)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {e}")
+            return
 
-        self.status_var.set(f"Сгенерировано команд: {len(self.commands)}")
+        self.status_var.set(f"Экспортировано начислений: {count}")
 
     def open_settings(self):
         dialog = SettingsDialog(self.root, self.settings)
-        self.root.wait_window(dialog)
+        self.root.wait_window(dialog.window)
 
         if dialog.result:
             self.settings = dialog.result
-            input_method_text = "Буфер обмена" if self.settings['input_method'] == 'clipboard' else "Прямой ввод"
+            input_method_text = INPUT_METHOD_NAMES[self.settings['input_method']]
             self.info_label.config(text=f"Способ ввода: {input_method_text}")
 
+    def open_batch(self):
+        dialog = BatchDialog(self.root)
+        self.root.wait_window(dialog.window)
+
+        if not dialog.result:
+            return
+
+        try:
+            jobs = load_batch_jobs(dialog.result['source'])
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось прочитать манифест: {str(e)}")
+            return
+
+        if not jobs:
+            messagebox.showinfo("Информация", "Не найдено изображений для обработки")
+            return
+
+        self.batch_queue = queue.Queue()
+        self.status_var.set(f"Пакетная обработка: 0/{len(jobs)}")
+
+        def progress(done, total, report):
+            self.batch_queue.put(('progress', done, total))
+
+        def worker():
+            try:
+                reports = run_batch(jobs, dialog.result['output'],
+                                    report_path=os.path.splitext(dialog.result['output'])[0] + '.report.json',
+                                    workers=dialog.result['workers'], progress=progress,
+                                    use_cache=self.settings['use_ocr_cache'], mode=self.settings['ocr_mode'],
+                                    policy=self.settings['aggregate_policy'])
+                self.batch_queue.put(('done', reports))
+            except Exception as e:
+                self.batch_queue.put(('error', str(e)))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(100, self.poll_batch)
+
+    def poll_batch(self):
+        # Обновления из фонового потока обрабатываем только в потоке Tk
+        try:
+            while True:
+                event = self.batch_queue.get_nowait()
+                if event[0] == 'progress':
+                    self.status_var.set(f"Пакетная обработка: {event[1]}/{event[2]}")
+                elif event[0] == 'error':
+                    self.status_var.set("Готов к работе")
+                    messagebox.showerror("Ошибка", f"Пакетная обработка прервана: {event[1]}")
+                    return
+                else:
+                    self.finish_batch(event[1])
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_batch)
+
+    def finish_batch(self, reports):
+        # Команды игроков из пакета заменяют их прежние команды, остальные игроки сессии не меняются
+        count = self.store.replace_commands(command for report in reports for command in report['commands'])
+        self.apply_view()
+
+        failed = sum(1 for report in reports if report['error'])
+        self.status_var.set(f"Пакет: изображений {len(reports)}, ошибок {failed}, команд {count}")
+        messagebox.showinfo("Пакетная обработка",
+                            f"Обработано изображений: {len(reports)}\n"
+                            f"Ошибок: {failed}\n"
+                            f"Сгенерировано команд: {count}")
+
     def edit_roles(self):
-        # Здесь можно добавить диалог для редактирования должностей
-        messagebox.showinfo("Информация", "Функция редактирования должностей в разработке")
+        self.edit_dictionary('roles', "Должности", "Название должности (как в игре) = идентификатор трекера")
 
     def edit_time_units(self):
-        # Здесь можно добавить диалог для редактирования единиц времени
-        messagebox.showinfo("Информация", "Функция редактирования единиц времени в разработке")
+        self.edit_dictionary('time_units', "Единицы времени",
+                             "Единица (ч, м или с) = варианты написания через запятую")
+
+    def edit_dictionary(self, name, title, hint):
+        dialog = DictionaryDialog(self.root, name, title, hint)
+        self.root.wait_window(dialog.window)
+
+        if dialog.result:
+            self.status_var.set(f"Словарь сохранён: {dialog.result}")
+
+    def poll_dictionaries(self):
+        # Файлы словарей могли изменить вручную или из другой копии программы
+        if refresh_dictionaries():
+            self.status_var.set("Словари перезагружены")
+        self.root.after(DICTIONARY_POLL_MS, self.poll_dictionaries)
 
     def start_execution(self):
         if not self.commands:
@@ -517,77 +4452,304 @@ class App:
         if self.execution_in_progress:
             return
 
-        # Показываем инструкцию
+        # Если команды списка уже отправлялись в этой сессии или список был прерван, предлагаем продолжить
+        journal = ExecutionJournal(self.commands)
+        sent = {position for position in range(len(self.commands))
+                if self.store.status(self.commands.record(position)) == CommandStore.SENT}
+        if journal.resumable:
+            sent |= journal.sent
+        skip = ()
+        if sent:
+            answer = messagebox.askyesnocancel(
+                "Продолжить выполнение",
+                f"Из этого списка уже отправлено {len(sent)} из {len(self.commands)} команд.\n\n"
+                f"Да — отправить только неотправленные команды\nНет — выполнить все команды заново")
+            if answer is None:
+                return
+            if answer:
+                skip = sent
+                for position in skip:
+                    self.store.mark_sent(self.commands.record(position))
+
+        if not self.confirm_execution(f"Команды ({len(self.commands)})"):
+            return
+
+        try:
+            journal.begin(resume=bool(skip))
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть журнал выполнения: {e}")
+            return
+
+        # Начинаем выполнение
+        self.execution_in_progress = True
+        self.journal = journal
+        self.current_command_index = max(skip) + 1 if skip else 0
+        self.execute_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.status_var.set("Ожидание начала выполнения...")
+
+        # Команды отправляются в отдельном потоке, чтобы не блокировать интерфейс
+        self.execution_events = queue.Queue()
+        self.executor = CommandExecutor(self.commands, self.settings, self.execution_events,
+                                        start_delay=self.start_delay(), skip=skip, journal=journal)
+        self.executor.start()
+        self.root.after(EXECUTION_POLL_MS, self.poll_execution)
+
+    def save_metrics_report(self):
+        """Отчёт метрик запуска в папке данных приложения"""
+        reports_dir = os.path.join(APP_DATA_DIR, 'reports')
+        try:
+            os.makedirs(reports_dir, exist_ok=True)
+            write_metrics_report(get_metrics(),
+                                 os.path.join(reports_dir, f"run-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+        except OSError as e:
+            print(f"Не удалось сохранить отчёт метрик: {e}")
+
+    def confirm_execution(self, description):
+        """Показывает инструкцию; при отправке по HTTP переключаться в игру не нужно"""
+        if self.settings['input_method'] == 'http':
+            return messagebox.askokcancel("Выполнение команд",
+                                          f"{description} будут отправлены на {self.settings['http_url']}")
+
         input_method_text = "через буфер обмена (Ctrl+V)" if self.settings[
                                                                  'input_method'] == 'clipboard' else "прямым вводом"
         messagebox.showinfo("Выполнение команд",
                             f"1. Наведите курсор на командную строку\n"
                             f"2. Нажмите ОК\n"
-                            f"3. Все команды будут выполнены автоматически {input_method_text}")
+                            f"3. {description} будут выполнены автоматически {input_method_text}")
+        return True
+
+    def start_delay(self):
+        """Время, чтобы пользователь успел перейти в игру"""
+        return 0 if self.settings['input_method'] == 'http' else 1.0
+
+    def toggle_capture(self):
+        if self.capture:
+            # Поток дораспознает текущий кадр и пришлёт 'done'
+            self.capture.stop_event.set()
+            return
+
+        if self.execution_in_progress:
+            return
+
+        if not self.nickname_entry.get().strip():
+            messagebox.showwarning("Предупреждение", "Введите ник игрока")
+            return
+
+        # Окно программы не должно закрывать выделяемый список
+        self.root.withdraw()
+        dialog = RegionDialog(self.root)
+        self.root.wait_window(dialog.window)
+        self.root.deiconify()
+        if not dialog.result:
+            return
+
+        get_metrics().reset()
+        self.capture_events = queue.Queue()
+        self.capture = ScrollCapture(dialog.result, self.capture_events,
+                                     options={'scroll_clicks': self.settings['capture_scroll']}).start()
+        self.capture_button.config(text="Остановить съёмку")
+        self.status_var.set("Съёмка: прокручивайте список до конца")
+        self.root.after(EXECUTION_POLL_MS, self.poll_capture)
+
+    def poll_capture(self):
+        done = False
+        try:
+            while True:
+                event = self.capture_events.get_nowait()
+                if event[0] == 'frame':
+                    self.status_var.set(f"Кадр {event[1]}: новых строк {event[2]}, всего {len(self.capture.rows)}")
+                elif event[0] == 'error':
+                    messagebox.showerror("Ошибка", f"Съёмка прервана: {event[1]}")
+                elif event[0] == 'done':
+                    done = True
+        except queue.Empty:
+            pass
+
+        if not done:
+            self.root.after(EXECUTION_POLL_MS, self.poll_capture)
+            return
+
+        capture, self.capture = self.capture, None
+        capture.stop()
+        self.capture_button.config(text="Снять с экрана")
+
+        # Склеенные строки попадают в поле правки, команды строятся по самим строкам
+        nickname = self.nickname_entry.get().strip()
+        commands = aggregate_commands(process_rows(capture.rows, nickname), self.settings['aggregate_policy'])
+        self.load_text(rows_to_text(capture.rows), nickname, commands)
+        if not commands:
+            self.status_var.set(f"Съёмка: строк {len(capture.rows)}, команды не распознаны")
+            return
+        count = self.set_player_commands(nickname, commands)
+
+        self.status_var.set(f"Съёмка: строк {len(capture.rows)}, команд {count}")
+        self.metrics_var.set(get_metrics().summary())
+
+    def toggle_watch(self):
+        if self.watch_pipeline:
+            self.stop_execution()
+            return
+
+        if self.execution_in_progress:
+            return
+
+        directory = filedialog.askdirectory(title="Папка, куда сохраняются скриншоты")
+        if not directory:
+            return
+
+        if not self.confirm_execution("Команды из новых скриншотов"):
+            return
+
+        # Очередь ещё пуста, поэтому журнал наблюдения привязан к папке; каждая сессия — новый запуск
+        commands = CommandQueue()
+        journal = ExecutionJournal(commands, key=f"watch:{os.path.abspath(directory)}")
+        try:
+            journal.begin()
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть журнал выполнения: {e}")
+            return
+
+        # Команды новых скриншотов дописываются в живую очередь, а исполнитель отправляет их по мере поступления
+        get_metrics().reset()
+        self.commands = commands
+        self.watch_sent = set()
+        self.commands_list.highlighted = None
+        self.commands_list.set_rows(0, self.queue_row)
+        self.watch_events = queue.Queue()
+        self.watch_pipeline = WatchPipeline(directory, self.commands, self.watch_events,
+                                            nickname=self.nickname_entry.get().strip() or None,
+                                            use_cache=self.settings['use_ocr_cache'], mode=self.settings['ocr_mode'],
+                                            policy=self.settings['aggregate_policy']).start()
 
-        # Начинаем выполнение
         self.execution_in_progress = True
+        self.journal = journal
         self.current_command_index = 0
         self.execute_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
-        self.status_var.set("Ожидание начала выполнения...")
+        self.watch_button.config(text="Остановить наблюдение")
+        self.status_var.set(f"Наблюдение за папкой {directory}")
 
-        # Запускаем выполнение в отдельном потоке, чтобы не блокировать интерфейс
-        self.root.after(1000, self.execute_all_commands)
+        self.execution_events = queue.Queue()
+        self.executor = CommandExecutor(self.commands, self.settings, self.execution_events,
+                                        start_delay=self.start_delay(), journal=journal)
+        self.executor.start()
+        self.root.after(EXECUTION_POLL_MS, self.poll_execution)
+        self.root.after(EXECUTION_POLL_MS, self.poll_watch)
 
-    def execute_all_commands(self):
-        if not self.execution_in_progress:
+    def poll_watch(self):
+        if not self.watch_pipeline:
             return
 
-        # Выполняем команды по очереди
-        for i, cmd in enumerate(self.commands):
-            if not self.execution_in_progress:
-                break
-
-            # Обновляем статус
-            self.status_var.set(f"Выполнение команды {i + 1}/{len(self.commands)}: {cmd}")
-            self.commands_listbox.selection_clear(0, tk.END)
-            self.commands_listbox.selection_set(i)
-            self.commands_listbox.see(i)
-            self.root.update()
+        try:
+            while True:
+                event = self.watch_events.get_nowait()
+                name = os.path.basename(event[1])
+                if event[0] == 'image':
+                    self.status_var.set(f"Распознан {name}: команд {event[2]}")
+                else:
+                    self.status_var.set(f"Ошибка {name}: {event[2]}")
+        except queue.Empty:
+            pass
 
-            # Выбираем способ ввода
-            if self.settings['input_method'] == 'clipboard':
-                # Копируем команду в буфер обмена
-                pyperclip.copy(cmd)
+        # Команды, появившиеся с прошлого опроса, увеличивают длину списка; рисуются только видимые
+        if len(self.commands) != self.commands_list.count:
+            self.commands_list.set_rows(len(self.commands), self.queue_row)
 
-                # Небольшая задержка для надежности
-                time.sleep(0.1)
+        self.root.after(EXECUTION_POLL_MS, self.poll_watch)
 
-                # Вставляем из буфера обмена (Ctrl+V)
-                pyautogui.hotkey('ctrl', 'v')
-            else:
-                # Прямой ввод команды
-                pyautogui.write(cmd)
+    def poll_execution(self):
+        # Из очереди забираем всё накопленное, а интерфейс обновляем один раз за опрос
+        progress = None
+        finished = None
+        sent = False
+        try:
+            while True:
+                event = self.execution_events.get_nowait()
+                if event[0] == 'progress':
+                    progress = event[1]
+                elif event[0] == 'sent':
+                    # По HTTP пачки подтверждаются не по порядку
+                    self.current_command_index = max(self.current_command_index, event[1] + 1)
+                    if isinstance(self.commands, CommandQueue):
+                        self.watch_sent.add(event[1])
+                    else:
+                        self.store.mark_sent(self.commands.record(event[1]))
+                    sent = True
+                elif event[0] == 'error':
+                    finished = event
+                    break
+                else:
+                    finished = event
+        except queue.Empty:
+            pass
 
-            # Задержка перед нажатием Enter
-            time.sleep(self.settings['enter_delay'])
+        if progress is not None:
+            self.metrics_var.set(get_metrics().summary())
+            self.status_var.set(f"Выполнение команды {progress + 1}/{len(self.commands)}: {self.commands[progress]}")
+            self.commands_list.highlight(progress)
+        elif sent:
+            self.commands_list.refresh()
+        if sent and not isinstance(self.commands, CommandQueue):
+            self.update_players()
 
-            # Нажимаем Enter
-            pyautogui.press('enter')
+        if finished is None:
+            self.root.after(EXECUTION_POLL_MS, self.poll_execution)
+            return
 
-            # Задержка между командами
-            time.sleep(self.settings['command_delay'])
+        # Считаем до finish_execution: он заменяет список представлением сессии
+        total = len(self.commands)
+        if isinstance(self.commands, CommandQueue):
+            sent = len(self.watch_sent)
+        else:
+            sent = sum(self.store.status(index) == CommandStore.SENT for index in self.commands.indices)
 
-        # Завершение выполнения
-        self.stop_execution()
-        messagebox.showinfo("Завершено", "Все команды выполнены!")
+        self.finish_execution()
+        if finished[0] == 'error':
+            messagebox.showerror("Ошибка", f"Выполнение прервано: {finished[1]}")
+        elif finished[1]:
+            self.status_var.set(f"Выполнение остановлено: отправлено {sent}/{total}")
+        else:
+            self.status_var.set(f"Выполнено команд: {total}")
+            messagebox.showinfo("Завершено", "Все команды выполнены!")
 
     def stop_execution(self):
+        if self.watch_pipeline:
+            # Поток распознавания может дорабатывать текущее изображение, интерфейс его не ждёт
+            threading.Thread(target=self.watch_pipeline.stop, daemon=True).start()
+        if self.execution_in_progress:
+            self.executor.stop()
+            self.stop_button.config(state=tk.DISABLED)
+            self.status_var.set("Остановка...")
+
+    def finish_execution(self):
         self.execution_in_progress = False
-        self.current_command_index = 0
+        self.executor = None
+        self.metrics_var.set(get_metrics().summary())
+        self.save_metrics_report()
+
+        if self.watch_pipeline:
+            if not self.watch_pipeline.stop_event.is_set():
+                threading.Thread(target=self.watch_pipeline.stop, daemon=True).start()
+            self.watch_pipeline = None
+            self.watch_button.config(text="Следить за папкой")
+
+        if isinstance(self.commands, CommandQueue):
+            # Команды наблюдения остаются в сессии вместе с отметками об отправке
+            entries = [parse_command(command) for command in self.commands]
+            self.store.replace(entries)
+            first = len(self.store) - len(entries)
+            for position in self.watch_sent:
+                self.store.mark_sent(first + position)
+        # Фильтры могли поменять во время выполнения
+        self.apply_view()
 
         self.execute_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.status_var.set("Выполнение остановлено")
 
 
-if __name__ == "__main__":
+def run_gui():
+    """Запуск графического интерфейса"""
     # Настройка Tesseract
     if not setup_tesseract():
         messagebox.showerror(
@@ -598,20 +4760,659 @@ if __name__ == "__main__":
             "2. Установите программу\n"
             "3. Перезапустите это приложение"
         )
-        exit(1)
+        sys.exit(1)
 
     # Устанавливаем pyperclip, если не установлен
     try:
-        import pyperclip
+        importlib.import_module('pyperclip')
     except ImportError:
         import subprocess
-        import sys
 
         messagebox.showinfo("Установка зависимости",
                             "Устанавливаем библиотеку pyperclip для работы с буфером обмена...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "pyperclip"])
-        import pyperclip
 
     root = tk.Tk()
-    app = App(root)
-    root.mainloop()
\ No newline at end of file
+    App(root)
+    root.mainloop()
+
+
+def _open_output(path, stdout):
+    """Файл для записи результата или стандартный вывод"""
+    if not path or path == '-':
+        return contextlib.nullcontext(stdout)
+    return open(path, 'w', encoding='utf-8')
+
+
+def _require_tesseract():
+    """Проверяет Tesseract перед распознаванием из командной строки"""
+    try:
+        # Движков столько, сколько полос большого изображения распознаётся одновременно
+        found = setup_tesseract(TILE_OPTIONS['workers'])
+    except ImportError as e:
+        raise SystemExit(f"Не установлена зависимость для распознавания: {e.name}")
+    if not found:
+        raise SystemExit("Tesseract OCR не установлен или не найден")
+
+
+def cli_parse(args):
+    """Команды из готового текста"""
+    if args.input == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding='utf-8') as f:
+            text = f.read()
+
+    with _open_output(args.output, args.stdout) as output:
+        for command in aggregate_commands(process_text(text, args.nick), args.aggregate):
+            output.write(command + '\n')
+    return 0
+
+
+def cli_ocr(args):
+    """Распознавание скриншотов одного игрока"""
+    _require_tesseract()
+
+    with _open_output(args.output, args.stdout) as output:
+        # Скриншоты одного игрока часто перекрываются, поэтому команды сливаются по всем изображениям
+        commands = []
+        for image_path in args.images:
+            text, image_commands = ocr_image(image_path, args.nick, not args.no_cache, args.mode)
+            if args.text:
+                output.write(text)
+            commands.extend(image_commands)
+
+        if not args.text:
+            for command in aggregate_commands(commands, args.aggregate):
+                output.write(command + '\n')
+    return 0
+
+
+def _parse_region(value):
+    """Область экрана из строки «x,y,ширина,высота»"""
+    try:
+        left, top, width, height = (int(part) for part in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается x,y,ширина,высота: {value}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"пустая область: {value}")
+    return left, top, width, height
+
+
+def _frame_reader(paths):
+    """Источник кадров из файлов снимков: по кадру на вызов, затем None"""
+    frames = iter(paths)
+
+    def read():
+        path = next(frames, None)
+        return Image.open(path).convert('RGB') if path else None
+
+    return read
+
+
+def cli_capture(args):
+    """Распознавание списка с экрана (или из серии снимков) со склейкой кадров при прокрутке"""
+    _require_tesseract()
+
+    grab = _frame_reader(args.images) if args.images else None
+    options = {'interval': args.interval if not args.images else 0, 'scroll_clicks': args.scroll}
+    events = queue.Queue()
+    capture = ScrollCapture(args.region, events, grab=grab, options=options, max_frames=args.max_frames).start()
+    if args.region:
+        print(f"Съёмка области {args.region} (Ctrl+C — закончить)")
+
+    try:
+        while True:
+            event = events.get()
+            if event[0] == 'frame':
+                print(f"кадр {event[1]}: новых строк {event[2]}")
+            elif event[0] == 'error':
+                print(f"ошибка: {event[1]}")
+            elif event[0] == 'done':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.stop()
+
+    with _open_output(args.output, args.stdout) as output:
+        if args.text:
+            output.write(rows_to_text(capture.rows))
+        else:
+            for command in aggregate_commands(process_rows(capture.rows, args.nick), args.aggregate):
+                output.write(command + '\n')
+    return 0
+
+
+def cli_batch(args):
+    """Пакетная обработка по манифесту или папке"""
+    _require_tesseract()
+
+    jobs = load_batch_jobs(args.source)
+    if not jobs:
+        print("Не найдено изображений для обработки")
+        return 1
+
+    def progress(done, total, report):
+        status = f"ошибка: {report['error']}" if report['error'] else f"команд: {len(report['commands'])}"
+        print(f"[{done}/{total}] {report['nickname']} {report['image']} — {status}")
+
+    report_path = args.report or os.path.splitext(args.output)[0] + '.report.json'
+    reports = run_batch(jobs, args.output, report_path=report_path, workers=args.jobs, progress=progress,
+                        use_cache=not args.no_cache, mode=args.mode, policy=args.aggregate)
+    return 1 if any(report['error'] for report in reports) else 0
+
+
+def cli_watch(args):
+    """Распознавание новых скриншотов из папки по мере их появления"""
+    _require_tesseract()
+
+    commands = CommandQueue()
+    events = queue.Queue()
+    pipeline = WatchPipeline(args.directory, commands, events, nickname=args.nick, use_cache=not args.no_cache,
+                             mode=args.mode, policy=args.aggregate).start()
+
+    executor = journal = None
+    if args.url:
+        settings = dict(HTTP_DELIVERY_DEFAULTS, input_method='http', http_url=args.url, http_token=args.token,
+                        http_concurrency=args.concurrency, http_batch_size=args.batch_size)
+        # Как и в интерфейсе: журнал привязан к папке, каждая сессия наблюдения — новый запуск
+        journal = ExecutionJournal(commands, key=f"watch:{os.path.abspath(args.directory)}")
+        journal.begin()
+        executor = CommandExecutor(commands, settings, queue.Queue(), start_delay=0, journal=journal)
+        executor.start()
+
+    print(f"Наблюдение за папкой {args.directory} (Ctrl+C — остановить)")
+    written = 0
+    with _open_output(None if args.url else args.output, args.stdout) as output:
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if event[0] == 'image':
+                    print(f"{event[1]}: команд {event[2]}")
+                else:
+                    print(f"{event[1]}: ошибка: {event[2]}")
+
+                if not args.url:
+                    for index in range(written, len(commands)):
+                        output.write(commands[index] + '\n')
+                    written = len(commands)
+                    output.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pipeline.stop()
+            if executor:
+                # Уже распознанные команды досылаются
+                executor.join()
+                print(f"Отправлено команд: {len(journal.sent)}/{len(commands)} (журнал {journal.path})")
+    return 0
+
+
+def cli_send(args):
+    """Отправка готовых команд на административный HTTP-эндпоинт"""
+    with open(args.input, encoding='utf-8') as f:
+        commands = [line.strip() for line in f if line.strip()]
+
+    settings = dict(HTTP_DELIVERY_DEFAULTS, input_method='http', http_url=args.url, http_token=args.token,
+                    http_concurrency=args.concurrency, http_batch_size=args.batch_size, http_retries=args.retries)
+    journal = ExecutionJournal(commands)
+    skip = set(journal.sent) if args.resume and journal.resumable else set()
+    if skip:
+        print(f"Продолжение по журналу: уже отправлено {len(skip)}/{len(commands)}")
+    journal.begin(resume=bool(skip))
+
+    events = queue.Queue()
+    executor = CommandExecutor(commands, settings, events, start_delay=0, skip=skip, journal=journal)
+
+    started = time.perf_counter()
+    executor.start()
+    sent = len(skip)
+    try:
+        while True:
+            event = events.get()
+            if event[0] == 'sent':
+                sent += 1
+            elif event[0] == 'error':
+                print(f"Ошибка отправки: {event[1]} (отправлено {sent}/{len(commands)})")
+                return 1
+            elif event[0] == 'finished':
+                break
+    except KeyboardInterrupt:
+        # Паузы между повторами прерываются сразу; запрос без ответа не ждём до конца таймаута —
+        # подтверждённые команды уже в журнале, и продолжение с --resume их пропустит
+        executor.stop()
+        executor.join(STOP_JOIN_TIMEOUT)
+        journal.close()
+        print(f"Отправка прервана (отправлено {len(journal.sent)}/{len(commands)}, журнал {journal.path}); "
+              f"продолжить: --resume")
+        return 1
+
+    elapsed = time.perf_counter() - started
+    print(f"Отправлено команд: {sent} за {elapsed:.2f} с")
+    return 0
+
+
+def cli_mock_server(args):
+    """Локальный имитатор административного эндпоинта"""
+    server = MockAdminServer(args.host, args.port, args.token, args.fail_rate, args.delay)
+    print(f"Имитатор сервера слушает {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+    print(f"Принято команд: {len(server.commands)}, запросов: {server.requests}, повторов: {server.duplicates}, "
+          f"соединений: {server.connections}")
+    if args.output:
+        with _open_output(args.output, args.stdout) as output:
+            for command in server.commands:
+                output.write(command + '\n')
+    return 0
+
+
+def cli_export(args):
+    """Экспорт файла команд в скрипт SQL или скрипт консоли"""
+    export = EXPORT_FORMATS[args.format]
+    source = contextlib.nullcontext(sys.stdin) if args.input == '-' else open(args.input, encoding='utf-8')
+
+    with source as lines, _open_output(args.output, args.stdout) as output:
+        count = export(iter_command_entries(lines), output)
+
+    print(f"Экспортировано начислений: {count}")
+    return 0
+
+
+def cli_migrate(args):
+    """Перенос времени напрямую между базами SQLite без распознавания"""
+    for path in (args.source, args.target):
+        if not os.path.exists(path):
+            print(f"Файл базы не найден: {path}")
+            return 1
+
+    def progress(stats):
+        print(f"Прочитано: {stats['read']}, добавлено: {stats['inserted']}, обновлено: {stats['updated']}")
+
+    started = time.perf_counter()
+    try:
+        stats = migrate_playtime(args.source, args.target, args.merge, args.chunk_size, args.all_trackers,
+                                 args.dry_run, progress if args.verbose else None)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Ошибка переноса: {e}")
+        return 1
+
+    mode = " (пробный запуск, база не изменена)" if args.dry_run else ""
+    print(f"Перенос завершён за {time.perf_counter() - started:.2f} с{mode}: прочитано {stats['read']}, "
+          f"пропущено {stats['skipped']}, добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+          f"без изменений {stats['unchanged']}")
+    return 0
+
+
+def cli_bench(args):
+    """Бенчмарк распознавания и разбора на синтетических таблицах с известным эталоном"""
+    fonts = None
+    if not args.parse_only:
+        _require_tesseract()
+        fonts = load_bench_fonts(args.font)
+        if not fonts:
+            print("Не найден шрифт с кириллицей: укажите его через --font")
+            return 1
+
+    config = {'count': args.count, 'seed': args.seed, 'mode': 'parse' if args.parse_only else args.mode,
+              'rows_per_image': args.rows, 'text_noise': args.text_noise}
+    if args.corpus:
+        os.makedirs(args.corpus, exist_ok=True)
+
+    samples = synthetic_corpus(args.count, args.seed, fonts, args.rows, args.text_noise)
+    result = run_benchmark(samples, args.mode, args.parse_only, args.corpus)
+    result['config'] = config
+
+    args.stdout.write(f"режим {result['mode']}: {result['images']} изобр., {result['rows']} строк за {result['seconds']} с "
+                      f"({result['images_per_sec']} изобр./с, {result['rows_per_sec']} строк/с)\n")
+    args.stdout.write(f"точность {result['precision']:.2%}, полнота {result['recall']:.2%} "
+                      f"({result['correct']} верных из {result['found']} найденных)\n")
+    for name, span in result['spans'].items():
+        args.stdout.write(f"  {name:<12}{span['mean_ms']:>10.2f} мс  p95 {span['p95_ms']:.2f} мс  × {span['count']}\n")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('config') != config:
+        print(f"Параметры эталона отличаются: {baseline.get('config')}")
+    regressions = compare_with_baseline(result, baseline, args.tolerance, args.max_slowdown)
+    for regression in regressions:
+        args.stdout.write(f"РЕГРЕССИЯ {regression}\n")
+    return 1 if regressions else 0
+
+
+def _parsed_rows(text):
+    """Множество пар (должность, секунды), распознанных в тексте"""
+    return {tuple(command.split()[2:]) for command in process_text(text, '-')}
+
+
+def cli_bench_preprocess(args):
+    """Сравнение вариантов предобработки по скорости и точности распознавания"""
+    if args.ocr:
+        _require_tesseract()
+
+    images = []
+    for image_path in args.images:
+        image = Image.open(image_path)
+        image.load()
+        images.append((image_path, image))
+
+    variants = [
+        ('legacy', preprocess_image_legacy, dict(PREPROCESS_OPTIONS, threshold=150)),
+        ('numpy', preprocess_image, PREPROCESS_OPTIONS),
+        ('numpy-adaptive', preprocess_image, dict(PREPROCESS_OPTIONS, threshold='adaptive')),
+    ]
+
+    args.stdout.write(f"{'вариант':<16}{'мс/изобр.':>12}{'строк':>8}{'верно':>8}{'эталон':>8}\n")
+    for name, function, options in variants:
+        elapsed = 0.0
+        rows = correct = expected = 0
+        for image_path, image in images:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                processed = function(image, options)
+                elapsed += time.perf_counter() - started
+
+            if not args.ocr:
+                continue
+
+            found = _parsed_rows(get_ocr_backend().image_to_string(processed))
+            rows += len(found)
+
+            # Эталон: текст "должность время" в файле <изображение>.gt.txt
+            truth_path = os.path.splitext(image_path)[0] + '.gt.txt'
+            if os.path.exists(truth_path):
+                with open(truth_path, encoding='utf-8') as f:
+                    truth = _parsed_rows(f.read())
+                correct += len(truth & found)
+                expected += len(truth)
+
+        milliseconds = elapsed * 1000 / (len(images) * args.repeat)
+        args.stdout.write(f"{name:<16}{milliseconds:>12.1f}{rows:>8}{correct:>8}{expected:>8}\n")
+    return 0
+
+
+# Строки на границах форматов: пробелы, слитные числа, неизвестные единицы, одни цифры
+TIME_EDGE_CASES = (
+    "164 40m", "164 40ч", "164 40с", "164 40", "16ч4м", "80h16м", "164ч", "1234", "12", "", "  ",
+    "166ч 40м", "5 x", "0ч", "12ч30мин 5с", "12 ч 30 м", "1ч2", "ч30м", "12:30", "1.5ч", "٣ч ٤م",
+)
+
+
+def cli_bench_time(args):
+    """Сверка и скорость разбора строк таблицы: split_time_line против прежнего поиска и разбора времени"""
+    rng = random.Random(args.seed)
+    roles = sorted(ROLE_TRANSLATION)
+    strings = [_bench_time_string(rng, rng.randint(1, 300 * 60) * 60) for _ in range(args.count)]
+    strings.extend(TIME_EDGE_CASES)
+    lines = [f"{rng.choice(roles).capitalize()} {time_str}" for time_str in strings]
+    lines.extend(TIME_EDGE_CASES)
+
+    # Должность не сверяется: прежняя замена вырезала из строки ещё и повторы времени ("75:75ч")
+    mismatches = []
+    for time_str in strings:
+        expected, found = time_to_seconds_legacy(time_str), time_to_seconds(time_str)
+        if expected != found:
+            mismatches.append((time_str, expected, found))
+    for line in lines:
+        expected, found = split_time_line_legacy(line), split_time_line(line)
+        if (expected and expected[1:]) != (found and found[1:]):
+            mismatches.append((line, expected, found))
+    for text, expected, found in mismatches[:20]:
+        args.stdout.write(f"РАСХОЖДЕНИЕ {text!r}: прежний разбор {expected}, новый {found}\n")
+
+    # Время process_text на строку без поиска должности в словаре, одинакового для обоих вариантов
+    timings = {}
+    for name, function in (('legacy', split_time_line_legacy), ('tokenizer', split_time_line)):
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for line in lines:
+                function(line)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        args.stdout.write(f"{name:<12}{best * 1e6 / len(lines):>8.2f} мкс/строку\n")
+
+    args.stdout.write(f"ускорение ×{timings['legacy'] / timings['tokenizer']:.2f}, "
+                      f"строк {len(lines)}, расхождений {len(mismatches)}\n")
+    return 1 if mismatches else 0
+
+
+def cli_dictionaries(args):
+    """Где ищутся словари, что загружено; --init записывает текущие словари в файлы"""
+    for name in DICTIONARY_NAMES:
+        table = ROLE_TRANSLATION if name == 'roles' else TIME_UNITS
+        path = dictionary_path(name)
+        if args.init and not path:
+            path = save_dictionary(name, table)
+            table = ROLE_TRANSLATION if name == 'roles' else TIME_UNITS
+        args.stdout.write(f"{name}: {path or 'встроенный'} (записей {len(table)})\n")
+    args.stdout.write(f"Папка словарей: {_dictionary_dir}\n")
+    return 0
+
+
+def _add_aggregate_argument(parser):
+    parser.add_argument('--aggregate', choices=AGGREGATE_POLICIES + ('none',), default='max',
+                        help="слияние повторов должности: max, sum, last или none (без слияния)")
+
+
+def build_arg_parser():
+    """Аргументы командной строки"""
+    parser = argparse.ArgumentParser(
+        prog='time.py',
+        description="Генератор команд playtime_addrole. Без аргументов запускается графический интерфейс.")
+    parser.add_argument('--metrics', metavar='FILE', help="сохранить время этапов и счётчики в JSON или CSV")
+    parser.add_argument('--profile', metavar='FILE', help="записать профиль cProfile (смотреть через pstats)")
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help=f"лимит памяти на изображение: большие обрабатываются полосами "
+                             f"(по умолчанию {TILE_OPTIONS['memory_limit'] // 2 ** 20}, 0 — всегда целиком)")
+    parser.add_argument('--tile-workers', type=int, metavar='N', help="полос, распознаваемых одновременно")
+    parser.add_argument('--dictionaries', metavar='DIR',
+                        help=f"папка словарей roles и time_units (.json/.yaml), по умолчанию {DICTIONARY_DIR}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help="команды из распознанного текста")
+    parse_parser.add_argument('input', help="файл с текстом или - для stdin")
+    parse_parser.add_argument('--nick', required=True, help="ник игрока")
+    parse_parser.add_argument('-o', '--output', help="файл команд (по умолчанию stdout)")
+    _add_aggregate_argument(parse_parser)
+    parse_parser.set_defaults(handler=cli_parse)
+
+    ocr_parser = subparsers.add_parser('ocr', help="команды из скриншотов одного игрока")
+    ocr_parser.add_argument('images', nargs='+', help="пути к изображениям")
+    ocr_parser.add_argument('--nick', required=True, help="ник игрока")
+    ocr_parser.add_argument('-o', '--output', help="файл команд (по умолчанию stdout)")
+    ocr_parser.add_argument('--text', action='store_true', help="вывести распознанный текст вместо команд")
+    ocr_parser.add_argument('--no-cache', action='store_true', help="не использовать кэш распознавания")
+    ocr_parser.add_argument('--mode', choices=('layout', 'text'), default='layout',
+                            help="layout — строки по рамкам слов, text — сплошной текст")
+    _add_aggregate_argument(ocr_parser)
+    ocr_parser.set_defaults(handler=cli_ocr)
+
+    batch_parser = subparsers.add_parser('batch', help="пакетная обработка манифеста или папки")
+    batch_parser.add_argument('source', help="манифест CSV/JSON или папка <ник>/<скриншоты>")
+    batch_parser.add_argument('-o', '--output', required=True, help="общий файл команд")
+    batch_parser.add_argument('--report', help="файл отчёта JSON (по умолчанию рядом с файлом команд)")
+    batch_parser.add_argument('-j', '--jobs', type=int, help="число процессов (по умолчанию все ядра)")
+    batch_parser.add_argument('--no-cache', action='store_true', help="не использовать кэш распознавания")
+    batch_parser.add_argument('--mode', choices=('layout', 'text'), default='layout',
+                              help="layout — строки по рамкам слов, text — сплошной текст")
+    _add_aggregate_argument(batch_parser)
+    batch_parser.set_defaults(handler=cli_batch)
+
+    watch_parser = subparsers.add_parser('watch', help="распознавать новые скриншоты из папки по мере появления")
+    watch_parser.add_argument('directory', help="папка вида <папка>/<ник>/<скриншоты>")
+    watch_parser.add_argument('--nick', help="ник для скриншотов в корне папки")
+    watch_parser.add_argument('-o', '--output', help="файл команд (по умолчанию stdout)")
+    watch_parser.add_argument('--url', help="сразу отправлять команды на административный эндпоинт")
+    watch_parser.add_argument('--token', default='', help="токен администратора")
+    watch_parser.add_argument('-c', '--concurrency', type=int, default=HTTP_DELIVERY_DEFAULTS['http_concurrency'],
+                              help="число одновременных соединений")
+    watch_parser.add_argument('--batch-size', type=int, default=HTTP_DELIVERY_DEFAULTS['http_batch_size'],
+                              help="команд в одном запросе")
+    watch_parser.add_argument('--no-cache', action='store_true', help="не использовать кэш распознавания")
+    watch_parser.add_argument('--mode', choices=('layout', 'text'), default='layout',
+                              help="layout — строки по рамкам слов, text — сплошной текст")
+    _add_aggregate_argument(watch_parser)
+    watch_parser.set_defaults(handler=cli_watch)
+
+    capture_parser = subparsers.add_parser('capture', help="распознать список прямо с экрана, склеивая кадры прокрутки")
+    capture_source = capture_parser.add_mutually_exclusive_group(required=True)
+    capture_source.add_argument('--region', type=_parse_region, help="область экрана x,y,ширина,высота")
+    capture_source.add_argument('--images', nargs='+', help="вместо экрана — снимки прокрутки по порядку")
+    capture_parser.add_argument('--nick', required=True, help="ник игрока")
+    capture_parser.add_argument('-o', '--output', help="файл команд (по умолчанию stdout)")
+    capture_parser.add_argument('--text', action='store_true', help="вывести склеенный текст вместо команд")
+    capture_parser.add_argument('--scroll', type=int, default=CAPTURE_OPTIONS['scroll_clicks'],
+                                help="прокручивать список колесом мыши на столько щелчков (0 — вручную)")
+    capture_parser.add_argument('--interval', type=float, default=CAPTURE_OPTIONS['interval'],
+                                help="пауза между снимками (сек)")
+    capture_parser.add_argument('--max-frames', type=int, help="остановиться после стольких кадров")
+    _add_aggregate_argument(capture_parser)
+    capture_parser.set_defaults(handler=cli_capture)
+
+    send_parser = subparsers.add_parser('send', help="отправить команды на административный HTTP-эндпоинт")
+    send_parser.add_argument('input', help="файл команд, по одной в строке")
+    send_parser.add_argument('--url', required=True, help="адрес эндпоинта")
+    send_parser.add_argument('--token', default='', help="токен администратора")
+    send_parser.add_argument('-c', '--concurrency', type=int, default=HTTP_DELIVERY_DEFAULTS['http_concurrency'],
+                             help="число одновременных соединений")
+    send_parser.add_argument('--batch-size', type=int, default=HTTP_DELIVERY_DEFAULTS['http_batch_size'],
+                             help="команд в одном запросе")
+    send_parser.add_argument('--retries', type=int, default=HTTP_DELIVERY_DEFAULTS['http_retries'],
+                             help="повторов при временных ошибках")
+    send_parser.add_argument('--resume', action='store_true',
+                             help="продолжить прерванную отправку этого файла по журналу")
+    send_parser.set_defaults(handler=cli_send)
+
+    mock_parser = subparsers.add_parser('mock-server', help="локальный имитатор административного эндпоинта")
+    mock_parser.add_argument('--host', default='127.0.0.1', help="адрес для прослушивания")
+    mock_parser.add_argument('--port', type=int, default=1212, help="порт")
+    mock_parser.add_argument('--token', default='', help="ожидаемый токен")
+    mock_parser.add_argument('--fail-rate', type=float, default=0.0, help="доля запросов с ответом 503")
+    mock_parser.add_argument('--delay', type=float, default=0.0, help="задержка ответа в секундах")
+    mock_parser.add_argument('-o', '--output', help="сохранить принятые команды в файл после остановки")
+    mock_parser.set_defaults(handler=cli_mock_server)
+
+    export_parser = subparsers.add_parser('export', help="экспортировать файл команд в SQL или скрипт консоли")
+    export_parser.add_argument('input', help="файл команд или - для stdin")
+    export_parser.add_argument('-f', '--format', choices=tuple(EXPORT_FORMATS), default='sql',
+                               help="sql — пакетный upsert PostgreSQL, script — команды консоли")
+    export_parser.add_argument('-o', '--output', help="файл результата (по умолчанию stdout)")
+    export_parser.set_defaults(handler=cli_export)
+
+    migrate_parser = subparsers.add_parser('migrate', help="перенести время напрямую из базы SQLite другого сервера")
+    migrate_parser.add_argument('source', help="база SQLite исходного сервера")
+    migrate_parser.add_argument('target', help="база SQLite целевого сервера")
+    migrate_parser.add_argument('--merge', choices=MERGE_POLICIES, default='max',
+                                help="max — большее из значений, add — сумма с уже существующим временем")
+    migrate_parser.add_argument('--chunk-size', type=int, default=MIGRATION_CHUNK_SIZE,
+                                help="строк в одной транзакции")
+    migrate_parser.add_argument('--all-trackers', action='store_true',
+                                help="переносить все трекеры, а не только должности из словаря")
+    migrate_parser.add_argument('--dry-run', action='store_true', help="только посчитать изменения")
+    migrate_parser.add_argument('-v', '--verbose', action='store_true', help="печатать ход переноса")
+    migrate_parser.set_defaults(handler=cli_migrate)
+
+    synthetic_parser = subparsers.add_parser('bench', help="бенчмарк на синтетических таблицах с эталоном")
+    synthetic_parser.add_argument('--count', type=int, default=40, help="число изображений")
+    synthetic_parser.add_argument('--rows', type=int, default=BENCH_ROWS_PER_IMAGE, help="строк в таблице")
+    synthetic_parser.add_argument('--seed', type=int, default=0, help="зерно генератора корпуса")
+    synthetic_parser.add_argument('--mode', choices=('layout', 'text'), default='layout',
+                                  help="layout — строки по рамкам слов, text — сплошной текст")
+    synthetic_parser.add_argument('--parse-only', action='store_true',
+                                  help="без распознавания: разбирать текст эталона (Tesseract не нужен)")
+    synthetic_parser.add_argument('--text-noise', type=float, default=0.0,
+                                  help="доля букв, заменяемых похожими латинскими (для --parse-only)")
+    synthetic_parser.add_argument('--font', action='append', help="шрифт TTF с кириллицей (можно несколько)")
+    synthetic_parser.add_argument('--corpus', help="сохранить изображения и эталон <имя>.gt.txt в папку")
+    synthetic_parser.add_argument('-o', '--output', help="сохранить результат в JSON (можно взять как эталон)")
+    synthetic_parser.add_argument('--baseline', help="JSON прошлого результата: при регрессии код возврата 1")
+    synthetic_parser.add_argument('--tolerance', type=float, default=0.005, help="допустимое падение точности")
+    synthetic_parser.add_argument('--max-slowdown', type=float, default=0.3, help="допустимое замедление (доля)")
+    synthetic_parser.set_defaults(handler=cli_bench)
+
+    bench_parser = subparsers.add_parser('bench-preprocess', help="сравнить варианты предобработки изображений")
+    bench_parser.add_argument('images', nargs='+', help="пути к изображениям (эталон — <имя>.gt.txt рядом)")
+    bench_parser.add_argument('--repeat', type=int, default=5, help="повторов на изображение")
+    bench_parser.add_argument('--ocr', action='store_true', help="также распознать и сравнить с эталоном")
+    bench_parser.set_defaults(handler=cli_bench_preprocess)
+
+    time_parser = subparsers.add_parser('bench-time', help="сверить и сравнить по скорости разбор строк времени")
+    time_parser.add_argument('--count', type=int, default=100000, help="число синтетических строк")
+    time_parser.add_argument('--seed', type=int, default=0, help="зерно генератора строк")
+    time_parser.add_argument('--repeat', type=int, default=3, help="повторов замера (берётся лучший)")
+    time_parser.set_defaults(handler=cli_bench_time)
+
+    dictionaries_parser = subparsers.add_parser('dictionaries', help="показать и проверить словари должностей и единиц")
+    dictionaries_parser.add_argument('--init', action='store_true',
+                                     help="записать встроенные словари в файлы для правки (существующие не трогаются)")
+    dictionaries_parser.set_defaults(handler=cli_dictionaries)
+
+    return parser
+
+
+def cli_main(argv):
+    """Точка входа командной строки"""
+    args = build_arg_parser().parse_args(argv)
+    args.stdout = sys.stdout
+    if getattr(args, 'aggregate', None) == 'none':
+        args.aggregate = None
+
+    if args.memory_limit is not None:
+        TILE_OPTIONS['memory_limit'] = args.memory_limit * 2 ** 20
+    if args.tile_workers:
+        TILE_OPTIONS['workers'] = args.tile_workers
+
+    # Ошибка в файле словаря в командной строке — повод остановиться, а не взять встроенный
+    if args.dictionaries:
+        set_dictionary_dir(args.dictionaries)
+    try:
+        load_dictionaries()
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Ошибка словаря: {e}")
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Диагностика process_text идёт в stderr, чтобы stdout содержал только результат
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            return args.handler(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.metrics:
+            write_metrics_report(get_metrics(), args.metrics)
+
+
+if __name__ == "__main__":
+    # Нужно для пула процессов в собранном exe
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
+
+    run_gui()
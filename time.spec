@@ -6,7 +6,33 @@ a = Analysis(
     pathex=[],
     binaries=[('C:\\Program Files\\Tesseract-OCR\\tesseract.exe', '.')],
     datas=[('C:\\Program Files\\Tesseract-OCR\\tessdata', 'tessdata')],
-    hiddenimports=['pytesseract'],
+    # Модули импортируются лениво по имени, поэтому перечисляем их явно
+    hiddenimports=[
+        'pytesseract',
+        'PIL.Image',
+        'PIL.ImageEnhance',
+        'PIL.ImageFilter',
+        'pyautogui',
+        'pyperclip',
+        'tkinter',
+        'tkinter.filedialog',
+        'tkinter.messagebox',
+        'tkinter.scrolledtext',
+        'tkinter.ttk',
+        'tkinter.simpledialog',
+        'tkinter.font',
+        'tesserocr',
+        'numpy',
+        'PIL.ImageOps',
+        'PIL.ImageChops',
+        'PIL.ImageDraw',
+        'PIL.ImageFont',
+        'http.client',
+        'http.server',
+        'urllib.parse',
+        'sqlite3',
+        'yaml',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],